@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+"""
+Task Scheduler Benchmark
+
+Compares the heap and timing wheel scheduler backends with 10^4 to 10^6
+pending tasks spread over a day: scheduling them, cancelling and moving 10%
+of them, and draining the queue by stepping a simulated clock one second at a
+time. Runs in memory, without a database or a running scheduler loop.
+
+Usage:
+    python -m minute_empire.benchmarks.scheduler_benchmark [size ...]
+"""
+
+import sys
+import time
+import random
+import asyncio
+import logging
+from datetime import datetime, timedelta
+
+from minute_empire.services.task_scheduler import TaskScheduler
+
+DEFAULT_SIZES = [10_000, 100_000, 1_000_000]
+BACKENDS = ["heap", "wheel"]
+SPREAD_SECONDS = 24 * 60 * 60
+
+async def noop():
+    """Callback of the benchmark tasks, never run"""
+
+async def run(backend: str, size: int, seed: int = 42) -> dict:
+    """Time each operation on one backend; returns microseconds per task"""
+    rng = random.Random(seed)
+    scheduler = TaskScheduler(durable=False, backend=backend)
+    now = datetime.utcnow()
+    times = [now + timedelta(seconds=rng.uniform(0, SPREAD_SECONDS)) for _ in range(size)]
+    task_ids = [f"task-{i}" for i in range(size)]
+    sample = rng.sample(task_ids, size // 10)
+
+    start = time.perf_counter()
+    for task_id, execution_time in zip(task_ids, times):
+        await scheduler.schedule_task(task_id, execution_time, noop)
+    schedule_s = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for task_id in sample:
+        await scheduler.cancel_task(task_id)
+    cancel_s = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for task_id in sample:
+        await scheduler.schedule_task(task_id, now + timedelta(seconds=rng.uniform(0, SPREAD_SECONDS)), noop)
+    move_s = time.perf_counter() - start
+
+    # Drain the queue itself, one simulated second at a time
+    queue = scheduler.queue
+    clock = time.monotonic()
+    drained = 0
+    start = time.perf_counter()
+    for second in range(SPREAD_SECONDS + 2):
+        queue.peek()
+        drained += len(queue.pop_due(clock + second))
+    drain_s = time.perf_counter() - start
+    await scheduler.stop()
+
+    assert drained == size, f"{backend} drained {drained} of {size} tasks"
+    return {
+        "schedule": schedule_s / size * 1e6,
+        "cancel": cancel_s / len(sample) * 1e6,
+        "move": move_s / len(sample) * 1e6,
+        "drain": drain_s / size * 1e6,
+    }
+
+async def main():
+    """Run every backend at every size and print a table."""
+    logging.getLogger("minute_empire.services.task_scheduler").setLevel(logging.WARNING)
+    sizes = [int(arg) for arg in sys.argv[1:]] or DEFAULT_SIZES
+
+    print("\n=== Task Scheduler Benchmark (µs per task) ===")
+    print(f"\n{'backend':<8} {'tasks':>10} {'schedule':>10} {'cancel':>10} {'move':>10} {'drain':>10}")
+    for size in sizes:
+        for backend in BACKENDS:
+            result = await run(backend, size)
+            print(f"{backend:<8} {size:>10} {result['schedule']:>10.2f} {result['cancel']:>10.2f} "
+                  f"{result['move']:>10.2f} {result['drain']:>10.2f}")
+
+if __name__ == "__main__":
+    asyncio.run(main())
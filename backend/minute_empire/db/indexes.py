@@ -0,0 +1,115 @@
+"""
+Declarative index registry for all collections.
+
+Every query issued by the repositories should be backed by one of the indexes
+declared here. `ensure_indexes()` is applied at startup and is idempotent:
+existing indexes are left untouched, and indexes whose definition changed are
+migrated (dropped and recreated) in place.
+"""
+
+import logging
+from typing import Dict, List, Any
+from pymongo import ASCENDING, DESCENDING, IndexModel
+from pymongo.errors import OperationFailure
+
+from minute_empire.db.mongodb import get_db
+from minute_empire.repositories.village_repository import VillageRepository
+from minute_empire.repositories.troops_repository import TroopsRepository
+from minute_empire.repositories.troop_action_repository import TroopActionRepository
+from minute_empire.repositories.user_repository import UserRepository
+from minute_empire.repositories.task_history_repository import TaskHistoryRepository
+from minute_empire.repositories.scheduled_task_repository import ScheduledTaskRepository
+
+logger = logging.getLogger(__name__)
+
+# MongoDB error codes for an index that exists with a different definition
+INDEX_OPTIONS_CONFLICT = 85
+INDEX_KEY_SPECS_CONFLICT = 86
+DUPLICATE_KEY = 11000
+
+INDEXES: Dict[str, List[IndexModel]] = {
+    VillageRepository.COLLECTION: [
+        # find_by_location / get_by_location; unique so two registrations can't claim the same tile
+        IndexModel([("location.x", ASCENDING), ("location.y", ASCENDING)],
+                   name="location_unique", unique=True),
+        # get_by_owner / iter_by_owner
+        IndexModel([("owner_id", ASCENDING)], name="owner_id"),
+        # iter_with_pending_tasks ($or over both task arrays, each branch needs its own index)
+        IndexModel([("construction_tasks.processed", ASCENDING)], name="construction_tasks_processed"),
+        IndexModel([("troop_training_tasks.processed", ASCENDING)], name="troop_training_tasks_processed"),
+    ],
+    TroopsRepository.COLLECTION: [
+        # get_troops_at_location
+        IndexModel([("location.x", ASCENDING), ("location.y", ASCENDING)], name="location"),
+        # get_by_home / iter_by_home
+        IndexModel([("home_id", ASCENDING)], name="home_id"),
+    ],
+    TroopActionRepository.COLLECTION: [
+        # iter_all_active / get_pending_actions
+        IndexModel([("processed", ASCENDING), ("completion_time", ASCENDING)],
+                   name="processed_completion_time"),
+        # get_active_actions_for_troop
+        IndexModel([("troop_id", ASCENDING), ("processed", ASCENDING)], name="troop_id_processed"),
+    ],
+    UserRepository.COLLECTION: [
+        # get_by_username; unique so concurrent registrations can't share a username
+        IndexModel([("username", ASCENDING)], name="username_unique", unique=True),
+    ],
+    TaskHistoryRepository.COLLECTION: [
+        # get_by_village, newest first
+        IndexModel([("village_id", ASCENDING), ("completion_time", DESCENDING)],
+                   name="village_id_completion_time"),
+    ],
+    ScheduledTaskRepository.COLLECTION: [
+        # get_due_page, keyset paging in due order
+        IndexModel([("due_at", ASCENDING), ("_id", ASCENDING)], name="due_at_id"),
+    ],
+}
+
+async def _drop_conflicting_index(collection, index: IndexModel) -> None:
+    """Drop the existing index that clashes with the given definition (same name or same keys)"""
+    wanted = index.document
+    existing = await collection.index_information()
+    for name, info in existing.items():
+        if name == "_id_":
+            continue
+        same_keys = [tuple(key) for key in info.get("key", [])] == list(wanted["key"].items())
+        if name == wanted["name"] or same_keys:
+            logger.info(f"Dropping outdated index {collection.name}.{name}")
+            await collection.drop_index(name)
+
+async def ensure_indexes() -> Dict[str, Any]:
+    """
+    Create every index in the registry, migrating indexes whose definition changed.
+
+    Returns:
+        Dict with the indexes that were applied and any errors encountered
+    """
+    result = {"applied": [], "errors": []}
+
+    async with get_db() as db:
+        for collection_name, indexes in INDEXES.items():
+            collection = db[collection_name]
+            for index in indexes:
+                name = index.document["name"]
+                try:
+                    try:
+                        await collection.create_indexes([index])
+                    except OperationFailure as e:
+                        if e.code not in (INDEX_OPTIONS_CONFLICT, INDEX_KEY_SPECS_CONFLICT):
+                            raise
+                        # The index exists with an older definition, replace it
+                        await _drop_conflicting_index(collection, index)
+                        await collection.create_indexes([index])
+                    result["applied"].append(f"{collection_name}.{name}")
+                except OperationFailure as e:
+                    if e.code == DUPLICATE_KEY:
+                        error_msg = (f"Cannot create unique index {collection_name}.{name}: "
+                                     f"existing documents contain duplicates ({str(e)})")
+                    else:
+                        error_msg = f"Error creating index {collection_name}.{name}: {str(e)}"
+                    logger.error(error_msg)
+                    result["errors"].append(error_msg)
+
+    logger.info(f"Applied {len(result['applied'])} indexes")
+    return result
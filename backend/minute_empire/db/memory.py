@@ -0,0 +1,586 @@
+"""
+In-memory stand-in for the Motor client, selected with DATABASE_BACKEND=memory.
+
+It implements the subset of the Motor API that the repositories use, so they
+run unchanged against it: find / find_one cursors (batch_size, skip, limit,
+sort, to_list, async iteration, projections), insert, update, delete and
+bulk_write with the pymongo result types, unique indexes, and no-op sessions.
+
+Queries support dotted paths into embedded documents and arrays, $or / $and /
+$nor and the $eq, $ne, $in, $nin, $gt, $gte, $lt, $lte, $exists and $elemMatch
+operators. Updates support $set, $setOnInsert, $unset, $inc, $push (with $each),
+$pull and $addToSet, including positional `$[identifier]` paths with array_filters.
+
+Documents are deep-copied on the way in and out, like a round trip through
+BSON, so callers never share state with the store. Transactions are accepted
+but not isolated: every write is applied immediately.
+"""
+
+import copy
+from contextlib import asynccontextmanager
+from typing import Dict, List, Optional, Any, Tuple, Iterator
+from bson import ObjectId
+from pymongo import ASCENDING, DeleteOne, DeleteMany, InsertOne, UpdateOne, UpdateMany, ReplaceOne
+from pymongo.errors import DuplicateKeyError, OperationFailure
+from pymongo.results import BulkWriteResult, DeleteResult, InsertOneResult, InsertManyResult, UpdateResult
+
+_MISSING = object()
+
+def _resolve(document: Any, path: str) -> List[Any]:
+    """Get every value at a dotted path, descending into arrays like MongoDB does"""
+    values = [document]
+    for part in path.split("."):
+        found = []
+        for value in values:
+            if isinstance(value, dict):
+                if part in value:
+                    found.append(value[part])
+            elif isinstance(value, list):
+                if part.isdigit():
+                    if int(part) < len(value):
+                        found.append(value[int(part)])
+                else:
+                    found.extend(item[part] for item in value if isinstance(item, dict) and part in item)
+        values = found
+    return values
+
+def _candidates(values: List[Any]) -> List[Any]:
+    """Values to compare against a condition: the values themselves plus the elements of array values"""
+    candidates = list(values)
+    for value in values:
+        if isinstance(value, list):
+            candidates.extend(value)
+    return candidates
+
+def _compare(values: List[Any], check) -> bool:
+    for value in _candidates(values):
+        try:
+            if value is not None and check(value):
+                return True
+        except TypeError:
+            continue
+    return False
+
+def _equals(values: List[Any], expected: Any) -> bool:
+    if not values:
+        return expected is None
+    return any(value == expected for value in _candidates(values))
+
+def _match_condition(values: List[Any], condition: Any) -> bool:
+    """Check the values found at a path against a query condition"""
+    if not (isinstance(condition, dict) and condition and all(key.startswith("$") for key in condition)):
+        return _equals(values, condition)
+
+    for operator, operand in condition.items():
+        if operator == "$eq":
+            matched = _equals(values, operand)
+        elif operator == "$ne":
+            matched = not _equals(values, operand)
+        elif operator == "$in":
+            matched = any(_equals(values, option) for option in operand)
+        elif operator == "$nin":
+            matched = not any(_equals(values, option) for option in operand)
+        elif operator == "$gt":
+            matched = _compare(values, lambda value: value > operand)
+        elif operator == "$gte":
+            matched = _compare(values, lambda value: value >= operand)
+        elif operator == "$lt":
+            matched = _compare(values, lambda value: value < operand)
+        elif operator == "$lte":
+            matched = _compare(values, lambda value: value <= operand)
+        elif operator == "$exists":
+            matched = bool(values) == bool(operand)
+        elif operator == "$elemMatch":
+            matched = any(
+                matches(item, operand) if isinstance(item, dict) else _match_condition([item], operand)
+                for value in values if isinstance(value, list) for item in value
+            )
+        else:
+            raise OperationFailure(f"Unsupported query operator in memory backend: {operator}")
+        if not matched:
+            return False
+    return True
+
+def matches(document: Dict[str, Any], query: Optional[Dict[str, Any]]) -> bool:
+    """Check whether a document matches a MongoDB query"""
+    for key, condition in (query or {}).items():
+        if key == "$or":
+            if not any(matches(document, clause) for clause in condition):
+                return False
+        elif key == "$and":
+            if not all(matches(document, clause) for clause in condition):
+                return False
+        elif key == "$nor":
+            if any(matches(document, clause) for clause in condition):
+                return False
+        elif not _match_condition(_resolve(document, key), condition):
+            return False
+    return True
+
+def _project(document: Dict[str, Any], projection: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    """Apply an inclusion or exclusion projection to a copy of a document"""
+    if not projection:
+        return copy.deepcopy(document)
+    fields = {key: value for key, value in projection.items() if key != "_id"}
+    include_id = projection.get("_id", 1)
+
+    if fields and all(fields.values()):
+        projected = {}
+        if include_id and "_id" in document:
+            projected["_id"] = document["_id"]
+        for path in fields:
+            source, target = document, projected
+            parts = path.split(".")
+            for part in parts[:-1]:
+                source = source.get(part) if isinstance(source, dict) else None
+                if not isinstance(source, dict):
+                    break
+                target = target.setdefault(part, {})
+            else:
+                if isinstance(source, dict) and parts[-1] in source:
+                    target[parts[-1]] = source[parts[-1]]
+        return copy.deepcopy(projected)
+
+    projected = copy.deepcopy(document)
+    for path in fields:
+        _unset_path(projected, path.split("."))
+    if not include_id:
+        projected.pop("_id", None)
+    return projected
+
+def _sort_key(value: Any) -> Tuple[int, Any]:
+    """Order missing values and None first, like MongoDB"""
+    return (0, 0) if value is _MISSING or value is None else (1, value)
+
+# --- Update operators ---
+
+def _array_filter_matches(element: Any, identifier: str, array_filters: List[Dict[str, Any]]) -> bool:
+    """Check an array element against the array filters of one $[identifier]"""
+    for array_filter in array_filters:
+        for key, condition in array_filter.items():
+            head, _, rest = key.partition(".")
+            if head != identifier:
+                continue
+            if rest:
+                if not (isinstance(element, dict) and matches(element, {rest: condition})):
+                    return False
+            elif not _match_condition([element], condition):
+                return False
+    return True
+
+def _targets(container: Any, parts: List[str], array_filters: List[Dict[str, Any]],
+             create: bool) -> Iterator[Tuple[Any, Any]]:
+    """Yield (parent, key) pairs for every location a dotted update path addresses"""
+    part, rest = parts[0], parts[1:]
+
+    if isinstance(container, list):
+        if part.startswith("$[") and part.endswith("]"):
+            identifier = part[2:-1]
+            keys = [
+                index for index, element in enumerate(container)
+                if not identifier or _array_filter_matches(element, identifier, array_filters)
+            ]
+        elif part.isdigit():
+            keys = [int(part)]
+        else:
+            raise OperationFailure(f"Cannot address array element with '{part}'")
+    elif isinstance(container, dict):
+        keys = [part]
+    else:
+        return
+
+    for key in keys:
+        if not rest:
+            yield container, key
+            continue
+        child = container[key] if (isinstance(container, dict) and key in container) or (
+            isinstance(container, list) and key < len(container)) else _MISSING
+        if child is _MISSING or child is None:
+            if not create:
+                continue
+            child = {}
+            container[key] = child
+        yield from _targets(child, rest, array_filters, create)
+
+def _get(parent: Any, key: Any, default: Any = _MISSING) -> Any:
+    if isinstance(parent, dict):
+        return parent.get(key, default)
+    return parent[key] if key < len(parent) else default
+
+def _unset_path(document: Dict[str, Any], parts: List[str]) -> None:
+    for parent, key in list(_targets(document, parts, [], create=False)):
+        if isinstance(parent, dict):
+            parent.pop(key, None)
+        elif key < len(parent):
+            parent[key] = None
+
+def _pull_matches(element: Any, condition: Any) -> bool:
+    if isinstance(condition, dict) and isinstance(element, dict) and not all(
+            key.startswith("$") for key in condition):
+        return matches(element, condition)
+    return _match_condition([element], condition)
+
+def apply_update(document: Dict[str, Any], update: Dict[str, Any],
+                 array_filters: Optional[List[Dict[str, Any]]] = None, inserting: bool = False) -> None:
+    """Apply MongoDB update operators to a document in place ($setOnInsert only when inserting)"""
+    array_filters = array_filters or []
+    for operator, fields in update.items():
+        if operator == "$setOnInsert":
+            if not inserting:
+                continue
+            operator = "$set"
+        for path, operand in fields.items():
+            parts = path.split(".")
+            if operator == "$unset":
+                _unset_path(document, parts)
+                continue
+            for parent, key in list(_targets(document, parts, array_filters, create=True)):
+                current = _get(parent, key)
+                if operator == "$set":
+                    parent[key] = copy.deepcopy(operand)
+                elif operator == "$inc":
+                    parent[key] = (0 if current is _MISSING or current is None else current) + operand
+                elif operator in ("$push", "$addToSet"):
+                    items = operand["$each"] if isinstance(operand, dict) and "$each" in operand else [operand]
+                    array = [] if current is _MISSING or current is None else current
+                    for item in copy.deepcopy(items):
+                        if operator == "$push" or item not in array:
+                            array.append(item)
+                    parent[key] = array
+                elif operator == "$pull":
+                    if isinstance(current, list):
+                        parent[key] = [element for element in current if not _pull_matches(element, operand)]
+                else:
+                    raise OperationFailure(f"Unsupported update operator in memory backend: {operator}")
+
+# --- Motor-like API ---
+
+class MemoryCursor:
+    """Cursor over a snapshot of the matching documents"""
+
+    def __init__(self, collection: "MemoryCollection", query: Optional[Dict[str, Any]],
+                 projection: Optional[Dict[str, Any]]):
+        self._collection = collection
+        self._query = query or {}
+        self._projection = projection
+        self._skip = 0
+        self._limit = 0
+        self._sort: List[Tuple[str, int]] = []
+        self._results: Optional[Iterator[Dict[str, Any]]] = None
+
+    def batch_size(self, size: int) -> "MemoryCursor":
+        return self
+
+    def skip(self, count: int) -> "MemoryCursor":
+        self._skip = count
+        return self
+
+    def limit(self, count: int) -> "MemoryCursor":
+        self._limit = count
+        return self
+
+    def sort(self, key_or_list: Any, direction: int = ASCENDING) -> "MemoryCursor":
+        self._sort = [(key_or_list, direction)] if isinstance(key_or_list, str) else list(key_or_list)
+        return self
+
+    def _documents(self) -> Iterator[Dict[str, Any]]:
+        documents = [document for document in self._collection._scan(self._query)]
+        for key, direction in reversed(self._sort):
+            documents.sort(
+                key=lambda document: _sort_key(next(iter(_resolve(document, key)), _MISSING)),
+                reverse=direction < 0
+            )
+        documents = documents[self._skip:]
+        if self._limit:
+            documents = documents[:self._limit]
+        return (_project(document, self._projection) for document in documents)
+
+    def __aiter__(self) -> "MemoryCursor":
+        return self
+
+    async def __anext__(self) -> Dict[str, Any]:
+        if self._results is None:
+            self._results = self._documents()
+        try:
+            return next(self._results)
+        except StopIteration:
+            raise StopAsyncIteration
+
+    async def to_list(self, length: Optional[int] = None) -> List[Dict[str, Any]]:
+        results = []
+        async for document in self:
+            results.append(document)
+            if length and len(results) >= length:
+                break
+        return results
+
+class MemoryCollection:
+    """A collection of documents keyed by _id"""
+
+    def __init__(self, database: "MemoryDatabase", name: str):
+        self.database = database
+        self.name = name
+        self._documents: Dict[Any, Dict[str, Any]] = {}
+        self._indexes: Dict[str, Dict[str, Any]] = {"_id_": {"key": [("_id", ASCENDING)], "unique": True}}
+        # Unique index name -> {index key: _id}, _id itself is the key of _documents
+        self._unique: Dict[str, Dict[Tuple[str, ...], Any]] = {}
+
+    # Reads
+
+    def _scan(self, query: Dict[str, Any]) -> Iterator[Dict[str, Any]]:
+        """Yield the stored documents matching a query (not copies)"""
+        document_id = query.get("_id", _MISSING)
+        if document_id is not _MISSING and not isinstance(document_id, dict):
+            document = self._documents.get(document_id)
+            if document is not None and matches(document, query):
+                yield document
+            return
+        for document in list(self._documents.values()):
+            if matches(document, query):
+                yield document
+
+    def find(self, filter: Optional[Dict[str, Any]] = None, projection: Optional[Dict[str, Any]] = None,
+             **kwargs) -> MemoryCursor:
+        return MemoryCursor(self, filter, projection)
+
+    async def find_one(self, filter: Optional[Dict[str, Any]] = None,
+                       projection: Optional[Dict[str, Any]] = None, **kwargs) -> Optional[Dict[str, Any]]:
+        document = next(self._scan(filter or {}), None)
+        return None if document is None else _project(document, projection)
+
+    async def count_documents(self, filter: Dict[str, Any], **kwargs) -> int:
+        return sum(1 for _ in self._scan(filter))
+
+    # Writes
+
+    def _unique_keys(self, document: Dict[str, Any]) -> Dict[str, Tuple[str, ...]]:
+        """Key of the document in every unique index"""
+        return {
+            name: tuple(repr(next(iter(_resolve(document, field)), None)) for field, _ in self._indexes[name]["key"])
+            for name in self._unique
+        }
+
+    def _check_unique(self, document: Dict[str, Any], ignore_id: Any = _MISSING) -> None:
+        """Raise DuplicateKeyError if the document collides with another one on a unique index"""
+        for name, key in self._unique_keys(document).items():
+            owner = self._unique[name].get(key, _MISSING)
+            if owner is not _MISSING and owner != ignore_id:
+                raise DuplicateKeyError(
+                    f"E11000 duplicate key error collection: {self.name} index: {name}",
+                    code=11000
+                )
+
+    def _index_document(self, document: Dict[str, Any], add: bool) -> None:
+        for name, key in self._unique_keys(document).items():
+            if add:
+                self._unique[name][key] = document["_id"]
+            else:
+                self._unique[name].pop(key, None)
+
+    def _insert(self, document: Dict[str, Any]) -> Any:
+        document = copy.deepcopy(document)
+        document.setdefault("_id", ObjectId())
+        if document["_id"] in self._documents:
+            raise DuplicateKeyError(
+                f"E11000 duplicate key error collection: {self.name} index: _id_", code=11000
+            )
+        self._check_unique(document)
+        self._documents[document["_id"]] = document
+        self._index_document(document, add=True)
+        return document["_id"]
+
+    def _update(self, filter: Dict[str, Any], update: Dict[str, Any], many: bool,
+                array_filters: Optional[List[Dict[str, Any]]] = None, upsert: bool = False,
+                replace: bool = False) -> Tuple[int, int, Any]:
+        """Apply an update to the matching documents; returns (matched, modified, upserted id)"""
+        targets = list(self._scan(filter))
+        if not many:
+            targets = targets[:1]
+
+        modified = 0
+        for document in targets:
+            updated = copy.deepcopy(document)
+            if replace:
+                updated = dict(copy.deepcopy(update), _id=document["_id"])
+            else:
+                apply_update(updated, update, array_filters)
+            if updated == document:
+                continue
+            self._check_unique(updated, ignore_id=document["_id"])
+            self._index_document(document, add=False)
+            self._documents[document["_id"]] = updated
+            self._index_document(updated, add=True)
+            modified += 1
+
+        upserted_id = None
+        if not targets and upsert:
+            seed = {key: value for key, value in filter.items()
+                    if not key.startswith("$") and not isinstance(value, dict)}
+            if replace:
+                seed.update(update)
+            else:
+                apply_update(seed, update, array_filters, inserting=True)
+            upserted_id = self._insert(seed)
+        return len(targets), modified, upserted_id
+
+    def _delete(self, filter: Dict[str, Any], many: bool) -> int:
+        targets = list(self._scan(filter))
+        if not many:
+            targets = targets[:1]
+        for document in targets:
+            del self._documents[document["_id"]]
+            self._index_document(document, add=False)
+        return len(targets)
+
+    async def insert_one(self, document: Dict[str, Any], **kwargs) -> InsertOneResult:
+        inserted_id = self._insert(document)
+        # Like pymongo, report the generated _id on the caller's document
+        document.setdefault("_id", inserted_id)
+        return InsertOneResult(inserted_id, True)
+
+    async def insert_many(self, documents: List[Dict[str, Any]], **kwargs) -> InsertManyResult:
+        inserted_ids = []
+        for document in documents:
+            inserted_ids.append(self._insert(document))
+            document.setdefault("_id", inserted_ids[-1])
+        return InsertManyResult(inserted_ids, True)
+
+    async def update_one(self, filter: Dict[str, Any], update: Dict[str, Any], upsert: bool = False,
+                         array_filters: Optional[List[Dict[str, Any]]] = None, **kwargs) -> UpdateResult:
+        matched, modified, upserted_id = self._update(filter, update, False, array_filters, upsert)
+        raw = {"n": matched or int(upserted_id is not None), "nModified": modified}
+        if upserted_id is not None:
+            raw["upserted"] = upserted_id
+        return UpdateResult(raw, True)
+
+    async def update_many(self, filter: Dict[str, Any], update: Dict[str, Any], upsert: bool = False,
+                          array_filters: Optional[List[Dict[str, Any]]] = None, **kwargs) -> UpdateResult:
+        matched, modified, upserted_id = self._update(filter, update, True, array_filters, upsert)
+        raw = {"n": matched or int(upserted_id is not None), "nModified": modified}
+        if upserted_id is not None:
+            raw["upserted"] = upserted_id
+        return UpdateResult(raw, True)
+
+    async def replace_one(self, filter: Dict[str, Any], replacement: Dict[str, Any], upsert: bool = False,
+                          **kwargs) -> UpdateResult:
+        matched, modified, upserted_id = self._update(filter, replacement, False, None, upsert, replace=True)
+        raw = {"n": matched or int(upserted_id is not None), "nModified": modified}
+        if upserted_id is not None:
+            raw["upserted"] = upserted_id
+        return UpdateResult(raw, True)
+
+    async def delete_one(self, filter: Dict[str, Any], **kwargs) -> DeleteResult:
+        return DeleteResult({"n": self._delete(filter, many=False)}, True)
+
+    async def delete_many(self, filter: Dict[str, Any], **kwargs) -> DeleteResult:
+        return DeleteResult({"n": self._delete(filter, many=True)}, True)
+
+    async def bulk_write(self, requests: List[Any], ordered: bool = True, **kwargs) -> BulkWriteResult:
+        """Apply pymongo write models in order"""
+        counts = {"nInserted": 0, "nMatched": 0, "nModified": 0, "nRemoved": 0, "nUpserted": 0, "upserted": []}
+        for index, request in enumerate(requests):
+            if isinstance(request, InsertOne):
+                self._insert(request._doc)
+                counts["nInserted"] += 1
+            elif isinstance(request, (DeleteOne, DeleteMany)):
+                counts["nRemoved"] += self._delete(request._filter, many=isinstance(request, DeleteMany))
+            elif isinstance(request, (UpdateOne, UpdateMany, ReplaceOne)):
+                matched, modified, upserted_id = self._update(
+                    request._filter,
+                    request._doc,
+                    many=isinstance(request, UpdateMany),
+                    array_filters=getattr(request, "_array_filters", None),
+                    upsert=bool(request._upsert),
+                    replace=isinstance(request, ReplaceOne)
+                )
+                counts["nMatched"] += matched
+                counts["nModified"] += modified
+                if upserted_id is not None:
+                    counts["nUpserted"] += 1
+                    counts["upserted"].append({"index": index, "_id": upserted_id})
+            else:
+                raise OperationFailure(f"Unsupported bulk operation in memory backend: {type(request).__name__}")
+        return BulkWriteResult(counts, True)
+
+    async def drop(self, **kwargs) -> None:
+        self.database._collections.pop(self.name, None)
+
+    # Indexes
+
+    async def create_indexes(self, indexes: List[Any], **kwargs) -> List[str]:
+        names = []
+        for index in indexes:
+            spec = index.document
+            definition = {"key": list(spec["key"].items()), "unique": spec.get("unique", False)}
+            existing = self._indexes.get(spec["name"])
+            if existing is not None and existing != definition:
+                raise OperationFailure(f"Index {spec['name']} already exists with different options", code=85)
+            self._indexes[spec["name"]] = definition
+            if definition["unique"] and spec["name"] not in self._unique:
+                entries = {}
+                for document in self._documents.values():
+                    key = tuple(repr(next(iter(_resolve(document, field)), None)) for field, _ in definition["key"])
+                    if key in entries:
+                        self._indexes.pop(spec["name"])
+                        raise OperationFailure(f"E11000 duplicate key error index: {spec['name']}", code=11000)
+                    entries[key] = document["_id"]
+                self._unique[spec["name"]] = entries
+            names.append(spec["name"])
+        return names
+
+    async def index_information(self) -> Dict[str, Dict[str, Any]]:
+        return copy.deepcopy(self._indexes)
+
+    async def drop_index(self, name: str, **kwargs) -> None:
+        self._indexes.pop(name, None)
+        self._unique.pop(name, None)
+
+class MemoryDatabase:
+    """A named set of collections, created on first access"""
+
+    def __init__(self, name: str):
+        self.name = name
+        self._collections: Dict[str, MemoryCollection] = {}
+
+    def __getitem__(self, name: str) -> MemoryCollection:
+        if name not in self._collections:
+            self._collections[name] = MemoryCollection(self, name)
+        return self._collections[name]
+
+    def __getattr__(self, name: str) -> MemoryCollection:
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return self[name]
+
+    async def list_collection_names(self, **kwargs) -> List[str]:
+        return list(self._collections)
+
+class MemorySession:
+    """No-op session: transactions are accepted but writes apply immediately"""
+
+    async def __aenter__(self) -> "MemorySession":
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        return None
+
+    @asynccontextmanager
+    async def start_transaction(self, **kwargs):
+        yield self
+
+class MemoryClient:
+    """Process-local replacement for AsyncIOMotorClient"""
+
+    def __init__(self):
+        self._databases: Dict[str, MemoryDatabase] = {}
+
+    def __getitem__(self, name: str) -> MemoryDatabase:
+        if name not in self._databases:
+            self._databases[name] = MemoryDatabase(name)
+        return self._databases[name]
+
+    async def start_session(self, **kwargs) -> MemorySession:
+        return MemorySession()
+
+    def close(self) -> None:
+        self._databases = {}
@@ -0,0 +1,29 @@
+"""
+One-off data migrations.
+
+Each migration is recorded by name in the schema_migrations collection once it
+has run, so startup code can tell whether it still needs to be applied.
+"""
+
+from datetime import datetime
+
+from minute_empire.db.mongodb import get_db
+
+MIGRATIONS_COLLECTION = "schema_migrations"
+
+# The scheduled_tasks queue was filled from a scan of every village and troop action
+SCHEDULED_TASKS_QUEUE = "scheduled_tasks_queue"
+
+async def is_applied(name: str) -> bool:
+    """Check whether a migration has already run"""
+    async with get_db() as db:
+        return await db[MIGRATIONS_COLLECTION].count_documents({"_id": name}, limit=1) > 0
+
+async def mark_applied(name: str) -> None:
+    """Record that a migration has run"""
+    async with get_db() as db:
+        await db[MIGRATIONS_COLLECTION].update_one(
+            {"_id": name},
+            {"$set": {"applied_at": datetime.utcnow()}},
+            upsert=True
+        )
@@ -1,10 +1,13 @@
 import os
-from typing import Dict, List, Optional, Any, Union
+from typing import Dict, List, Optional, Any, Union, Type
 from datetime import datetime
 from bson import ObjectId
 from motor.motor_asyncio import AsyncIOMotorClient, AsyncIOMotorDatabase
+from pydantic import BaseModel
+from pymongo.monitoring import ConnectionPoolListener
 from dotenv import load_dotenv
 import pathlib
+import threading
 from contextlib import asynccontextmanager
 
 from ..schemas.schemas import (
@@ -37,20 +40,160 @@ DATABASE_NAME = os.getenv("DATABASE_NAME") or MONGO_DB  # Use MONGO_DB as fallba
 host = "mongodb" if os.getenv("DOCKER_ENV") else "localhost"
 MONGODB_URI = f"mongodb://{MONGO_USER}:{MONGO_PASSWORD}@{host}:27017/{MONGO_DB}?authSource=admin"
 
-print(f"Connecting to MongoDB at: {host}:27017 with user {MONGO_USER} and database {MONGO_DB}")
-print(f"Using database name: {DATABASE_NAME}")
+# Connection pool settings (shared by every repository in the process)
+MONGO_MAX_POOL_SIZE = int(os.getenv("MONGO_MAX_POOL_SIZE", "100"))
+MONGO_MIN_POOL_SIZE = int(os.getenv("MONGO_MIN_POOL_SIZE", "0"))
+MONGO_MAX_IDLE_TIME_MS = int(os.getenv("MONGO_MAX_IDLE_TIME_MS", "60000"))
+MONGO_WAIT_QUEUE_TIMEOUT_MS = int(os.getenv("MONGO_WAIT_QUEUE_TIMEOUT_MS", "10000"))
+
+# Documents fetched per round trip when repositories stream a collection
+MONGO_CURSOR_BATCH_SIZE = int(os.getenv("MONGO_CURSOR_BATCH_SIZE", "500"))
+
+# Storage backend: "mongo" for MongoDB, "memory" for the in-process stand-in used by benchmarks and simulations
+DATABASE_BACKEND = os.getenv("DATABASE_BACKEND", "mongo").lower()
+if DATABASE_BACKEND not in ("mongo", "memory"):
+    raise ValueError(f"Unknown DATABASE_BACKEND: {DATABASE_BACKEND}")
+
+if DATABASE_BACKEND == "memory":
+    print(f"Using in-memory database backend with database name: {DATABASE_NAME}")
+else:
+    print(f"Connecting to MongoDB at: {host}:27017 with user {MONGO_USER} and database {MONGO_DB}")
+    print(f"Using database name: {DATABASE_NAME}")
+    print(f"Connection pool size: min={MONGO_MIN_POOL_SIZE}, max={MONGO_MAX_POOL_SIZE}")
+
+class PoolStatsListener(ConnectionPoolListener):
+    """Keeps live counters of the connection pool state.
+    
+    Pool events are published from PyMongo's background threads, so the
+    counters are guarded by a lock.
+    """
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.open = 0
+        self.in_use = 0
+        self.waiting = 0
+        self.created_total = 0
+        self.checkouts_total = 0
+        self.checkout_failures_total = 0
+        self.pools_cleared_total = 0
+    
+    def snapshot(self) -> Dict[str, int]:
+        """Return a consistent copy of the counters"""
+        with self._lock:
+            return {
+                "open": self.open,
+                "in_use": self.in_use,
+                "idle": max(0, self.open - self.in_use),
+                "waiting": self.waiting,
+                "created_total": self.created_total,
+                "checkouts_total": self.checkouts_total,
+                "checkout_failures_total": self.checkout_failures_total,
+                "pools_cleared_total": self.pools_cleared_total
+            }
+    
+    def pool_created(self, event):
+        pass
+    
+    def pool_ready(self, event):
+        pass
+    
+    def pool_cleared(self, event):
+        with self._lock:
+            self.pools_cleared_total += 1
+    
+    def pool_closed(self, event):
+        pass
+    
+    def connection_created(self, event):
+        with self._lock:
+            self.open += 1
+            self.created_total += 1
+    
+    def connection_ready(self, event):
+        pass
+    
+    def connection_closed(self, event):
+        with self._lock:
+            self.open = max(0, self.open - 1)
+    
+    def connection_check_out_started(self, event):
+        with self._lock:
+            self.waiting += 1
+    
+    def connection_check_out_failed(self, event):
+        with self._lock:
+            self.waiting = max(0, self.waiting - 1)
+            self.checkout_failures_total += 1
+    
+    def connection_checked_out(self, event):
+        with self._lock:
+            self.waiting = max(0, self.waiting - 1)
+            self.in_use += 1
+            self.checkouts_total += 1
+    
+    def connection_checked_in(self, event):
+        with self._lock:
+            self.in_use = max(0, self.in_use - 1)
+
+# Process-wide client and its pool listener
+pool_stats_listener = PoolStatsListener()
+_client: Optional[AsyncIOMotorClient] = None
+
+def get_client() -> AsyncIOMotorClient:
+    """Return the process-wide MongoDB client, creating it on first use
+    
+    With DATABASE_BACKEND=memory this is a MemoryClient exposing the same API,
+    so repositories and services run unchanged without a MongoDB server.
+    """
+    global _client
+    if _client is None and DATABASE_BACKEND == "memory":
+        from minute_empire.db.memory import MemoryClient
+        _client = MemoryClient()
+    elif _client is None:
+        _client = AsyncIOMotorClient(
+            MONGODB_URI,
+            maxPoolSize=MONGO_MAX_POOL_SIZE,
+            minPoolSize=MONGO_MIN_POOL_SIZE,
+            maxIdleTimeMS=MONGO_MAX_IDLE_TIME_MS,
+            waitQueueTimeoutMS=MONGO_WAIT_QUEUE_TIMEOUT_MS,
+            event_listeners=[pool_stats_listener]
+        )
+    return _client
+
+async def connect_to_mongo() -> None:
+    """Create the shared client. Called once at application startup."""
+    get_client()
+
+async def close_mongo_connection() -> None:
+    """Close the shared client and its pool. Called at application shutdown."""
+    global _client
+    if _client is not None:
+        _client.close()
+        _client = None
+
+def get_pool_stats() -> Dict[str, Any]:
+    """Get the current in-use, idle and waiting counts of the connection pool"""
+    stats = pool_stats_listener.snapshot()
+    stats["max_pool_size"] = MONGO_MAX_POOL_SIZE
+    stats["min_pool_size"] = MONGO_MIN_POOL_SIZE
+    stats["connected"] = _client is not None
+    stats["backend"] = DATABASE_BACKEND
+    return stats
+
+def projection_for(model: Type[BaseModel]) -> Dict[str, int]:
+    """Build a MongoDB projection that fetches only the fields declared on a view model"""
+    return {field.alias or name: 1 for name, field in model.model_fields.items()}
 
 @asynccontextmanager
 async def get_db():
-    """Context manager for database connections.
+    """Context manager for database access.
+    
+    All callers share the same pooled client; leaving the context returns
+    nothing to close, connections go back to the pool automatically.
     
     Usage:
         async with get_db() as db:
             result = await db.collection.find_one(...)
     """
-    client = AsyncIOMotorClient(MONGODB_URI)
-    try:
-        db = client[DATABASE_NAME]
-        yield db
-    finally:
-        client.close()
\ No newline at end of file
+    yield get_client()[DATABASE_NAME]
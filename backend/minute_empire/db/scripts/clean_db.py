@@ -12,7 +12,7 @@ import asyncio
 from typing import List
 from datetime import datetime
 
-from minute_empire.db.mongodb import get_db, MONGO_DB
+from minute_empire.db.mongodb import get_db, close_mongo_connection, MONGO_DB
 
 def get_confirmation(database_name: str) -> bool:
     """Get user confirmation before proceeding with database cleanup."""
@@ -60,7 +60,10 @@ async def clean_database() -> None:
 async def main():
     """Main function to clean the database."""
     print("\n=== MongoDB Database Cleanup ===")
-    await clean_database()
+    try:
+        await clean_database()
+    finally:
+        await close_mongo_connection()
 
 if __name__ == "__main__":
     asyncio.run(main()) 
\ No newline at end of file
@@ -0,0 +1,39 @@
+#!/usr/bin/env python
+"""
+Task History Backfill Script
+
+Moves the processed construction and troop training tasks that are still
+stored in village documents into the task_history collection, leaving only
+pending tasks in the villages. Safe to run repeatedly and while the server
+is running: archived tasks are keyed by task ID and villages are written
+with compare-and-set.
+"""
+
+import sys
+import asyncio
+
+from minute_empire.db.mongodb import connect_to_mongo, close_mongo_connection, MONGO_DB
+from minute_empire.db.indexes import ensure_indexes
+from minute_empire.services.task_compaction_service import TaskCompactionService
+
+async def main():
+    """Main function to backfill the task history."""
+    print("\n=== Task History Backfill ===")
+    try:
+        await connect_to_mongo()
+        await ensure_indexes()
+
+        print(f"\nCompacting village tasks in database '{MONGO_DB}'...")
+        stats = await TaskCompactionService().compact_all_villages()
+
+        print(f"\n✅ Archived {stats['tasks_archived']} tasks from {stats['villages_compacted']} villages")
+        if stats["errors"]:
+            print(f"\n❌ {len(stats['errors'])} villages could not be compacted:")
+            for error in stats["errors"]:
+                print(f"- {error}")
+            sys.exit(1)
+    finally:
+        await close_mongo_connection()
+
+if __name__ == "__main__":
+    asyncio.run(main())
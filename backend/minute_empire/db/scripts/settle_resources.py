@@ -0,0 +1,46 @@
+#!/usr/bin/env python
+"""
+Resource Settlement Script
+
+Completes every overdue task, then advances the stored resource snapshot of
+every village to now, in bulk. Resources are evaluated lazily from the
+snapshots, so this is only maintenance: it keeps the stored balances close to
+the displayed ones. Completing the overdue tasks first keeps their rate
+changes at their completion times.
+"""
+
+import sys
+import asyncio
+from datetime import datetime
+
+from minute_empire.db.mongodb import connect_to_mongo, close_mongo_connection, MONGO_DB
+from minute_empire.db.indexes import ensure_indexes
+from minute_empire.services.resource_service import ResourceService
+from minute_empire.services.timed_tasks_service import TimedConstructionService
+
+async def main():
+    """Main function to settle the resources of every village."""
+    print("\n=== Resource Settlement ===")
+    try:
+        await connect_to_mongo()
+        await ensure_indexes()
+        now = datetime.utcnow()
+
+        print(f"\nCompleting overdue tasks in database '{MONGO_DB}'...")
+        completion = await TimedConstructionService().complete_all_tasks_until(now)
+        print(f"\n✅ Completed {completion.get('total_tasks_completed', 0)} overdue tasks")
+        if completion.get("errors"):
+            print(f"\n❌ {len(completion['errors'])} errors completing tasks, not settling:")
+            for error in completion["errors"]:
+                print(f"- {error}")
+            sys.exit(1)
+
+        print("\nSettling village resources...")
+        stats = await ResourceService().settle_all_villages(now)
+        print(f"\n✅ Settled {stats['villages_settled']} of {stats['villages_checked']} villages "
+              f"({stats['conflicts']} written concurrently)")
+    finally:
+        await close_mongo_connection()
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,84 @@
+"""
+Per-level lookup tables for the game balance formulas.
+
+Costs, times, bonuses, production and capacities only depend on a type and a
+level, so each formula is evaluated once at import for every level up to
+MAX_TABLE_LEVEL and stored in an immutable table. Levels past the table fall
+back to the formula itself, so lookups always return exactly what the
+formula would.
+"""
+
+from functools import lru_cache
+from types import MappingProxyType
+from typing import Any, Callable, Dict, Iterable, Mapping
+
+# Highest level precomputed in every table
+MAX_TABLE_LEVEL = 50
+
+class LevelTable:
+    """Immutable values of a formula for levels 0..MAX_TABLE_LEVEL"""
+
+    __slots__ = ("_formula", "_values")
+
+    def __init__(self, formula: Callable[[int], Any], max_level: int = MAX_TABLE_LEVEL):
+        self._formula = formula
+        self._values = tuple(self._freeze(formula(level)) for level in range(max_level + 1))
+
+    @staticmethod
+    def _freeze(value: Any) -> Any:
+        return MappingProxyType(value) if isinstance(value, dict) else value
+
+    def __getitem__(self, level: int) -> Any:
+        if 0 <= level < len(self._values):
+            return self._values[level]
+        return self._freeze(self._formula(level))
+
+    def to_list(self) -> list:
+        """Plain copy of the precomputed values, for serialization"""
+        return [dict(value) if isinstance(value, Mapping) else value for value in self._values]
+
+def per_type_tables(types: Iterable[Any], formula: Callable[[Any, int], Any]) -> Mapping[Any, LevelTable]:
+    """Build a read-only mapping of type -> LevelTable for a formula of (type, level)"""
+    return MappingProxyType({
+        type_: LevelTable(lambda level, type_=type_: formula(type_, level))
+        for type_ in types
+    })
+
+def _tables_to_dict(tables: Mapping[Any, LevelTable]) -> Dict[str, list]:
+    return {getattr(type_, "value", type_): table.to_list() for type_, table in tables.items()}
+
+@lru_cache(maxsize=1)
+def get_balance_config() -> Dict[str, Any]:
+    """
+    Everything a client needs to compute costs, times and production locally.
+
+    Built once per process; the tables never change while it runs.
+    """
+    # Imported here, the domain modules import this one
+    from minute_empire.domain import building, resource_field, village
+    from minute_empire.domain.building import Building
+    from minute_empire.domain.resource_field import ResourceProducer
+    from minute_empire.domain.troop import Troop
+
+    return {
+        "max_table_level": MAX_TABLE_LEVEL,
+        "buildings": {
+            "creation_costs": {t.value: dict(c) for t, c in Building.BASE_CREATION_COSTS.items()},
+            "creation_times": {t.value: minutes for t, minutes in Building.BASE_CREATION_TIMES.items()},
+            "upgrade_costs": _tables_to_dict(building.UPGRADE_COST_TABLES),
+            "upgrade_times": _tables_to_dict(building.UPGRADE_TIME_TABLES),
+            "production_bonuses": _tables_to_dict(building.PRODUCTION_BONUS_TABLES),
+        },
+        "fields": {
+            "creation_costs": {t.value: dict(c) for t, c in ResourceProducer.BASE_CREATION_COSTS.items()},
+            "creation_times": {t.value: minutes for t, minutes in ResourceProducer.BASE_CREATION_TIMES.items()},
+            "upgrade_costs": _tables_to_dict(resource_field.UPGRADE_COST_TABLES),
+            "upgrade_times": _tables_to_dict(resource_field.UPGRADE_TIME_TABLES),
+            "base_production": _tables_to_dict(resource_field.BASE_PRODUCTION_TABLES),
+        },
+        "storage_capacity": village.STORAGE_CAPACITY_TABLE.to_list(),
+        "troops": {
+            "training_costs": {t.value: dict(c) for t, c in Troop.TRAINING_COSTS.items()},
+            "training_times": {t.value: minutes for t, minutes in Troop.TRAINING_TIMES.items()},
+        },
+    }
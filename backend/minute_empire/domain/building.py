@@ -1,5 +1,6 @@
 from typing import Dict, Optional, Any
 from minute_empire.schemas.schemas import ConstructionType, Construction
+from minute_empire.domain.balance_tables import per_type_tables
 
 class Building:
     """Domain class for buildings with game logic"""
@@ -161,24 +162,15 @@ class Building:
     
     def get_upgrade_cost(self) -> Dict[str, int]:
         """Calculate upgrade cost based on building type and level"""
-        if self.type not in Building.BASE_UPGRADE_COSTS:
+        if self.type not in UPGRADE_COST_TABLES:
             return {}
-            
-        # Apply level multiplier
-        level_multiplier = 1.5 ** self.level
-        return {
-            resource: int(amount * level_multiplier)
-            for resource, amount in Building.BASE_UPGRADE_COSTS[self.type].items()
-        }
+        return dict(UPGRADE_COST_TABLES[self.type][self.level])
     
     def get_upgrade_time(self) -> int:
         """Calculate upgrade time in minutes"""
-        if self.type not in Building.BASE_UPGRADE_TIMES:
+        if self.type not in UPGRADE_TIME_TABLES:
             return 0
-        if self.type not in Building.CTN_TIME_LEVEL_SCALE:
-            return 0     
-        # Apply level multiplier
-        return int(Building.BASE_UPGRADE_TIMES[self.type] * (Building.CTN_TIME_LEVEL_SCALE[self.type] ** self.level))
+        return UPGRADE_TIME_TABLES[self.type][self.level]
     
     def can_upgrade(self) -> bool:
         """Check if upgrade requirements are met"""
@@ -199,12 +191,11 @@ class Building:
         Returns:
             Dict[str, float]: Production bonuses as multipliers for each resource type
         """
-        if self.type not in Building.BASE_PRODUCTION_BONUSES:
+        if self.type not in PRODUCTION_BONUS_TABLES:
             return {}
             
-        base_bonus = Building.BASE_PRODUCTION_BONUSES[self.type]
         target_level = level if level is not None else self.level
-        bonus_value = base_bonus * target_level
+        bonus_value = PRODUCTION_BONUS_TABLES[self.type][target_level]
         
         # Return bonuses for each resource type
         return {
@@ -229,4 +220,25 @@ class Building:
         return self.level
 
     def __str__(self) -> str:
-        return f"{self.type.value} (Level {self.level}, Slot {self.slot})" 
\ No newline at end of file
+        return f"{self.type.value} (Level {self.level}, Slot {self.slot})"
+
+# Per-level tables compiled from the balance constants above
+
+def _upgrade_cost(building_type: ConstructionType, level: int) -> Dict[str, int]:
+    level_multiplier = 1.5 ** level
+    return {
+        resource: int(amount * level_multiplier)
+        for resource, amount in Building.BASE_UPGRADE_COSTS[building_type].items()
+    }
+
+def _upgrade_time(building_type: ConstructionType, level: int) -> int:
+    return int(Building.BASE_UPGRADE_TIMES[building_type] * (Building.CTN_TIME_LEVEL_SCALE[building_type] ** level))
+
+def _production_bonus(building_type: ConstructionType, level: int) -> float:
+    return Building.BASE_PRODUCTION_BONUSES[building_type] * level
+
+UPGRADE_COST_TABLES = per_type_tables(Building.BASE_UPGRADE_COSTS, _upgrade_cost)
+UPGRADE_TIME_TABLES = per_type_tables(
+    [t for t in Building.BASE_UPGRADE_TIMES if t in Building.CTN_TIME_LEVEL_SCALE], _upgrade_time
+)
+PRODUCTION_BONUS_TABLES = per_type_tables(Building.BASE_PRODUCTION_BONUSES, _production_bonus)
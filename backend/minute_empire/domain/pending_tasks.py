@@ -0,0 +1,88 @@
+from typing import Any, Dict, Iterable, List, Union
+from minute_empire.schemas.schemas import TaskType, ConstructionTask, TroopTrainingTask
+
+class PendingTaskIndex:
+    """
+    Index of a village's unprocessed tasks.
+
+    Construction tasks are indexed by slot and troop training tasks by troop
+    type, and the working population of the pending constructions is kept as
+    a running total. The task arrays keep every task the village ever had;
+    the index only holds the pending ones, so lookups don't grow with them.
+    """
+
+    __slots__ = ("_construction", "_training", "_by_slot", "_by_troop_type", "working_population")
+
+    def __init__(self, construction_tasks: Iterable[ConstructionTask],
+                 troop_training_tasks: Iterable[TroopTrainingTask]):
+        self._construction: Dict[str, ConstructionTask] = {}
+        self._training: Dict[str, TroopTrainingTask] = {}
+        self._by_slot: Dict[int, List[ConstructionTask]] = {}
+        self._by_troop_type: Dict[str, List[TroopTrainingTask]] = {}
+        self.working_population = 0
+        for task in construction_tasks:
+            if not task.processed:
+                self.add(task)
+        for task in troop_training_tasks:
+            if not task.processed:
+                self.add(task)
+
+    @staticmethod
+    def _workers(task: ConstructionTask) -> int:
+        """Workers busy on a construction task: the target level squared for upgrades, 1 for creations"""
+        if task.task_type in (TaskType.UPGRADE_BUILDING, TaskType.UPGRADE_FIELD):
+            return round(task.level**2)
+        if task.task_type in (TaskType.CREATE_BUILDING, TaskType.CREATE_FIELD):
+            return 1
+        return 0
+
+    def add(self, task: Union[ConstructionTask, TroopTrainingTask]) -> None:
+        """Index a new pending task (indexing it twice has no effect)"""
+        if task.id in self._construction or task.id in self._training:
+            return
+        if isinstance(task, ConstructionTask):
+            self._construction[task.id] = task
+            self._by_slot.setdefault(task.slot, []).append(task)
+            self.working_population += self._workers(task)
+        else:
+            self._training[task.id] = task
+            self._by_troop_type.setdefault(task.troop_type, []).append(task)
+
+    def remove(self, task: Union[ConstructionTask, TroopTrainingTask]) -> None:
+        """Drop a task that was processed"""
+        if isinstance(task, ConstructionTask):
+            if self._construction.pop(task.id, None) is None:
+                return
+            self._discard(self._by_slot, task.slot, task)
+            self.working_population -= self._workers(task)
+        elif self._training.pop(task.id, None) is not None:
+            self._discard(self._by_troop_type, task.troop_type, task)
+
+    @staticmethod
+    def _discard(index: Dict[Any, List[Any]], key: Any, task: Any) -> None:
+        tasks = index[key]
+        tasks[:] = [t for t in tasks if t.id != task.id]
+        if not tasks:
+            del index[key]
+
+    def construction_tasks(self) -> List[ConstructionTask]:
+        """Pending construction tasks, in the order they were started"""
+        return list(self._construction.values())
+
+    def troop_training_tasks(self) -> List[TroopTrainingTask]:
+        """Pending troop training tasks, in the order they were started"""
+        return list(self._training.values())
+
+    def has_slot_task(self, slot: int, task_types: Iterable[TaskType] = ()) -> bool:
+        """Whether a slot has a pending construction task, optionally of one of the given types"""
+        tasks = self._by_slot.get(slot, ())
+        if not task_types:
+            return bool(tasks)
+        return any(task.task_type in task_types for task in tasks)
+
+    def has_troop_task(self, troop_type: str) -> bool:
+        """Whether a troop type has a pending training task"""
+        return troop_type in self._by_troop_type
+
+    def __len__(self) -> int:
+        return len(self._construction) + len(self._training)
@@ -1,5 +1,6 @@
 from typing import Dict, Optional, Any
 from minute_empire.schemas.schemas import ResourceField, ResourceFieldType
+from minute_empire.domain.balance_tables import per_type_tables
 
 class ResourceProducer:
     """Domain class for resource fields with production logic"""
@@ -122,15 +123,12 @@ class ResourceProducer:
         Returns:
             Dict[str, float]: Production rates per hour for each resource type
         """
-        if self.type not in ResourceProducer.BASE_PRODUCTION_RATES:
+        if self.type not in BASE_PRODUCTION_TABLES:
             return {}
             
-        base_rate = ResourceProducer.BASE_PRODUCTION_RATES[self.type]
+        # Base rate with the level multiplier
         target_level = level if level is not None else self.level
-        level_multiplier = 1.2 ** target_level  # 20% increase per level
-        
-        # Calculate base rate with level multiplier
-        base_rate_with_level = base_rate * level_multiplier
+        base_rate_with_level = BASE_PRODUCTION_TABLES[self.type][target_level]
         
         # Get building bonuses
         if hasattr(self._village, 'get_production_bonus_for_resource'):
@@ -147,23 +145,15 @@ class ResourceProducer:
     
     def get_upgrade_cost(self) -> Dict[str, int]:
         """Calculate the cost to upgrade this resource field"""
-        if self.type not in ResourceProducer.BASE_UPGRADE_COSTS:
+        if self.type not in UPGRADE_COST_TABLES:
             return {}
-            
-        # Apply level multiplier
-        level_multiplier = 1.5 ** self.level
-        return {
-            resource: int(amount * level_multiplier)
-            for resource, amount in ResourceProducer.BASE_UPGRADE_COSTS[self.type].items()
-        }
+        return dict(UPGRADE_COST_TABLES[self.type][self.level])
     
     def get_upgrade_time(self) -> int:
         """Calculate upgrade time in minutes"""
-        if self.type not in ResourceProducer.BASE_UPGRADE_TIMES:
+        if self.type not in UPGRADE_TIME_TABLES:
             return 0
-            
-        # Apply level multiplier
-        return int(ResourceProducer.BASE_UPGRADE_TIMES[self.type] * (1.42 ** self.level))
+        return UPGRADE_TIME_TABLES[self.type][self.level]
     
     def can_upgrade(self) -> bool:
         """Check if upgrade requirements are met"""
@@ -188,4 +178,24 @@ class ResourceProducer:
         return self.level
     
     def __str__(self) -> str:
-        return f"{self.type.value} field (Level {self.level}, Slot {self.slot})" 
\ No newline at end of file
+        return f"{self.type.value} field (Level {self.level}, Slot {self.slot})"
+
+# Per-level tables compiled from the balance constants above
+
+def _base_production(field_type: ResourceFieldType, level: int) -> float:
+    level_multiplier = 1.2 ** level  # 20% increase per level
+    return ResourceProducer.BASE_PRODUCTION_RATES[field_type] * level_multiplier
+
+def _upgrade_cost(field_type: ResourceFieldType, level: int) -> Dict[str, int]:
+    level_multiplier = 1.5 ** level
+    return {
+        resource: int(amount * level_multiplier)
+        for resource, amount in ResourceProducer.BASE_UPGRADE_COSTS[field_type].items()
+    }
+
+def _upgrade_time(field_type: ResourceFieldType, level: int) -> int:
+    return int(ResourceProducer.BASE_UPGRADE_TIMES[field_type] * (1.42 ** level))
+
+BASE_PRODUCTION_TABLES = per_type_tables(ResourceProducer.BASE_PRODUCTION_RATES, _base_production)
+UPGRADE_COST_TABLES = per_type_tables(ResourceProducer.BASE_UPGRADE_COSTS, _upgrade_cost)
+UPGRADE_TIME_TABLES = per_type_tables(ResourceProducer.BASE_UPGRADE_TIMES, _upgrade_time)
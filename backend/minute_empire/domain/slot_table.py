@@ -0,0 +1,51 @@
+from typing import Any, Iterator, List, Optional
+
+class SlotTable:
+    """
+    Fixed-size container of a village's buildings or fields, indexed by slot.
+
+    Lookups, insertions and removals index straight into the slot array, so
+    completing a task updates the table in place instead of rebuilding it.
+    A slot past the capacity (only possible in old documents) grows the array.
+    """
+
+    __slots__ = ("_items", "_count")
+
+    def __init__(self, capacity: int):
+        self._items: List[Optional[Any]] = [None] * capacity
+        self._count = 0
+
+    def get(self, slot: int) -> Optional[Any]:
+        """Get the item in a slot, or None if the slot is empty"""
+        if 0 <= slot < len(self._items):
+            return self._items[slot]
+        return None
+
+    def set(self, slot: int, item: Any) -> None:
+        """Put an item in a slot, replacing whatever was there"""
+        if slot >= len(self._items):
+            self._items.extend([None] * (slot + 1 - len(self._items)))
+        if self._items[slot] is None:
+            self._count += 1
+        self._items[slot] = item
+
+    def remove(self, slot: int) -> Optional[Any]:
+        """Empty a slot, returning the item that was in it"""
+        item = self.get(slot)
+        if item is not None:
+            self._items[slot] = None
+            self._count -= 1
+        return item
+
+    def values(self) -> List[Any]:
+        """Items of the occupied slots, in slot order"""
+        return [item for item in self._items if item is not None]
+
+    def __contains__(self, slot: int) -> bool:
+        return self.get(slot) is not None
+
+    def __iter__(self) -> Iterator[Any]:
+        return iter(self.values())
+
+    def __len__(self) -> int:
+        return self._count
@@ -1,11 +1,36 @@
 from datetime import datetime, timedelta
-from typing import Dict, List, Optional, Any
+from typing import Dict, List, Optional, Any, Tuple
 from minute_empire.schemas.schemas import VillageInDB, ConstructionType, ResourceFieldType
 from minute_empire.schemas.schemas import TaskType, ConstructionTask, Construction, ResourceField, TroopTrainingTask
+from minute_empire.schemas.schemas import AppliedTransfer
 from minute_empire.domain.building import Building
 from minute_empire.domain.resource_field import ResourceProducer
+from minute_empire.domain.balance_tables import LevelTable
+from minute_empire.domain.slot_table import SlotTable
+from minute_empire.domain.pending_tasks import PendingTaskIndex
+from pydantic import BaseModel
 from bson import ObjectId
 
+# Capacity of each resource without a warehouse/granary, and with one per level
+BASE_STORAGE_CAPACITY = 300
+STORAGE_CAPACITY_TABLE = LevelTable(lambda level: BASE_STORAGE_CAPACITY * (1.64**level))
+
+# Troop action transfers remembered per village, for retries of the action
+APPLIED_TRANSFERS_KEPT = 20
+
+# Village Center level each resource field slot is unlocked at, indexed by slot
+FIELD_SLOT_UNLOCKS = {
+    1: [0, 1, 2, 3, 4, 5, 6, 7],
+    3: [11, 12, 13],
+    5: [17, 18, 19],
+    7: [8, 9, 10],
+    9: [14, 15, 16],
+}
+FIELD_SLOT_REQUIRED_LEVELS = tuple(
+    next((level for level, slots in FIELD_SLOT_UNLOCKS.items() if slot in slots), None)
+    for slot in range(max(s for slots in FIELD_SLOT_UNLOCKS.values() for s in slots) + 1)
+)
+
 class Village:
     """Domain class for villages with game logic"""
     # Class constants from core.village
@@ -13,11 +38,26 @@ class Village:
     MAX_CONSTRUCTIONS = 25
     FOOD_CONSUMPTION_PER_PERSON = 10  # Each person consumes 10 food per hour
     
+    # Arrays whose elements are tracked individually, with the field that identifies an element
+    TRACKED_ARRAYS = {
+        "construction_tasks": "id",
+        "troop_training_tasks": "id",
+        "city.constructions": "slot",
+        "resource_fields": "slot",
+    }
+    
+    # Top-level document fields the derived stats (bonuses, rates, capacities, population) depend on
+    DERIVED_STATS_FIELDS = {"city", "resource_fields"}
+    
     def __init__(self, village_data: VillageInDB):
         self._data = village_data
         self._changed = False
         self._buildings = None
+        self._wall = None
         self._resource_fields = None
+        self._pending = None
+        self._derived_stats = {}
+        self.clear_changes()
         
     
     @property
@@ -50,6 +90,11 @@ class Village:
         """City object"""
         return self._data.city
     
+    @property
+    def version(self) -> int:
+        """Version of the stored document this village was loaded from"""
+        return self._data.version
+    
     @property
     def created_at(self) -> datetime:
         """Village creation time"""
@@ -69,71 +114,100 @@ class Village:
     def res_update_at(self, value: datetime) -> None:
         """Set last resource update time"""
         self._data.res_update_at = value
+        self.mark_as_changed("res_update_at")
     
-    def get_building(self, slot: int) -> Optional[Building]:
-        """Get building by slot number"""
-        # Lazy-load buildings
+    def _load_buildings(self) -> SlotTable:
+        """Wrap the village's constructions in a slot table, on first use"""
         if self._buildings is None:
-            self._buildings = {}
-            
-            # Add wall as special case
-            if self._data.city.wall:
-                wall = Building(self._data.city.wall, self)
-                self._buildings[wall.slot] = wall
-            
-            # Add other buildings
+            self._buildings = SlotTable(self.MAX_CONSTRUCTIONS)
             for construction in self._data.city.constructions:
-                building = Building(construction, self)
-                self._buildings[building.slot] = building
-                
-        return self._buildings.get(slot)
+                self._buildings.set(construction.slot, Building(construction, self))
+        return self._buildings
+    
+    def _get_wall(self) -> Optional[Building]:
+        """The wall building, unless a construction occupies its slot"""
+        wall = self._data.city.wall
+        if not wall or wall.slot in self._load_buildings():
+            return None
+        if self._wall is None or self._wall.data is not wall:
+            self._wall = Building(wall, self)
+        return self._wall
+    
+    def get_building(self, slot: int) -> Optional[Building]:
+        """Get building by slot number"""
+        building = self._load_buildings().get(slot)
+        if building is None:
+            wall = self._get_wall()
+            if wall is not None and wall.slot == slot:
+                return wall
+        return building
     
     def get_all_buildings(self) -> List[Building]:
-        """Get all buildings"""
-        # Ensure buildings are loaded
-        if self._buildings is None:
-            # This will load the buildings
-            # We need to load at least one building to load the list
-            self.get_building(0)
-            
-        return list(self._buildings.values())
+        """Get all buildings, the wall first and then by slot"""
+        buildings = self._load_buildings().values()
+        wall = self._get_wall()
+        if wall is not None:
+            buildings.insert(0, wall)
+        return buildings
     
-    def get_resource_field(self, slot: int) -> Optional[ResourceProducer]:
-        """Get resource field by slot number"""
-        # Lazy-load resource fields
+    def _load_resource_fields(self) -> SlotTable:
+        """Wrap the village's resource fields in a slot table, on first use"""
         if self._resource_fields is None:
-            self._resource_fields = {}
-            # Load all resource fields into cache
+            self._resource_fields = SlotTable(self.MAX_FIELDS)
             if hasattr(self._data, 'resource_fields') and self._data.resource_fields:
                 for field in self._data.resource_fields:
                     if field is not None and hasattr(field, 'slot'):
-                        producer = ResourceProducer(field, self)
-                        self._resource_fields[field.slot] = producer
-        
-        return self._resource_fields.get(slot)
+                        self._resource_fields.set(field.slot, ResourceProducer(field, self))
+        return self._resource_fields
+    
+    def get_resource_field(self, slot: int) -> Optional[ResourceProducer]:
+        """Get resource field by slot number"""
+        return self._load_resource_fields().get(slot)
     
     def get_all_resource_fields(self) -> List[ResourceProducer]:
-        """Get all resource fields"""
-        # Ensure resource fields are loaded
-        if self._resource_fields is None:
-            # This will load the resource fields
-            # We need to load at least one resource field to load the list
-            self.get_resource_field(0)
-        
-        return list(self._resource_fields.values())
+        """Get all resource fields, by slot"""
+        return self._load_resource_fields().values()
+    
+    def get_field_slot_required_level(self, slot: int) -> Optional[int]:
+        """Village Center level a resource field slot needs, or None if the slot is not restricted"""
+        if 0 <= slot < len(FIELD_SLOT_REQUIRED_LEVELS):
+            return FIELD_SLOT_REQUIRED_LEVELS[slot]
+        return None
+    
+    def _derived_stat(self, key: str, compute) -> Any:
+        """Return a derived stat, computing it once per mutation of the fields it depends on"""
+        if key not in self._derived_stats:
+            self._derived_stats[key] = compute()
+        return self._derived_stats[key]
+    
+    def invalidate_derived_stats(self) -> None:
+        """Forget the memoized stats; called whenever buildings, fields or construction tasks change"""
+        self._derived_stats = {}
+    
+    def _invalidate_derived_stats_for(self, path: str) -> None:
+        """Invalidate the memoized stats if the changed document path affects them"""
+        if path.split(".", 1)[0] in self.DERIVED_STATS_FIELDS:
+            self.invalidate_derived_stats()
+    
+    def _compute_production_bonuses(self) -> Dict[str, float]:
+        """Sum the production bonuses of all buildings per resource type"""
+        bonuses = {}
+        for building in self.get_all_buildings():
+            for resource_type, bonus in building.get_production_bonus().items():
+                bonuses[resource_type] = bonuses.get(resource_type, 0.0) + bonus
+        return bonuses
     
     def get_production_bonus_for_resource(self, resource_type: str) -> float:
         """Calculate production bonus for a resource type from all buildings"""
-        bonus = 0.0
-        for building in self.get_all_buildings():
-            # Get bonus dictionary from building and extract the specific resource value
-            building_bonuses = building.get_production_bonus()
-            if resource_type in building_bonuses:
-                bonus += building_bonuses[resource_type]
-        return bonus
+        bonuses = self._derived_stat("production_bonuses", self._compute_production_bonuses)
+        return bonuses.get(resource_type, 0.0)
     
     def get_resource_rates(self) -> Dict[str, float]:
         """Calculate hourly production rates for all resources"""
+        return dict(self._derived_stat("resource_rates", self._compute_resource_rates))
+    
+    def _compute_resource_rates(self) -> Dict[str, float]:
+        """Sum the hourly production of every field minus the population's consumption"""
         rates = {
             "wood": 100,
             "stone": 100, 
@@ -175,11 +249,10 @@ class Village:
                 
         return rates
     
-    def update_resources(self, time_elapsed_hours: float) -> None:
-        """Update resources based on production rates and time elapsed"""
-        rates = self.get_resource_rates()
-        
-        for resource_type, rate in rates.items():
+    def _balances_after(self, time_elapsed_hours: float) -> Dict[str, float]:
+        """Closed-form resource amounts after producing for the given time at the current rates"""
+        balances = {}
+        for resource_type, rate in self.get_resource_rates().items():
             # Calculate production
             produced = rate * time_elapsed_hours
             
@@ -189,41 +262,209 @@ class Village:
             # Calculate storage capacity
             capacity = self.calculate_storage_capacity(resource_type)
             
-            # Update resource (don't exceed capacity)
-            setattr(self._data.resources, resource_type, 
-                   min(current + produced, capacity))
+            # Don't exceed capacity
+            balances[resource_type] = min(current + produced, capacity)
+        return balances
+    
+    def update_resources(self, time_elapsed_hours: float) -> None:
+        """Update resources based on production rates and time elapsed"""
+        for resource_type, amount in self._balances_after(time_elapsed_hours).items():
+            setattr(self._data.resources, resource_type, amount)
+        
+        self.mark_as_changed("resources")
+    
+    def resources_at(self, when: datetime) -> Dict[str, float]:
+        """
+        Evaluate the resource amounts at a point in time without changing the village.
         
-        self.mark_as_changed()
+        The stored resources are a snapshot taken at res_update_at; rates and
+        capacities only change when buildings, fields or tasks change, and those
+        changes settle the snapshot first, so the amounts at any later time
+        follow in closed form from the snapshot.
+        """
+        hours_elapsed = (when - self.res_update_at).total_seconds() / 3600
+        if hours_elapsed <= 0:
+            return {
+                resource_type: getattr(self._data.resources, resource_type, 0)
+                for resource_type in ("wood", "stone", "iron", "food")
+            }
+        return self._balances_after(hours_elapsed)
+    
+    def project_resources(self, when: datetime) -> None:
+        """
+        Advance the in-memory resources to a point in time for display or validation.
+        
+        Nothing is marked as changed, so reading a village never causes a write.
+        A later save of the resources writes the projected amounts together with
+        the projected res_update_at, which is the same snapshot in closed form.
+        """
+        if when <= self.res_update_at:
+            return
+        for resource_type, amount in self.resources_at(when).items():
+            setattr(self._data.resources, resource_type, amount)
+        self._data.res_update_at = when
+    
+    def settle_resources(self, when: datetime) -> bool:
+        """
+        Advance the resources to a point in time and mark them to be saved.
+        
+        Must be called before anything that changes the rates or the amounts
+        (task completion, deductions, steals, deposits).
+        
+        Returns:
+            bool: True if the snapshot moved forward
+        """
+        if when <= self.res_update_at:
+            return False
+        self.project_resources(when)
+        self.mark_as_changed("resources")
+        return True
     
     def calculate_storage_capacity(self, resource_type: str) -> int:
         """Calculate storage capacity based on warehouse/granary levels"""
-        base_capacity = 300
-        
+        capacities = self._derived_stat("storage_capacities", dict)
+        if resource_type not in capacities:
+            capacities[resource_type] = self._compute_storage_capacity(resource_type)
+        return capacities[resource_type]
+    
+    def _compute_storage_capacity(self, resource_type: str) -> int:
+        """Find the storage building of a resource type and compute its capacity"""
         if resource_type == "food":
             # Find granary
             granary = next((b for b in self.get_all_buildings()
                           if b.type == ConstructionType.GRANARY), None)
             if granary:
-                return base_capacity * (1.64**granary.level)
+                return STORAGE_CAPACITY_TABLE[granary.level]
         else:
             # Find warehouse for other resources
             warehouse = next((b for b in self.get_all_buildings()
                             if b.type == ConstructionType.WAREHOUSE), None)
             if warehouse:
-                return base_capacity * (1.64**warehouse.level)
+                return STORAGE_CAPACITY_TABLE[warehouse.level]
                 
-        return base_capacity
+        return BASE_STORAGE_CAPACITY
     
-    def mark_as_changed(self) -> None:
-        """Mark that this village needs to be saved to database"""
+    def mark_as_changed(self, *paths: str) -> None:
+        """
+        Mark that this village needs to be saved to database.
+        
+        Args:
+            paths: Document paths that changed (e.g. "resources", "city.wall").
+                   Without paths the whole document is saved.
+        """
         self._changed = True
+        if not paths:
+            self._full_save = True
+            self.invalidate_derived_stats()
+        for path in paths:
+            self._dirty_paths.add(path)
+            self._invalidate_derived_stats_for(path)
+            # Resources are only meaningful together with the time they were calculated at
+            if path == "resources":
+                self._dirty_paths.add("res_update_at")
         # Update the timestamp
         self._data.updated_at = datetime.utcnow()
     
+    def mark_task_changed(self, task: Any) -> None:
+        """Mark a single construction or troop training task as changed"""
+        array = "construction_tasks" if isinstance(task, ConstructionTask) else "troop_training_tasks"
+        self._mark_element_changed(array, task)
+    
+    def _mark_element_changed(self, array: str, element: BaseModel) -> None:
+        """Mark one element of a tracked array as changed"""
+        # Elements appended since the last save are pushed with their current state anyway
+        if not any(added is element for added in self._added_elements.get(array, [])):
+            key = getattr(element, self.TRACKED_ARRAYS[array])
+            self._changed_elements.setdefault(array, {})[key] = element
+        self._invalidate_derived_stats_for(array)
+        self._changed = True
+        self._data.updated_at = datetime.utcnow()
+    
+    def _mark_element_added(self, array: str, element: BaseModel) -> None:
+        """Mark an element that was appended to a tracked array"""
+        self._added_elements.setdefault(array, []).append(element)
+        self._invalidate_derived_stats_for(array)
+        self._changed = True
+        self._data.updated_at = datetime.utcnow()
+    
     def has_changes(self) -> bool:
         """Check if village has unsaved changes"""
         return self._changed
     
+    def mark_as_saved(self) -> None:
+        """Record a successful compare-and-set write: bump the version and forget the changes"""
+        self._data.version += 1
+        self.clear_changes()
+    
+    def clear_changes(self) -> None:
+        """Forget recorded changes, called once they are persisted"""
+        self._changed = False
+        self._full_save = False
+        self._dirty_paths = set()
+        self._changed_elements = {}
+        self._added_elements = {}
+    
+    @staticmethod
+    def _serialize(value: Any) -> Any:
+        """Convert a model value into what is stored in the database"""
+        if isinstance(value, BaseModel):
+            return value.dict(by_alias=True)
+        if isinstance(value, list):
+            return [Village._serialize(item) for item in value]
+        return value
+    
+    def _get_path(self, path: str) -> Any:
+        """Resolve a dotted document path against the village data"""
+        value = self._data
+        for part in path.split("."):
+            value = getattr(value, part)
+        return value
+    
+    def get_pending_update(self) -> Optional[Tuple[Dict[str, Any], List[Dict[str, Any]]]]:
+        """
+        Build a partial MongoDB update for the recorded changes.
+        
+        Returns:
+            Tuple of (update document, array filters), or None when the whole
+            document has to be saved
+        """
+        if self._full_save:
+            return None
+        
+        set_fields = {}
+        push_fields = {}
+        array_filters = []
+        
+        # Whole arrays that must be rewritten: explicitly dirty, or both appended to
+        # and modified in place (MongoDB rejects both operators on one array)
+        whole_arrays = {
+            array for array in self.TRACKED_ARRAYS
+            if array in self._dirty_paths
+            or (array in self._added_elements and array in self._changed_elements)
+        }
+        
+        for path in self._dirty_paths | whole_arrays:
+            set_fields[path] = self._serialize(self._get_path(path))
+        
+        for array, elements in self._added_elements.items():
+            if array not in whole_arrays:
+                push_fields[array] = {"$each": self._serialize(elements)}
+        
+        for array, elements in self._changed_elements.items():
+            if array in whole_arrays:
+                continue
+            key_field = self.TRACKED_ARRAYS[array]
+            for key, element in elements.items():
+                identifier = f"e{len(array_filters)}"
+                set_fields[f"{array}.$[{identifier}]"] = self._serialize(element)
+                array_filters.append({f"{identifier}.{key_field}": key})
+        
+        set_fields["updated_at"] = self._data.updated_at
+        update = {"$set": set_fields}
+        if push_fields:
+            update["$push"] = push_fields
+        return update, array_filters
+    
     def deduct_resources(self, costs: Dict[str, int]) -> bool:
         """
         Deduct resources from the village and mark it as changed.
@@ -246,16 +487,34 @@ class Village:
             setattr(self.resources, resource, current - amount)
             
         # Mark as changed
-        self.mark_as_changed()
+        self.mark_as_changed("resources")
         
         return True
     
+    def get_applied_transfer(self, action_id: str) -> Optional[Dict[str, float]]:
+        """Resources a troop action already moved into or out of this village, or None"""
+        transfer = next((t for t in self._data.applied_transfers if t.action_id == action_id), None)
+        return dict(transfer.resources) if transfer is not None else None
+    
+    def record_transfer(self, action_id: str, resources: Dict[str, float]) -> None:
+        """
+        Record the resources a troop action moved, written together with them.
+        
+        Without a transaction, the village can be saved while the troop side of
+        the action fails and the action is retried; the retry finds the record
+        and completes the troop side without moving the resources again.
+        """
+        transfers = [t for t in self._data.applied_transfers if t.action_id != action_id]
+        transfers.append(AppliedTransfer(action_id=action_id, resources=resources))
+        self._data.applied_transfers = transfers[-APPLIED_TRANSFERS_KEPT:]
+        self.mark_as_changed("applied_transfers")
+    
     def to_dict(self) -> Dict[str, Any]:
         """Convert village to dictionary for storage or API responses"""
         return self._data.dict(by_alias=True)
 
     def add_construction_task(self, task_type: TaskType, target_type: str, 
-                            slot: int, duration_minutes: int) -> ConstructionTask:
+                            slot: int, duration_minutes: int, level: int = 1) -> ConstructionTask:
         """
         Add a new construction task to the village.
         
@@ -264,6 +523,7 @@ class Village:
             target_type: Type of building or field
             slot: Slot number
             duration_minutes: How long the task takes to complete
+            level: Level the target will have once the task completes
             
         Returns:
             ConstructionTask: The newly created task
@@ -281,18 +541,98 @@ class Village:
             task_type=task_type,
             target_type=target_type,
             slot=slot,
+            level=level,
             started_at=now,
             completion_time=completion_time
         )
         
         # Add to village data
         self._data.construction_tasks.append(task)
+        self._pending_tasks().add(task)
         
         # Mark as changed
-        self.mark_as_changed()
+        self._mark_element_added("construction_tasks", task)
         
         return task
     
+    def _pending_tasks(self) -> PendingTaskIndex:
+        """Index of the unprocessed tasks, built on first use"""
+        if self._pending is None:
+            self._pending = PendingTaskIndex(self._data.construction_tasks, self._data.troop_training_tasks)
+        return self._pending
+    
+    def get_pending_construction_tasks(self) -> List[ConstructionTask]:
+        """Unprocessed construction tasks, in the order they were started"""
+        return self._pending_tasks().construction_tasks()
+    
+    def get_pending_troop_training_tasks(self) -> List[TroopTrainingTask]:
+        """Unprocessed troop training tasks, in the order they were started"""
+        return self._pending_tasks().troop_training_tasks()
+    
+    def has_pending_construction_task(self, slot: int, *task_types: TaskType) -> bool:
+        """Whether a slot has an unprocessed construction task, optionally of one of the given types"""
+        return self._pending_tasks().has_slot_task(slot, task_types)
+    
+    def has_pending_troop_training(self, troop_type: str) -> bool:
+        """Whether a troop type has an unprocessed training task"""
+        return self._pending_tasks().has_troop_task(troop_type)
+    
+    def mark_task_processed(self, task: Any) -> None:
+        """Flag a construction or troop training task as processed"""
+        task.processed = True
+        self._pending_tasks().remove(task)
+        self.mark_task_changed(task)
+    
+    def compact_processed_tasks(self) -> List[Any]:
+        """
+        Remove the processed tasks from the task arrays, keeping only the pending ones.
+        
+        The arrays are rewritten on the next save. The caller archives the
+        returned tasks before that save, so they are never lost in between.
+        
+        Returns:
+            List[Any]: The construction and troop training tasks that were removed
+        """
+        removed = []
+        for array in ("construction_tasks", "troop_training_tasks"):
+            tasks = getattr(self._data, array)
+            processed = [task for task in tasks if task.processed]
+            if processed:
+                setattr(self._data, array, [task for task in tasks if not task.processed])
+                self.mark_as_changed(array)
+                removed.extend(processed)
+        return removed
+    
+    def get_due_tasks(self, until: datetime) -> List[Any]:
+        """Unprocessed construction and troop training tasks due by a time, in completion order"""
+        pending = self._pending_tasks()
+        due = [task for task in pending.construction_tasks() if task.completion_time <= until]
+        due.extend(task for task in pending.troop_training_tasks() if task.completion_time <= until)
+        due.sort(key=lambda task: task.completion_time)
+        return due
+    
+    def apply_due_tasks(self, until: datetime) -> List[Any]:
+        """
+        Complete every task due by a time in memory, in chronological order.
+        
+        Resources are piecewise linear between completions: the snapshot is
+        settled at each completion time with the rates in force until then,
+        and the completion then sets the rates for the next piece. Troop
+        training tasks are only marked as processed, the caller creates the
+        troops.
+        
+        Returns:
+            List[Any]: The completed tasks, in the order they were applied
+        """
+        tasks = self.get_due_tasks(until)
+        for task in tasks:
+            self.settle_resources(task.completion_time)
+            if isinstance(task, ConstructionTask):
+                self.complete_construction_task(task)
+            else:
+                self.mark_task_processed(task)
+        return tasks
+    
     def process_construction_tasks(self) -> List[ConstructionTask]:
         """
         Process all completed construction tasks.
@@ -300,17 +640,10 @@ class Village:
         Returns:
             List[ConstructionTask]: List of tasks that were completed
         """
-        if not hasattr(self._data, 'construction_tasks'):
-            return []
-            
         now = datetime.utcnow()
         completed_tasks = []
         
-        for task in self._data.construction_tasks:
-            # Skip already processed tasks
-            if task.processed:
-                continue
-                
+        for task in self.get_pending_construction_tasks():
             # Check if task is complete
             if task.completion_time <= now:
                 # Complete the task
@@ -329,7 +662,7 @@ class Village:
         from minute_empire.schemas.schemas import ResourceFieldType, ConstructionType
         
         # Mark as processed
-        task.processed = True
+        self.mark_task_processed(task)
         
         # Handle different task types
         if task.task_type == TaskType.CREATE_BUILDING:
@@ -346,9 +679,8 @@ class Village:
             
             # Add to village constructions
             self._data.city.constructions.append(construction)
-            
-            # Clear building cache
-            self._buildings = None
+            self._mark_element_added("city.constructions", construction)
+            self._load_buildings().set(task.slot, Building(construction, self))
             print(f"[Village] Completed building creation: {building_type.value} in slot {task.slot}")
                 
         elif task.task_type == TaskType.UPGRADE_BUILDING:
@@ -358,9 +690,11 @@ class Village:
                 # Just set the level directly without calling upgrade()
                 # (which would check and deduct resources again)
                 building.data.level = task.level
+                if building.data is self._data.city.wall:
+                    self.mark_as_changed("city.wall")
+                else:
+                    self._mark_element_changed("city.constructions", building.data)
                 
-                # Clear building cache
-                self._buildings = None
                 print(f"[Village] Completed building upgrade: {building.type.value} to level {task.level}")
             else:
                 print(f"[Village] Failed to complete building upgrade task: Building not found in slot {task.slot}")
@@ -379,9 +713,8 @@ class Village:
             
             # Add to village fields
             self._data.resource_fields.append(field)
-            
-            # Clear resource field cache
-            self._resource_fields = None
+            self._mark_element_added("resource_fields", field)
+            self._load_resource_fields().set(task.slot, ResourceProducer(field, self))
             print(f"[Village] Completed field creation: {field_type.value} in slot {task.slot}")
                 
         elif task.task_type == TaskType.UPGRADE_FIELD:
@@ -391,9 +724,8 @@ class Village:
                 # Just set the level directly without calling upgrade()
                 # (which would check and deduct resources again)
                 field.data.level = task.level
+                self._mark_element_changed("resource_fields", field.data)
                 
-                # Clear resource field cache
-                self._resource_fields = None
                 print(f"[Village] Completed field upgrade: {field.type.value} to level {task.level}")
             else:
                 print(f"[Village] Failed to complete field upgrade task: Field not found in slot {task.slot}")
@@ -405,12 +737,11 @@ class Village:
                 # Get building type for logging
                 building_type = building.type.value
                 
-                # Remove building from village constructions
-                self._data.city.constructions = [c for c in self._data.city.constructions 
-                                             if c.slot != task.slot]
+                # Remove building from village constructions (the wall is not one of them)
+                if self._load_buildings().remove(task.slot) is not None:
+                    self._data.city.constructions.remove(building.data)
+                self.mark_as_changed("city.constructions")
                 
-                # Clear building cache
-                self._buildings = None
                 print(f"[Village] Completed building destruction: {building_type} in slot {task.slot}")
             else:
                 print(f"[Village] Failed to complete building destruction task: Building not found in slot {task.slot}")
@@ -423,17 +754,13 @@ class Village:
                 field_type = field.type.value
                 
                 # Remove field from village resource fields
-                self._data.resource_fields = [f for f in self._data.resource_fields 
-                                          if f.slot != task.slot]
+                self._load_resource_fields().remove(task.slot)
+                self._data.resource_fields.remove(field.data)
+                self.mark_as_changed("resource_fields")
                 
-                # Clear resource field cache
-                self._resource_fields = None
                 print(f"[Village] Completed field destruction: {field_type} in slot {task.slot}")
             else:
                 print(f"[Village] Failed to complete field destruction task: Field not found in slot {task.slot}")
-                
-        # Mark village as changed
-        self.mark_as_changed()
 
     def get_summary(self) -> Dict[str, Any]:
         """Get a summary of the village for display"""
@@ -486,34 +813,30 @@ class Village:
         now = datetime.utcnow()
         pending_tasks = []
         
-        if hasattr(self._data, 'construction_tasks'):
-            for task in self._data.construction_tasks:
-                if not task.processed:
-                    pending_tasks.append({
-                        "id": task.id,
-                        "task_type": task.task_type,
-                        "target_type": task.target_type,
-                        "slot": task.slot,
-                        "level": task.level,
-                        "started_at": task.started_at,
-                        "completion_time": task.completion_time,
-                        "time_remaining_seconds": max(0, (task.completion_time - now).total_seconds())
-                    })
+        for task in self.get_pending_construction_tasks():
+            pending_tasks.append({
+                "id": task.id,
+                "task_type": task.task_type,
+                "target_type": task.target_type,
+                "slot": task.slot,
+                "level": task.level,
+                "started_at": task.started_at,
+                "completion_time": task.completion_time,
+                "time_remaining_seconds": max(0, (task.completion_time - now).total_seconds())
+            })
         
         # Get pending troop training tasks
         pending_troop_tasks = []
         
-        if hasattr(self._data, 'troop_training_tasks'):
-            for task in self._data.troop_training_tasks:
-                if not task.processed:
-                    pending_troop_tasks.append({
-                        "id": task.id,
-                        "troop_type": task.troop_type,
-                        "quantity": task.quantity,
-                        "started_at": task.started_at,
-                        "completion_time": task.completion_time,
-                        "time_remaining_seconds": max(0, (task.completion_time - now).total_seconds())
-                    })
+        for task in self.get_pending_troop_training_tasks():
+            pending_troop_tasks.append({
+                "id": task.id,
+                "troop_type": task.troop_type,
+                "quantity": task.quantity,
+                "started_at": task.started_at,
+                "completion_time": task.completion_time,
+                "time_remaining_seconds": max(0, (task.completion_time - now).total_seconds())
+            })
             
         # Calculate population metrics
         total_population = self.getTotalPopulation()
@@ -553,6 +876,9 @@ class Village:
         Returns:
             int: The total population of the village
         """
+        return self._derived_stat("total_population", self._compute_total_population)
+    
+    def _compute_total_population(self) -> int:
         total_population = 0
         
         # Sum population from all buildings
@@ -574,23 +900,8 @@ class Village:
         Returns:
             int: The working population of the village
         """
-        working_population = 0
-        
-        # Check if there are any construction tasks
-        if not hasattr(self._data, 'construction_tasks'):
-            return working_population
-            
-        # Sum target levels from all pending tasks
-        for task in self._data.construction_tasks:
-            if not task.processed:
-                if task.task_type in [TaskType.UPGRADE_BUILDING, TaskType.UPGRADE_FIELD]:
-                    # For upgrade tasks, use the target level
-                    working_population += round(task.level**2)
-                elif task.task_type in [TaskType.CREATE_BUILDING, TaskType.CREATE_FIELD]:
-                    # For creation tasks, use level 1
-                    working_population += 1
-                
-        return working_population
+        # Kept up to date by the pending task index as tasks are added and completed
+        return self._pending_tasks().working_population
     
     def getPopulationConsumption(self) -> Dict[str, float]:
         """
@@ -648,8 +959,9 @@ class Village:
         
         # Add to village data
         self._data.troop_training_tasks.append(task)
+        self._pending_tasks().add(task)
         
         # Mark as changed
-        self.mark_as_changed()
+        self._mark_element_added("troop_training_tasks", task)
         
         return task
\ No newline at end of file
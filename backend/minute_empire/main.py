@@ -1,20 +1,28 @@
 from fastapi import FastAPI, HTTPException, Depends, Cookie, Response, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.security import OAuth2PasswordBearer
+from fastapi.responses import PlainTextResponse
 from typing import Optional, List, Dict, Any
 import asyncio
 import logging
+import os
 from starlette.websockets import WebSocketState
 import traceback
 
 from minute_empire.services.registration_service import RegistrationService
 from minute_empire.services.authentication_service import AuthenticationService
 from minute_empire.services.command_service import CommandService
-from minute_empire.services.task_scheduler import task_scheduler
+from minute_empire.services.task_scheduler import task_scheduler, SCHEDULER_RESCAN_ON_STARTUP
 from minute_empire.services.troop_action_service import TroopActionService
 from minute_empire.services.timed_tasks_service import TimedConstructionService
 from minute_empire.services.websocket_service import websocket_service
+from minute_empire.services.resource_service import ResourceService, SETTLE_RESOURCES_ON_STARTUP
 from minute_empire.repositories.village_repository import VillageRepository
+from minute_empire.db.mongodb import connect_to_mongo, close_mongo_connection, get_pool_stats
+from minute_empire.repositories.village_cache import village_cache
+from minute_empire.db.indexes import ensure_indexes
+from minute_empire.db import migrations
+from minute_empire.domain.balance_tables import get_balance_config
 from datetime import datetime
 from minute_empire.api.api_models import (
     RegistrationRequest, 
@@ -54,6 +62,11 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Serve the /debug endpoints (to logged-in users); they expose server internals, so off by default
+DEBUG_ENDPOINTS = os.getenv("DEBUG_ENDPOINTS", "false").lower() in ("1", "true", "yes")
+# Serve the Prometheus /metrics endpoint, unauthenticated for scrapers: keep it off the public network
+METRICS_ENDPOINT = os.getenv("METRICS_ENDPOINT", "false").lower() in ("1", "true", "yes")
+
 app = FastAPI(
     title="Minute Empire API",
     description="FastAPI backend for Minute Empire application",
@@ -91,39 +104,69 @@ async def startup_event():
     """Initialize services and load all pending tasks on startup"""
     logger.info("Starting Minute Empire API")
     
-    # Start the task scheduler
-    asyncio.create_task(task_scheduler.run_scheduler())
+    # Open the shared MongoDB connection pool before anything touches the database
+    await connect_to_mongo()
+    
+    # Make sure every collection has the indexes its queries rely on
+    try:
+        await ensure_indexes()
+    except Exception as e:
+        logger.error(f"Error applying indexes: {str(e)}")
     
     try:
         now = datetime.utcnow()
         
-        # 1. First, complete all tasks that are already due at startup
-        # This ensures tasks are completed in the correct chronological order
-        completion_results = await timed_tasks_service.complete_all_tasks_until(now)
-        
-        if completion_results.get("total_tasks_completed", 0) > 0:
-            logger.info(f"Completed {completion_results['total_tasks_completed']} overdue tasks at startup")
-            logger.info(f"Details: {completion_results['construction_tasks_completed']} construction, "
-                       f"{completion_results['troop_training_tasks_completed']} troop training, "
-                       f"{completion_results['troop_action_tasks_completed']} troop actions")
-        
-        # 2. Schedule all future tasks for execution
-        scheduling_results = await timed_tasks_service.schedule_pending_tasks(now)
-        
-        if scheduling_results.get("total_tasks_scheduled", 0) > 0:
-            logger.info(f"Scheduled {scheduling_results['total_tasks_scheduled']} future tasks at startup")
-            logger.info(f"Details: {scheduling_results['construction_tasks_scheduled']} construction, "
-                       f"{scheduling_results['troop_training_tasks_scheduled']} troop training, "
-                       f"{scheduling_results['troop_action_tasks_scheduled']} troop actions")
+        # Pending work lives in the durable scheduled_tasks queue. The whole world
+        # is only scanned to fill it the first time (or when asked to rebuild it);
+        # otherwise the scheduler drains the overdue tasks from the queue itself.
+        if SCHEDULER_RESCAN_ON_STARTUP or not await migrations.is_applied(migrations.SCHEDULED_TASKS_QUEUE):
+            # 1. First, complete all tasks that are already due at startup
+            # This ensures tasks are completed in the correct chronological order
+            completion_results = await timed_tasks_service.complete_all_tasks_until(now)
             
-        if scheduling_results.get("errors", []):
-            for error in scheduling_results["errors"]:
-                logger.error(f"Error during task scheduling: {error}")
+            if completion_results.get("total_tasks_completed", 0) > 0:
+                logger.info(f"Completed {completion_results['total_tasks_completed']} overdue tasks at startup")
+                logger.info(f"Details: {completion_results['construction_tasks_completed']} construction, "
+                           f"{completion_results['troop_training_tasks_completed']} troop training, "
+                           f"{completion_results['troop_action_tasks_completed']} troop actions")
+            
+            # Only here, after every overdue task is completed: settling earlier would
+            # move the snapshots past tasks that still have to change the rates
+            if SETTLE_RESOURCES_ON_STARTUP:
+                settlement_results = await ResourceService().settle_all_villages(now)
+                logger.info(f"Settled resources of {settlement_results['villages_settled']} of "
+                           f"{settlement_results['villages_checked']} villages at startup")
+            
+            # 2. Queue all future tasks for execution
+            scheduling_results = await timed_tasks_service.schedule_pending_tasks(now)
+            
+            if scheduling_results.get("total_tasks_scheduled", 0) > 0:
+                logger.info(f"Scheduled {scheduling_results['total_tasks_scheduled']} future tasks at startup")
+                logger.info(f"Details: {scheduling_results['construction_tasks_scheduled']} construction, "
+                           f"{scheduling_results['troop_training_tasks_scheduled']} troop training, "
+                           f"{scheduling_results['troop_action_tasks_scheduled']} troop actions")
+                
+            if scheduling_results.get("errors", []):
+                for error in scheduling_results["errors"]:
+                    logger.error(f"Error during task scheduling: {error}")
+            else:
+                await migrations.mark_applied(migrations.SCHEDULED_TASKS_QUEUE)
+
         
     except Exception as e:
         logger.error(f"Error during startup processing: {str(e)}")
         import traceback
         logger.error(traceback.format_exc())
+    
+    # Start the task scheduler; its first page picks up everything queued and overdue
+    task_scheduler.start()
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Release shared resources on shutdown"""
+    logger.info("Stopping Minute Empire API")
+    await task_scheduler.stop()
+    await close_mongo_connection()
 
 @app.get("/")
 async def root():
@@ -249,6 +292,12 @@ async def get_current_user(token: Optional[str] = Cookie(None, alias="minute_emp
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+async def require_debug_endpoints(current_user: dict = Depends(get_current_user)):
+    """Hide the debug endpoints unless DEBUG_ENDPOINTS is set, and require a logged-in user."""
+    if not DEBUG_ENDPOINTS:
+        raise HTTPException(status_code=404, detail="Not Found")
+    return current_user
+
 @app.get("/me", response_model=UserResponse)
 async def get_current_user_info(current_user: dict = Depends(get_current_user)):
     """Get information about the currently authenticated user."""
@@ -301,8 +350,8 @@ async def get_my_villages(current_user: dict = Depends(get_current_user)):
             print(traceback.format_exc())
             # Continue with the rest of the function even if action processing fails
         
-        # Update resources and get updated villages in one operation
-        villages = await resource_service.update_all_user_villages(current_user["id"])
+        # Get the villages with their resources evaluated now (read-only, nothing is saved)
+        villages = await resource_service.project_all_user_villages(current_user["id"])
         if not villages:
             return []
             
@@ -419,11 +468,13 @@ async def get_map_info_internal(user_id: str) -> Dict[str, Any]:
     from minute_empire.services.resource_service import ResourceService
     from minute_empire.repositories.troops_repository import TroopsRepository
     from minute_empire.repositories.troop_action_repository import TroopActionRepository
+    from minute_empire.repositories.user_repository import UserRepository
     from datetime import datetime
     import traceback
     
     # Initialize repositories and services
     village_repo = VillageRepository()
+    user_repo = UserRepository()
     resource_service = ResourceService()
     troops_repo = TroopsRepository()
     troop_action_repo = TroopActionRepository()
@@ -435,36 +486,45 @@ async def get_map_info_internal(user_id: str) -> Dict[str, Any]:
             logger.error(f"User {user_id} not found")
             return None
             
-        # Update the user's villages first
+        # Get the user's villages with current resources; these full documents are the only ones the map needs
         try:
-            user_villages = await resource_service.update_all_user_villages(user_id)
-            logger.info(f"Updated {len(user_villages)} villages for user {user_id}")
+            user_villages = await resource_service.project_all_user_villages(user_id)
+            logger.info(f"Loaded {len(user_villages)} villages for user {user_id}")
         except Exception as resource_error:
-            logger.error(f"Error updating user villages: {str(resource_error)}")
+            logger.error(f"Error loading user villages: {str(resource_error)}")
             logger.error(traceback.format_exc())
             # Continue even if resource update fails
+            user_villages = await village_repo.get_by_owner(user_id)
         
         # Get map bounds from World
         x_min, x_max, y_min, y_max = World.get_map_bounds()
         map_size = World.MAP_SIZE
         
-        # Get all villages
+        # Get the other villages as lightweight views (id, name, location, owner)
         try:
-            all_villages = await village_repo.get_all()
-            logger.info(f"Retrieved {len(all_villages) if all_villages else 0} villages")
+            other_villages = await village_repo.get_map_views_not_owned_by(user_id)
+            logger.info(f"Retrieved {len(user_villages) + len(other_villages)} villages")
         except Exception as village_error:
             logger.error(f"Error getting villages: {str(village_error)}")
             logger.error(traceback.format_exc())
             return None
         
+        # Look up every village owner once instead of once per village
+        owner_infos = {
+            user_id: UserBasicInfo(id=user["id"], family_name=user["family_name"], color=user["color"])
+        }
+        other_owners = await user_repo.get_public_views({village.owner_id for village in other_villages})
+        for owner_id, owner in other_owners.items():
+            owner_infos[owner_id] = UserBasicInfo(id=owner.id, family_name=owner.family_name, color=owner.color)
+        owned_village_ids = {village.id for village in user_villages if village is not None}
+        
         # Format village data for the map
         villages_data = []
+        map_villages = [(village, True) for village in user_villages] + [(village, False) for village in other_villages]
         
-        for i, village in enumerate(all_villages or []):
+        for i, (village, is_owned) in enumerate(map_villages):
             try:
                 if village is not None:
-                    is_owned = village.owner_id == user_id
-                    
                     # Extract location safely
                     x, y = 0, 0
                     if hasattr(village.location, 'get'):
@@ -475,12 +535,7 @@ async def get_map_info_internal(user_id: str) -> Dict[str, Any]:
                         y = village.location.y
                     
                     # Get user information for the village owner
-                    owner = await auth_service.get_user_by_id(village.owner_id)
-                    user_info = UserBasicInfo(
-                        id=owner["id"],
-                        family_name=owner["family_name"],
-                        color=owner["color"]
-                    )
+                    user_info = owner_infos[village.owner_id]
                     
                     # Initialize village data
                     village_data = MapVillage(
@@ -593,18 +648,12 @@ async def get_map_info_internal(user_id: str) -> Dict[str, Any]:
                         # Add construction tasks directly to the village
                         if hasattr(village._data, 'construction_tasks'):
                             # Only include non-processed tasks
-                            village_data.construction_tasks = [
-                                task for task in village._data.construction_tasks
-                                if not task.processed
-                            ]
+                            village_data.construction_tasks = village.get_pending_construction_tasks()
                             
                         # Add troop training tasks directly to the village
                         if hasattr(village._data, 'troop_training_tasks'):
                             # Only include non-processed tasks
-                            village_data.troop_training_tasks = [
-                                task for task in village._data.troop_training_tasks
-                                if not task.processed
-                            ]
+                            village_data.troop_training_tasks = village.get_pending_troop_training_tasks()
                             
                         # Add population information
                         village_data.total_population = village.getTotalPopulation()
@@ -619,10 +668,8 @@ async def get_map_info_internal(user_id: str) -> Dict[str, Any]:
         # Get all troops data
         all_troops = []
         try:
-            troops = await troops_repo.get_all()
-            
-            # Process each troop
-            for troop in troops:
+            # Stream troops instead of materialising the whole collection
+            async for troop in troops_repo.iter_all():
                 troop_data = {
                     "id": troop.id,
                     "type": troop.type,
@@ -632,7 +679,7 @@ async def get_map_info_internal(user_id: str) -> Dict[str, Any]:
                 }
                 
                 # Add mode and backpack only if the user owns the troop
-                if any(v.owner_id == user_id for v in all_villages if v and v.id == troop.home_id):
+                if troop.home_id in owned_village_ids:
                     troop_data["mode"] = troop.mode
                     troop_data["backpack"] = troop.backpack
                 
@@ -646,9 +693,7 @@ async def get_map_info_internal(user_id: str) -> Dict[str, Any]:
         all_troop_actions = []
         try:
             # Only get non-processed actions
-            actions = await troop_action_repo.get_all_active()
-            
-            for action in actions:
+            async for action in troop_action_repo.iter_all_active():
                 if not action.processed:
                     action_data = {
                         "id": action.id,
@@ -705,6 +750,38 @@ async def get_map_info(current_user: dict = Depends(get_current_user)):
         logger.error(traceback.format_exc())
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.get("/config/balance")
+async def get_balance_tables():
+    """Get the per-level cost, time, bonus, production and capacity tables used by the game."""
+    return get_balance_config()
+
+@app.get("/debug/db/pool", dependencies=[Depends(require_debug_endpoints)])
+async def get_db_pool_stats():
+    """Get in-use, idle and waiting counts of the MongoDB connection pool."""
+    return get_pool_stats()
+
+@app.get("/debug/cache/villages", dependencies=[Depends(require_debug_endpoints)])
+async def get_village_cache_stats():
+    """Get hit, miss and eviction counters of the village cache."""
+    return village_cache.get_stats()
+
+@app.get("/debug/scheduler", dependencies=[Depends(require_debug_endpoints)])
+async def get_scheduler_stats():
+    """Get the queue size and dispatch latency of the task scheduler."""
+    return task_scheduler.get_stats()
+
+@app.get("/debug/scheduler/next", dependencies=[Depends(require_debug_endpoints)])
+async def get_next_scheduler_tasks(limit: int = 20):
+    """Get the next tasks due in the task scheduler, in execution order."""
+    return await task_scheduler.get_next_tasks(max(1, min(limit, 1000)))
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    """Get the task scheduler metrics in the Prometheus text format, if METRICS_ENDPOINT is set."""
+    if not METRICS_ENDPOINT:
+        raise HTTPException(status_code=404, detail="Not Found")
+    return PlainTextResponse(await task_scheduler.get_metrics(), media_type="text/plain; version=0.0.4")
+
 @app.websocket("/ws")
 async def websocket_endpoint(websocket: WebSocket):
     """WebSocket endpoint for real-time updates"""
@@ -0,0 +1,57 @@
+import os
+import asyncio
+import functools
+import logging
+import random
+from typing import Dict, Any, Callable, Awaitable, TypeVar, Optional
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+# How many times an operation is re-run after losing a compare-and-set race
+MAX_CONFLICT_RETRIES = int(os.getenv("MAX_CONFLICT_RETRIES", "5"))
+
+class ConcurrentModificationError(Exception):
+    """Raised when a document changed between being loaded and being saved"""
+
+    def __init__(self, collection: str, document_id: str, version: Optional[int] = None):
+        self.collection = collection
+        self.document_id = document_id
+        self.version = version
+        expected = f" (expected version {version})" if version is not None else ""
+        super().__init__(f"{collection} document {document_id} was modified concurrently{expected}")
+
+def version_filter(document_id: str, version: int) -> Dict[str, Any]:
+    """
+    Build the filter of a compare-and-set update.
+
+    Documents written before versioning have no version field, they count as version 0.
+    """
+    if version == 0:
+        return {"_id": document_id, "version": {"$in": [0, None]}}
+    return {"_id": document_id, "version": version}
+
+async def run_with_retry(operation: Callable[[], Awaitable[T]], attempts: int = MAX_CONFLICT_RETRIES) -> T:
+    """
+    Run an operation, re-running it from scratch when it hits a concurrent modification.
+
+    The operation must reload what it modifies on every run; a short randomised
+    backoff spreads out writers that keep colliding.
+    """
+    for attempt in range(1, attempts + 1):
+        try:
+            return await operation()
+        except ConcurrentModificationError as e:
+            if attempt == attempts:
+                logger.error(f"Giving up after {attempts} attempts: {str(e)}")
+                raise
+            logger.info(f"Retrying after conflict (attempt {attempt}/{attempts}): {str(e)}")
+            await asyncio.sleep(random.uniform(0, 0.01 * attempt))
+
+def retry_on_conflict(func: Callable[..., Awaitable[T]]) -> Callable[..., Awaitable[T]]:
+    """Decorator for service methods that load, mutate and save documents"""
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs) -> T:
+        return await run_with_retry(lambda: func(*args, **kwargs))
+    return wrapper
@@ -0,0 +1,85 @@
+from typing import Any, Dict, List, Optional, Tuple
+from datetime import datetime
+from pymongo import ASCENDING, DeleteOne
+from minute_empire.db.mongodb import get_db
+
+class ScheduledTaskRepository:
+    """
+    Repository for the durable task scheduler queue.
+
+    Each document is one scheduled task: {_id: task ID, kind, due_at, payload,
+    serial_key, created_at}. The kind names a handler registered with the
+    scheduler and the payload holds its keyword arguments, so the queue can be
+    reloaded by any process after a restart.
+    """
+
+    COLLECTION = "scheduled_tasks"
+
+    async def upsert(self, task_id: str, kind: str, due_at: datetime, payload: Dict[str, Any],
+                     serial_key: Optional[str] = None) -> None:
+        """Store a scheduled task, replacing its previous time and payload if it was already queued"""
+        async with get_db() as db:
+            await db[self.COLLECTION].update_one(
+                {"_id": task_id},
+                {
+                    "$set": {"kind": kind, "due_at": due_at, "payload": payload, "serial_key": serial_key},
+                    "$setOnInsert": {"created_at": datetime.utcnow()}
+                },
+                upsert=True
+            )
+
+    async def get(self, task_id: str) -> Optional[Dict[str, Any]]:
+        """Get a queued task by ID"""
+        async with get_db() as db:
+            return await db[self.COLLECTION].find_one({"_id": task_id})
+
+    async def delete(self, task_id: str, due_at: Optional[datetime] = None) -> bool:
+        """Remove a task from the queue once it ran or was cancelled, optionally only if still due at due_at"""
+        query: Dict[str, Any] = {"_id": task_id}
+        if due_at is not None:
+            query["due_at"] = due_at
+        async with get_db() as db:
+            result = await db[self.COLLECTION].delete_one(query)
+            return result.deleted_count > 0
+
+    async def delete_many(self, tasks: List[Tuple[str, datetime]]) -> int:
+        """Remove tasks that ran together, each only if still due at the given time"""
+        if not tasks:
+            return 0
+        operations = [DeleteOne({"_id": task_id, "due_at": due_at}) for task_id, due_at in tasks]
+        async with get_db() as db:
+            result = await db[self.COLLECTION].bulk_write(operations, ordered=False)
+            return result.deleted_count
+
+    async def get_due_page(self, until: datetime, after: Optional[tuple] = None,
+                           limit: int = 1000) -> List[Dict[str, Any]]:
+        """
+        Get the next page of tasks due up to a time, in (due_at, _id) order.
+
+        Args:
+            until: Only tasks due at or before this time
+            after: (due_at, _id) of the last task of the previous page; with an
+                   _id of None, every task due at or before due_at is skipped
+            limit: Page size
+        """
+        query: Dict[str, Any] = {"due_at": {"$lte": until}}
+        if after is not None:
+            after_due, after_id = after
+            if after_id is None:
+                query["due_at"]["$gt"] = after_due
+            else:
+                query["$or"] = [
+                    {"due_at": {"$gt": after_due}},
+                    {"due_at": after_due, "_id": {"$gt": after_id}}
+                ]
+
+        async with get_db() as db:
+            cursor = db[self.COLLECTION].find(query).sort(
+                [("due_at", ASCENDING), ("_id", ASCENDING)]
+            ).limit(limit)
+            return await cursor.to_list(length=limit)
+
+    async def count(self) -> int:
+        """Number of tasks in the queue"""
+        async with get_db() as db:
+            return await db[self.COLLECTION].count_documents({})
@@ -0,0 +1,54 @@
+from typing import List, Any
+from datetime import datetime
+from pymongo import DESCENDING, ReplaceOne
+from minute_empire.db.mongodb import get_db
+from minute_empire.schemas.schemas import TaskHistoryInDB, ArchivedTaskKind, ConstructionTask
+
+class TaskHistoryRepository:
+    """Repository for processed construction and troop training tasks archived out of their villages"""
+
+    COLLECTION = "task_history"
+
+    async def archive(self, village_id: str, tasks: List[Any]) -> int:
+        """
+        Store processed tasks of a village in the history.
+
+        Entries are keyed by task ID and upserted, so archiving the same task
+        again (after a retry or an interrupted compaction) only rewrites it.
+
+        Returns:
+            Number of tasks written
+        """
+        if not tasks:
+            return 0
+
+        archived_at = datetime.utcnow()
+        operations = []
+        for task in tasks:
+            kind = ArchivedTaskKind.CONSTRUCTION if isinstance(task, ConstructionTask) else ArchivedTaskKind.TROOP_TRAINING
+            entry = TaskHistoryInDB(
+                _id=task.id,
+                village_id=village_id,
+                kind=kind,
+                task=task.dict(),
+                completion_time=task.completion_time,
+                archived_at=archived_at
+            )
+            operations.append(ReplaceOne({"_id": task.id}, entry.dict(by_alias=True), upsert=True))
+
+        async with get_db() as db:
+            await db[self.COLLECTION].bulk_write(operations, ordered=False)
+        return len(operations)
+
+    async def get_by_village(self, village_id: str, limit: int = 50) -> List[TaskHistoryInDB]:
+        """Get the most recently completed archived tasks of a village"""
+        async with get_db() as db:
+            cursor = db[self.COLLECTION].find({"village_id": village_id}).sort(
+                "completion_time", DESCENDING
+            ).limit(limit)
+            return [TaskHistoryInDB(**doc) async for doc in cursor]
+
+    async def exists(self, task_id: str) -> bool:
+        """Check whether a task was archived"""
+        async with get_db() as db:
+            return await db[self.COLLECTION].count_documents({"_id": task_id}, limit=1) > 0
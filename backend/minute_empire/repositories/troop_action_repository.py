@@ -1,7 +1,7 @@
-from typing import List, Optional, Dict, Any
+from typing import List, Optional, Dict, Any, AsyncIterator
 from datetime import datetime
 from bson import ObjectId
-from minute_empire.db.mongodb import get_db
+from minute_empire.db.mongodb import get_db, MONGO_CURSOR_BATCH_SIZE
 from minute_empire.schemas.schemas import TroopActionTaskInDB, ActionType
 
 class TroopActionRepository:
@@ -65,11 +65,13 @@ class TroopActionRepository:
         """Mark a troop action task as processed"""
         return await self.update(action_id, {"processed": True})
     
-    async def get_all_active(self) -> List[TroopActionTaskInDB]:
-        """Get all active (non-processed) actions"""
+    async def iter_all_active(self) -> AsyncIterator[TroopActionTaskInDB]:
+        """Stream all active (non-processed) actions, fetched in cursor batches"""
         async with get_db() as db:
-            cursor = db[self.COLLECTION].find({"processed": False})
-            active_actions = []
+            cursor = db[self.COLLECTION].find({"processed": False}).batch_size(MONGO_CURSOR_BATCH_SIZE)
             async for doc in cursor:
-                active_actions.append(TroopActionTaskInDB(**doc))
-            return active_actions 
\ No newline at end of file
+                yield TroopActionTaskInDB(**doc)
+    
+    async def get_all_active(self) -> List[TroopActionTaskInDB]:
+        """Get all active (non-processed) actions"""
+        return [action async for action in self.iter_all_active()] 
\ No newline at end of file
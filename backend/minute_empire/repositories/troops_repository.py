@@ -1,7 +1,9 @@
-from typing import List, Optional, Dict, Any
+from typing import List, Optional, Dict, Any, AsyncIterator
 from minute_empire.schemas.schemas import TroopInDB, TroopMode
-from minute_empire.db.mongodb import get_db
+from minute_empire.db.mongodb import get_db, MONGO_CURSOR_BATCH_SIZE
 from bson import ObjectId
+from minute_empire.schemas.validation import dump_for_write
+from minute_empire.repositories.concurrency import ConcurrentModificationError, version_filter
 
 class TroopsRepository:
     """Repository for accessing and persisting troops"""
@@ -22,50 +24,68 @@ class TroopsRepository:
                 print(f"Error loading troop {troop_id}: {str(e)}")
                 return None
     
-    async def get_by_home(self, home_id: str) -> List[TroopInDB]:
-        """Get all troops belonging to a specific village"""
+    async def iter_troops(self, query: Dict[str, Any]) -> AsyncIterator[TroopInDB]:
+        """
+        Stream the troops matching a query, skipping documents that fail validation.
+        
+        Documents are fetched from the cursor in batches of MONGO_CURSOR_BATCH_SIZE.
+        """
         async with get_db() as db:
-            # Exclude troops with quantity=0 or mode=DEAD
-            cursor = db[self.COLLECTION].find({
-                "home_id": home_id,
-                "quantity": {"$gt": 0},
-                "mode": {"$ne": TroopMode.DEAD.value}
-            })
-            troops_data = await cursor.to_list(length=100)  # Limit to 100 troops per village
-            
-            # Convert to domain objects with error handling
-            valid_troops = []
-            for troop_data in troops_data:
+            cursor = db[self.COLLECTION].find(query).batch_size(MONGO_CURSOR_BATCH_SIZE)
+            async for troop_data in cursor:
                 try:
-                    valid_troops.append(TroopInDB(**troop_data))
+                    troop = TroopInDB(**troop_data)
                 except Exception as e:
-                    print(f"Error converting troop data for home {home_id}: {str(e)}")
+                    print(f"Error converting troop data: {str(e)}")
                     continue
-                    
-            return valid_troops
+                yield troop
+    
+    def iter_by_home(self, home_id: str) -> AsyncIterator[TroopInDB]:
+        """Stream the living troops belonging to a specific village"""
+        # Exclude troops with quantity=0 or mode=DEAD
+        return self.iter_troops({
+            "home_id": home_id,
+            "quantity": {"$gt": 0},
+            "mode": {"$ne": TroopMode.DEAD.value}
+        })
+    
+    def iter_all(self) -> AsyncIterator[TroopInDB]:
+        """Stream all living troops in the game world"""
+        # Exclude troops with quantity=0 or marked as DEAD
+        return self.iter_troops({
+            "quantity": {"$gt": 0},
+            "mode": {"$ne": TroopMode.DEAD.value}
+        })
+    
+    async def get_by_home(self, home_id: str) -> List[TroopInDB]:
+        """Get all troops belonging to a specific village"""
+        return [troop async for troop in self.iter_by_home(home_id)]
     
     async def save(self, troop: TroopInDB) -> bool:
-        """Save changes to a troop back to the database"""
-        # Convert to dict and validate against schema
-        try:
-            troop_dict = troop.dict(by_alias=True)
-            # Validate against schema
-            TroopInDB(**troop_dict)
+        """
+        Save changes to a troop back to the database.
+        
+        Raises:
+            ConcurrentModificationError: If the troop was written by someone else since it was loaded
+        """
+        # The model was validated when loaded, strict mode checks it again
+        troop_dict = dump_for_write(troop, "troop")
             
-            # Remove the _id field from the update dict
-            if "_id" in troop_dict:
-                troop_dict.pop("_id")
-                
-            async with get_db() as db:
-                result = await db[self.COLLECTION].update_one(
-                    {"_id": troop.id},
-                    {"$set": troop_dict}
-                )
-                
-                return result.modified_count > 0
-        except Exception as e:
-            # If validation fails, raise an error
-            raise ValueError(f"Invalid troop data: {str(e)}")
+        # Remove the _id field from the update dict, the version is incremented instead of set
+        troop_dict.pop("_id", None)
+        troop_dict.pop("version", None)
+            
+        async with get_db() as db:
+            result = await db[self.COLLECTION].update_one(
+                version_filter(troop.id, troop.version),
+                {"$set": troop_dict, "$inc": {"version": 1}}
+            )
+            
+        if result.matched_count == 0:
+            raise ConcurrentModificationError(self.COLLECTION, troop.id, troop.version)
+            
+        troop.version += 1
+        return result.modified_count > 0
     
     async def create(self, troop_data: Dict[str, Any]) -> Optional[TroopInDB]:
         """Create a new troop"""
@@ -73,9 +93,9 @@ class TroopsRepository:
         if "_id" not in troop_data:
             troop_data["_id"] = str(ObjectId())
             
-        # Validate against schema before inserting
+        # Validate against schema before inserting, the result is returned as is
         try:
-            TroopInDB(**troop_data)
+            troop = TroopInDB(**troop_data)
         except Exception as e:
             raise ValueError(f"Invalid troop data: {str(e)}")
             
@@ -83,8 +103,8 @@ class TroopsRepository:
             # Insert into database
             await db[self.COLLECTION].insert_one(troop_data)
             
-            # Return a new Troop domain object
-            return TroopInDB(**troop_data)
+            # Return the validated troop
+            return troop
     
     async def delete(self, troop_id: str) -> bool:
         """Delete a troop"""
@@ -93,34 +113,30 @@ class TroopsRepository:
             return result.deleted_count > 0
     
     async def get_all(self) -> List[TroopInDB]:
-        """Get all troops in the game world"""
-        async with get_db() as db:
-            # Exclude troops with quantity=0 or marked as DEAD
-            cursor = db[self.COLLECTION].find({
-                "quantity": {"$gt": 0},
-                "mode": {"$ne": TroopMode.DEAD.value}
-            })
-            troops_data = await cursor.to_list(length=1000)  # Limit to 1000 troops
+        """Get all troops in the game world (prefer iter_all for world-wide scans)"""
+        return [troop async for troop in self.iter_all()]
             
-            # Convert to domain objects with error handling
-            valid_troops = []
-            for troop_data in troops_data:
-                try:
-                    valid_troops.append(TroopInDB(**troop_data))
-                except Exception as e:
-                    print(f"Error converting troop data: {str(e)}")
-                    continue
-                    
-            return valid_troops
+    async def update(self, troop_id: str, update_data: Dict[str, Any], version: Optional[int] = None) -> bool:
+        """
+        Update a troop with the given data.
+        
+        Args:
+            troop_id: The troop to update
+            update_data: Fields to set
+            version: If given, only update when the troop is still at this version
             
-    async def update(self, troop_id: str, update_data: Dict[str, Any]) -> bool:
-        """Update a troop with the given data"""
+        Raises:
+            ConcurrentModificationError: If a version was given and the troop was written since
+        """
+        query = {"_id": troop_id} if version is None else version_filter(troop_id, version)
         async with get_db() as db:
             result = await db[self.COLLECTION].update_one(
-                {"_id": troop_id},
-                {"$set": update_data}
+                query,
+                {"$set": update_data, "$inc": {"version": 1}}
             )
-            return result.modified_count > 0
+        if version is not None and result.matched_count == 0:
+            raise ConcurrentModificationError(self.COLLECTION, troop_id, version)
+        return result.modified_count > 0
     
     async def get_troops_at_location(self, x: int, y: int, exclude_dead: bool = True) -> List[TroopInDB]:
         """Get all troops at a specific location"""
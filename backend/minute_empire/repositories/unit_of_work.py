@@ -0,0 +1,224 @@
+import os
+import logging
+from typing import Dict, List, Optional, Any, Set
+from pymongo import UpdateOne, DeleteOne
+
+from minute_empire.db.mongodb import get_db, get_client
+from minute_empire.domain.village import Village
+from minute_empire.schemas.schemas import TroopInDB
+from minute_empire.repositories.village_repository import VillageRepository
+from minute_empire.repositories.troops_repository import TroopsRepository
+from minute_empire.repositories.concurrency import ConcurrentModificationError, version_filter
+from minute_empire.repositories.village_cache import village_cache
+
+logger = logging.getLogger(__name__)
+
+# Run each flush inside a multi-document transaction (requires a replica set)
+MONGO_USE_TRANSACTIONS = os.getenv("MONGO_USE_TRANSACTIONS", "false").lower() in ("1", "true", "yes")
+
+class UnitOfWork:
+    """
+    Collects troop and village mutations made while resolving an action and
+    writes them with one bulk_write per collection.
+
+    Troop updates are merged per troop ($set fields, last write wins) and a
+    delete discards any pending update for that troop. Villages are tracked by
+    ID so every step of the action mutates the same domain object.
+
+    Reads that must observe the pending writes go through get_troop/get_village.
+
+    Updates and deletes are compare-and-set on the document version, and every
+    conflict raises ConcurrentModificationError so the action is left
+    unprocessed and retried. Inside a transaction a conflict aborts everything.
+    Without one, the versions of the troops are checked before anything is
+    written, so troops changed since they were loaded fail the commit while it
+    is still safe to retry; only a troop written in the instant between that
+    check and the bulk_write can leave the villages written without it. For
+    that case, resource transfers between a village and a troop are recorded
+    on the village under operation_id (Village.record_transfer), so the retry
+    of the operation completes the troop side without moving them again.
+    """
+
+    def __init__(self, use_transaction: Optional[bool] = None, operation_id: Optional[str] = None):
+        self.village_repository = VillageRepository()
+        self.troops_repository = TroopsRepository()
+        self.use_transaction = MONGO_USE_TRANSACTIONS if use_transaction is None else use_transaction
+        # The action being resolved, which the resource transfers are recorded under
+        self.operation_id = operation_id
+        self._troop_updates: Dict[str, Dict[str, Any]] = {}
+        self._troop_versions: Dict[str, int] = {}
+        self._troop_deletes: Set[str] = set()
+        self._villages: Dict[str, Village] = {}
+        self._stale_village_ids: Set[str] = set()
+
+    def update_troop(self, troop_id: str, update_data: Dict[str, Any], version: Optional[int] = None) -> None:
+        """
+        Queue a $set of the given fields on a troop.
+
+        Args:
+            troop_id: The troop to update
+            update_data: Fields to set
+            version: Version the troop had when it was loaded, to detect concurrent writes
+        """
+        if troop_id in self._troop_deletes:
+            return
+        self._troop_updates.setdefault(troop_id, {}).update(update_data)
+        if version is not None:
+            self._troop_versions.setdefault(troop_id, version)
+
+    def delete_troop(self, troop_id: str, version: Optional[int] = None) -> None:
+        """
+        Queue a troop deletion, dropping its pending updates.
+
+        Args:
+            troop_id: The troop to delete
+            version: Version the troop had when it was loaded, to detect concurrent writes
+        """
+        self._troop_updates.pop(troop_id, None)
+        self._troop_deletes.add(troop_id)
+        if version is not None:
+            self._troop_versions.setdefault(troop_id, version)
+
+    async def get_troop(self, troop_id: str) -> Optional[TroopInDB]:
+        """Get a troop as it will be after the pending writes, or None if it is deleted"""
+        if troop_id in self._troop_deletes:
+            return None
+        troop = await self.troops_repository.get_by_id(troop_id)
+        if troop is None or troop_id not in self._troop_updates:
+            return troop
+        troop_data = troop.dict(by_alias=True)
+        troop_data.update(self._troop_updates[troop_id])
+        return TroopInDB(**troop_data)
+
+    def track_village(self, village: Village) -> Village:
+        """Track a village so its changes are written on commit; returns the tracked instance"""
+        return self._villages.setdefault(village.id, village)
+
+    async def get_village(self, village_id: str) -> Optional[Village]:
+        """Get the tracked village, loading and tracking it on first access"""
+        if village_id in self._villages:
+            return self._villages[village_id]
+        village = await self.village_repository.get_by_id(village_id)
+        if village is None:
+            return None
+        return self.track_village(village)
+
+    def has_changes(self) -> bool:
+        """Check if there is anything to write"""
+        return bool(
+            self._troop_updates or self._troop_deletes
+            or any(village.has_changes() for village in self._villages.values())
+        )
+
+    def _build_operations(self) -> Dict[str, List[Any]]:
+        """Turn the pending mutations into bulk_write operations per collection"""
+        village_ops = []
+        for village in self._villages.values():
+            if not village.has_changes():
+                continue
+            update, array_filters = self.village_repository.build_update(village)
+            village_ops.append(UpdateOne(
+                self.village_repository.version_filter(village),
+                update,
+                array_filters=array_filters or None
+            ))
+
+        troop_ops = []
+        for troop_id, fields in self._troop_updates.items():
+            query = {"_id": troop_id}
+            if troop_id in self._troop_versions:
+                query = version_filter(troop_id, self._troop_versions[troop_id])
+            troop_ops.append(UpdateOne(query, {"$set": fields, "$inc": {"version": 1}}))
+        for troop_id in self._troop_deletes:
+            query = {"_id": troop_id}
+            if troop_id in self._troop_versions:
+                query = version_filter(troop_id, self._troop_versions[troop_id])
+            troop_ops.append(DeleteOne(query))
+
+        # Villages go first: they are the usual source of conflicts, and failing
+        # there before anything is written keeps the action safe to retry
+        operations = {}
+        if village_ops:
+            operations[VillageRepository.COLLECTION] = village_ops
+        if troop_ops:
+            operations[TroopsRepository.COLLECTION] = troop_ops
+        return operations
+
+    async def _check_troop_versions(self, db: Any) -> None:
+        """Raise if a troop to update or delete was written or deleted since it was loaded"""
+        troop_ids = [troop_id for troop_id in self._troop_versions
+                     if troop_id in self._troop_updates or troop_id in self._troop_deletes]
+        if not troop_ids:
+            return
+        cursor = db[TroopsRepository.COLLECTION].find({"_id": {"$in": troop_ids}}, {"version": 1})
+        current = {document["_id"]: document.get("version") or 0 async for document in cursor}
+        stale = [troop_id for troop_id in troop_ids if current.get(troop_id) != self._troop_versions[troop_id]]
+        if stale:
+            raise ConcurrentModificationError(TroopsRepository.COLLECTION, ", ".join(stale))
+
+    def _check_conflicts(self, collection: str, result: Any, written_before: bool) -> None:
+        """Raise when some compare-and-set write of a bulk_write matched nothing"""
+        if collection == TroopsRepository.COLLECTION:
+            document_ids = list(self._troop_updates) + list(self._troop_deletes)
+        else:
+            document_ids = [village.id for village in self._villages.values() if village.has_changes()]
+        if result.matched_count + result.deleted_count >= len(document_ids):
+            return
+        error = ConcurrentModificationError(collection, ", ".join(document_ids))
+        if collection == VillageRepository.COLLECTION:
+            # We can't tell which villages lost the race: drop them all from the cache
+            # so the next read (or the retry) goes to the database
+            self._stale_village_ids.update(document_ids)
+            for village_id in document_ids:
+                village_cache.invalidate(village_id)
+        if not self.use_transaction and (written_before or result.matched_count + result.deleted_count > 0):
+            logger.error(f"Unit of work partially applied: {str(error)}")
+        raise error
+
+    async def commit(self) -> Dict[str, int]:
+        """
+        Write all pending mutations, one bulk_write per collection.
+
+        Returns:
+            Dict with the number of operations written per collection
+        """
+        operations = self._build_operations()
+        if not operations:
+            return {}
+
+        async with get_db() as db:
+            if self.use_transaction:
+                async with await get_client().start_session() as session:
+                    async with session.start_transaction():
+                        for collection, ops in operations.items():
+                            result = await db[collection].bulk_write(ops, ordered=False, session=session)
+                            self._check_conflicts(collection, result, written_before=False)
+            else:
+                await self._check_troop_versions(db)
+                written_before = False
+                try:
+                    for collection, ops in operations.items():
+                        result = await db[collection].bulk_write(ops, ordered=False)
+                        self._check_conflicts(collection, result, written_before)
+                        written_before = True
+                except ConcurrentModificationError:
+                    # Villages written before the conflict are newer than the cached
+                    # copies; the retry must read them, with their recorded transfers
+                    for village in self._villages.values():
+                        if village.has_changes():
+                            village_cache.invalidate(village.id)
+                    raise
+
+        # Everything is persisted, start over
+        for village in self._villages.values():
+            if village.has_changes():
+                village.mark_as_saved()
+                if village.id not in self._stale_village_ids:
+                    village_cache.put(village.to_dict())
+        self._troop_updates = {}
+        self._troop_versions = {}
+        self._troop_deletes = set()
+
+        written = {collection: len(ops) for collection, ops in operations.items()}
+        logger.info(f"Unit of work committed: {written}")
+        return written
@@ -1,8 +1,10 @@
 from typing import List, Optional, Dict, Any
-from minute_empire.schemas.schemas import UserInDB
+from minute_empire.schemas.schemas import UserInDB, UserPublicView
 from minute_empire.domain.user import User
-from minute_empire.db.mongodb import get_db
+from minute_empire.db.mongodb import get_db, projection_for
 from bson import ObjectId
+from pymongo.errors import DuplicateKeyError
+from minute_empire.schemas.validation import dump_for_write
 
 class UserRepository:
     """Repository for accessing and persisting users"""
@@ -35,6 +37,18 @@ class UserRepository:
             # Wrap in domain object
             return User(user_model)
     
+    async def get_public_views(self, user_ids: List[str]) -> Dict[str, UserPublicView]:
+        """Get the public views of several users in one query, keyed by user ID"""
+        if not user_ids:
+            return {}
+        async with get_db() as db:
+            cursor = db[self.COLLECTION].find(
+                {"_id": {"$in": list(user_ids)}},
+                projection_for(UserPublicView)
+            )
+            users_data = await cursor.to_list(length=None)
+            return {user_data["_id"]: UserPublicView(**user_data) for user_data in users_data}
+    
     async def get_all(self, limit: int = 100, skip: int = 0) -> List[User]:
         """Get all users with pagination"""
         async with get_db() as db:
@@ -57,8 +71,8 @@ class UserRepository:
         # Convert to dict and validate against schema
         try:
             user_dict = user.to_dict(include_password=True)
-            # Validate against schema
-            UserInDB(**user_dict)
+            # The model was validated when loaded, strict mode checks it again
+            dump_for_write(user._data, "user", user_dict)
             
             # Remove the _id field from the update dict
             if "_id" in user_dict:
@@ -87,17 +101,19 @@ class UserRepository:
             if "_id" not in user_data:
                 user_data["_id"] = str(ObjectId())
                 
-            # Validate against schema before inserting
+            # Validate against schema before inserting, the result is reused for the domain object
             try:
-                UserInDB(**user_data)
+                user_model = UserInDB(**user_data)
             except Exception as e:
                 raise ValueError(f"Invalid user data: {str(e)}")
                 
-            # Insert into database
-            await db[self.COLLECTION].insert_one(user_data)
+            # Insert into database; the unique username index catches concurrent registrations
+            try:
+                await db[self.COLLECTION].insert_one(user_data)
+            except DuplicateKeyError:
+                return None
             
             # Return a new User domain object
-            user_model = UserInDB(**user_data)
             return User(user_model)
     
     async def delete(self, user_id: str) -> bool:
@@ -0,0 +1,104 @@
+import os
+import time
+from collections import OrderedDict
+from typing import Dict, Optional, Any, Tuple
+
+# Maximum number of villages kept in the process cache (0 disables the cache)
+VILLAGE_CACHE_SIZE = int(os.getenv("VILLAGE_CACHE_SIZE", "1000"))
+# Seconds an entry is served before it is re-read from the database
+VILLAGE_CACHE_TTL_SECONDS = float(os.getenv("VILLAGE_CACHE_TTL_SECONDS", "30"))
+
+class VillageCache:
+    """
+    Process-level LRU cache of village documents keyed by village ID.
+
+    Entries are the documents as stored in the database. Every hit is validated
+    into a fresh VillageInDB, whose fields are all rebuilt from the document,
+    so callers never share mutable state with the cache. Entries expire
+    after the TTL; the least recently used entry is evicted when the cache is
+    full.
+
+    Writes made through this process refresh or invalidate the entry. A write
+    made by another process is not seen until the entry expires, but saving a
+    stale village fails its version check, which invalidates the entry so the
+    retry reads the current document.
+
+    Runs on the event loop only, so no locking is needed.
+    """
+
+    def __init__(self, max_size: int = VILLAGE_CACHE_SIZE, ttl_seconds: float = VILLAGE_CACHE_TTL_SECONDS):
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[str, Tuple[float, Dict[str, Any]]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_size > 0
+
+    def get(self, village_id: str) -> Optional[Dict[str, Any]]:
+        """Get the cached document, or None on a miss. The document must not be mutated."""
+        if not self.enabled:
+            return None
+        entry = self._entries.get(village_id)
+        if entry is None:
+            self.misses += 1
+            return None
+        stored_at, document = entry
+        if time.monotonic() - stored_at > self.ttl_seconds:
+            del self._entries[village_id]
+            self.expirations += 1
+            self.misses += 1
+            return None
+        self._entries.move_to_end(village_id)
+        self.hits += 1
+        return document
+
+    def put(self, document: Dict[str, Any]) -> None:
+        """Store (or refresh) a village document; the caller must not mutate it afterwards"""
+        if not self.enabled:
+            return
+        village_id = document["_id"]
+        self._entries[village_id] = (time.monotonic(), document)
+        self._entries.move_to_end(village_id)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def refresh(self, document: Dict[str, Any]) -> None:
+        """Update an entry that is already cached, without adding new ones (used by full scans)"""
+        if document.get("_id") in self._entries:
+            self.put(document)
+
+    def invalidate(self, village_id: str) -> None:
+        """Drop a village from the cache"""
+        if self._entries.pop(village_id, None) is not None:
+            self.invalidations += 1
+
+    def clear(self) -> None:
+        """Drop every entry, keeping the counters"""
+        self.invalidations += len(self._entries)
+        self._entries.clear()
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get the hit, miss and eviction counters"""
+        lookups = self.hits + self.misses
+        return {
+            "enabled": self.enabled,
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "ttl_seconds": self.ttl_seconds,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "invalidations": self.invalidations
+        }
+
+# Process-wide cache shared by every VillageRepository
+village_cache = VillageCache()
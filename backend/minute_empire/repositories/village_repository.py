@@ -1,8 +1,13 @@
-from typing import List, Optional, Dict, Any
-from minute_empire.schemas.schemas import VillageInDB
+from typing import List, Optional, Dict, Any, AsyncIterator, Tuple
+from minute_empire.schemas.schemas import VillageInDB, VillageMapView
 from minute_empire.domain.village import Village
-from minute_empire.db.mongodb import get_db
+from minute_empire.db.mongodb import get_db, projection_for, MONGO_CURSOR_BATCH_SIZE
 from bson import ObjectId
+from pymongo import UpdateOne
+from pymongo.errors import DuplicateKeyError
+from minute_empire.schemas.validation import dump_for_write
+from minute_empire.repositories.concurrency import ConcurrentModificationError, version_filter
+from minute_empire.repositories.village_cache import village_cache
 
 class VillageRepository:
     """Repository for accessing and persisting villages"""
@@ -10,11 +15,16 @@ class VillageRepository:
     COLLECTION = "villages"
     
     async def get_by_id(self, village_id: str) -> Optional[Village]:
-        """Get village domain object by ID"""
+        """Get village domain object by ID, served from the process cache when possible"""
+        village_data = village_cache.get(village_id)
+        if village_data is not None:
+            return Village(VillageInDB(**village_data))
+            
         async with get_db() as db:
             village_data = await db[self.COLLECTION].find_one({"_id": village_id})
             if village_data is None:
                 return None
+            village_cache.put(village_data)
             
             # Convert DB dict to Pydantic model
             village_model = VillageInDB(**village_data)
@@ -22,19 +32,72 @@ class VillageRepository:
             # Wrap in domain object
             return Village(village_model)
     
+    async def iter_villages(self, query: Dict[str, Any],
+                            projection: Optional[Dict[str, Any]] = None) -> AsyncIterator[Village]:
+        """
+        Stream the villages matching a query as domain objects.
+        
+        Documents are fetched from the cursor in batches of MONGO_CURSOR_BATCH_SIZE,
+        so memory stays bounded no matter how many villages match.
+        
+        Args:
+            query: MongoDB filter for the villages to stream
+            projection: Optional exclusion projection; excluded fields get their defaults,
+                        so the villages must only be used for what the remaining fields cover
+        """
+        async with get_db() as db:
+            cursor = db[self.COLLECTION].find(query, projection).batch_size(MONGO_CURSOR_BATCH_SIZE)
+            async for village_data in cursor:
+                try:
+                    village_model = VillageInDB(**village_data)
+                except Exception as e:
+                    print(f"Error converting village data: {str(e)}")
+                    continue
+                # Partial documents must never replace a cached one
+                if projection is None:
+                    village_cache.refresh(village_data)
+                yield Village(village_model)
+    
+    def iter_all(self) -> AsyncIterator[Village]:
+        """Stream all villages in the game world"""
+        return self.iter_villages({})
+    
+    def iter_by_owner(self, owner_id: str) -> AsyncIterator[Village]:
+        """Stream all villages owned by a specific user"""
+        return self.iter_villages({"owner_id": owner_id})
+    
+    def iter_with_pending_tasks(self) -> AsyncIterator[Village]:
+        """Stream the villages that have at least one unprocessed construction or training task"""
+        return self.iter_villages({"$or": [
+            {"construction_tasks.processed": False},
+            {"troop_training_tasks.processed": False}
+        ]})
+    
     async def get_by_owner(self, owner_id: str) -> List[Village]:
         """Get all villages owned by a specific user"""
-        async with get_db() as db:
-            cursor = db[self.COLLECTION].find({"owner_id": owner_id})
-            villages_data = await cursor.to_list(length=100)  # Limit to 100 villages per user
+        return [village async for village in self.iter_by_owner(owner_id)]
+    
+    async def get_views(self, query: Dict[str, Any], view_model=VillageMapView) -> List[Any]:
+        """
+        Get lightweight typed views of the villages matching a query.
+        
+        Only the fields declared on the view model are fetched from the database,
+        so large arrays like construction_tasks never cross the wire.
+        
+        Args:
+            query: MongoDB filter for the villages to fetch
+            view_model: Pydantic model describing the fields to project
             
-            # Convert to domain objects
-            villages = []
-            for village_data in villages_data:
-                village_model = VillageInDB(**village_data)
-                villages.append(Village(village_model))
-                
-            return villages
+        Returns:
+            List of view_model instances
+        """
+        async with get_db() as db:
+            cursor = db[self.COLLECTION].find(query, projection_for(view_model)).batch_size(MONGO_CURSOR_BATCH_SIZE)
+            return [view_model(**view_data) async for view_data in cursor]
+    
+    async def get_map_views_not_owned_by(self, owner_id: str) -> List[VillageMapView]:
+        """Get map views for every village that is not owned by the given user"""
+        return await self.get_views({"owner_id": {"$ne": owner_id}}, VillageMapView)
     
     async def get_by_location(self, x: int, y: int) -> Optional[Village]:
         """Get village at specific location"""
@@ -42,6 +105,7 @@ class VillageRepository:
             village_data = await db[self.COLLECTION].find_one({"location.x": x, "location.y": y})
             if village_data is None:
                 return None
+            village_cache.put(village_data)
             
             # Convert DB dict to Pydantic model
             village_model = VillageInDB(**village_data)
@@ -49,31 +113,91 @@ class VillageRepository:
             # Wrap in domain object
             return Village(village_model)
     
+    def build_update(self, village: Village) -> Tuple[Dict[str, Any], List[Dict[str, Any]]]:
+        """
+        Build the MongoDB update for a village's unsaved changes.
+        
+        Only the paths the village recorded as changed are written; villages
+        marked as changed without paths are saved in full.
+        Every update increments the document version.
+        
+        Returns:
+            Tuple of (update document, array filters)
+        """
+        pending = village.get_pending_update()
+        if pending is not None:
+            update, array_filters = pending
+            update["$inc"] = {"version": 1}
+            return update, array_filters
+            
+        # The model was validated when loaded, strict mode checks it again
+        village_dict = dump_for_write(village._data, "village", village.to_dict())
+            
+        # Remove the _id field from the update dict, the version is incremented instead of set
+        village_dict.pop("_id", None)
+        village_dict.pop("version", None)
+        return {"$set": village_dict, "$inc": {"version": 1}}, []
+    
+    def version_filter(self, village: Village) -> Dict[str, Any]:
+        """Filter matching the village only if nobody saved it since it was loaded"""
+        return version_filter(village.id, village.version)
+    
     async def save(self, village: Village) -> bool:
-        """Save changes to a village back to the database"""
+        """
+        Save changes to a village back to the database.
+        
+        Raises:
+            ConcurrentModificationError: If the village was saved by someone else since it was loaded
+        """
         if not village.has_changes():
             return True
             
-        # Convert to dict and validate against schema
-        try:
-            village_dict = village.to_dict()
-            # Validate against schema
-            VillageInDB(**village_dict)
-            
-            # Remove the _id field from the update dict
-            if "_id" in village_dict:
-                village_dict.pop("_id")
-                
-            async with get_db() as db:
-                result = await db[self.COLLECTION].update_one(
-                    {"_id": village.id},
-                    {"$set": village_dict}
-                )
-                
-                return result.modified_count > 0
-        except Exception as e:
-            # If validation fails, raise an error
-            raise ValueError(f"Invalid village data: {str(e)}")
+        update, array_filters = self.build_update(village)
+        async with get_db() as db:
+            result = await db[self.COLLECTION].update_one(
+                self.version_filter(village),
+                update,
+                array_filters=array_filters or None
+            )
+            
+        if result.matched_count == 0:
+            # The cached copy is as stale as this one, let the retry read the database
+            village_cache.invalidate(village.id)
+            raise ConcurrentModificationError(self.COLLECTION, village.id, village.version)
+            
+        village.mark_as_saved()
+        village_cache.put(village.to_dict())
+        return result.modified_count > 0
+    
+    async def bulk_save(self, villages: List[Village]) -> int:
+        """
+        Save the changes of many villages with a single bulk_write.
+        
+        Every update is compare-and-set on the village version; villages that
+        were written by someone else in the meantime are left untouched. All
+        the villages are marked as saved and their cached copies dropped, so
+        the ones that lost the race must be reloaded before being used again.
+        
+        Returns:
+            Number of villages written
+        """
+        villages = [village for village in villages if village.has_changes()]
+        if not villages:
+            return 0
+            
+        operations = []
+        for village in villages:
+            update, array_filters = self.build_update(village)
+            operations.append(UpdateOne(self.version_filter(village), update, array_filters=array_filters or None))
+            
+        async with get_db() as db:
+            result = await db[self.COLLECTION].bulk_write(operations, ordered=False)
+            
+        # The result doesn't say which updates lost the race, so no cached copy can be trusted
+        for village in villages:
+            village_cache.invalidate(village.id)
+            village.mark_as_saved()
+        return result.matched_count
     
     async def create(self, village_data: Dict[str, Any]) -> Optional[Village]:
         """Create a new village"""
@@ -81,43 +205,33 @@ class VillageRepository:
         if "_id" not in village_data:
             village_data["_id"] = str(ObjectId())
             
-        # Validate against schema before inserting
+        # Validate against schema before inserting, the result is reused for the domain object
         try:
-            VillageInDB(**village_data)
+            village_model = VillageInDB(**village_data)
         except Exception as e:
             raise ValueError(f"Invalid village data: {str(e)}")
             
         async with get_db() as db:
-            # Insert into database
-            await db[self.COLLECTION].insert_one(village_data)
+            # Insert into database; the unique location index rejects a tile that is already taken
+            try:
+                await db[self.COLLECTION].insert_one(village_data)
+            except DuplicateKeyError:
+                return None
             
             # Return a new Village domain object
-            village_model = VillageInDB(**village_data)
+            village_cache.put(village_model.dict(by_alias=True))
             return Village(village_model)
     
     async def delete(self, village_id: str) -> bool:
         """Delete a village"""
         async with get_db() as db:
             result = await db[self.COLLECTION].delete_one({"_id": village_id})
-            return result.deleted_count > 0
+        village_cache.invalidate(village_id)
+        return result.deleted_count > 0
     
     async def get_all(self) -> List[Village]:
-        """Get all villages in the game world"""
-        async with get_db() as db:
-            cursor = db[self.COLLECTION].find({})
-            villages_data = await cursor.to_list(length=1000)  # Limit to 1000 villages
-            
-            # Convert to domain objects
-            villages = []
-            for village_data in villages_data:
-                try:
-                    village_model = VillageInDB(**village_data)
-                    villages.append(Village(village_model))
-                except Exception as e:
-                    print(f"Error converting village data: {str(e)}")
-                    continue
-                
-            return villages
+        """Get all villages in the game world (prefer iter_all for world-wide scans)"""
+        return [village async for village in self.iter_all()]
     
     async def find_by_location(self, x: int, y: int) -> Optional[Village]:
         """Find a village at the given location coordinates"""
@@ -128,6 +242,7 @@ class VillageRepository:
             })
             
             if village_data:
+                village_cache.put(village_data)
                 # Convert DB dict to Pydantic model
                 village_model = VillageInDB(**village_data)
                 # Wrap in domain object
@@ -1,5 +1,5 @@
 from datetime import datetime
-from typing import Dict, List, Optional
+from typing import Any, Dict, List, Optional
 from pydantic import BaseModel, Field
 from enum import Enum
 
@@ -92,6 +92,15 @@ class UserInDB(BaseModel):
             datetime: lambda v: v.isoformat()
         }
 
+class UserPublicView(BaseModel):
+    """Lightweight projection of a user with only the publicly visible fields."""
+    id: str = Field(alias="_id")
+    family_name: str
+    color: str
+
+    class Config:
+        allow_population_by_field_name = True
+
 class TroopTrainingTask(BaseModel):
     id: str
     troop_type: TroopType
@@ -100,6 +109,11 @@ class TroopTrainingTask(BaseModel):
     completion_time: datetime
     processed: bool = Field(default=False)
 
+class AppliedTransfer(BaseModel):
+    """Resources a troop action moved into or out of a village"""
+    action_id: str
+    resources: Dict[str, float] = Field(default_factory=dict)
+
 class VillageInDB(BaseModel):
     """Schema for village as stored in database."""
     id: str = Field(alias="_id")
@@ -114,6 +128,8 @@ class VillageInDB(BaseModel):
     updated_at: datetime
     construction_tasks: List[ConstructionTask] = Field(default_factory=list)
     troop_training_tasks: List[TroopTrainingTask] = Field(default_factory=list)
+    applied_transfers: List[AppliedTransfer] = Field(default_factory=list)  # The latest ones, see Village.record_transfer
+    version: int = Field(default=0, ge=0)  # Incremented on every write, used for compare-and-set
 
     class Config:
         allow_population_by_field_name = True
@@ -121,6 +137,16 @@ class VillageInDB(BaseModel):
             datetime: lambda v: v.isoformat()
         }
 
+class VillageMapView(BaseModel):
+    """Lightweight projection of a village with only the fields shown on the map."""
+    id: str = Field(alias="_id")
+    name: str
+    location: Location
+    owner_id: str
+
+    class Config:
+        allow_population_by_field_name = True
+
 class TroopInDB(BaseModel):
     """Schema for troop as stored in database."""
     id: str = Field(alias="_id")
@@ -132,6 +158,7 @@ class TroopInDB(BaseModel):
     backpack: Resources = Field(default_factory=Resources)  # Resources being carried
     created_at: datetime
     updated_at: datetime
+    version: int = Field(default=0, ge=0)  # Incremented on every write, used for compare-and-set
 
     class Config:
         allow_population_by_field_name = True
@@ -159,4 +186,23 @@ class TroopActionTaskInDB(BaseModel):
         allow_population_by_field_name = True
         json_encoders = {
             datetime: lambda v: v.isoformat()
-        } 
\ No newline at end of file
+        } 
+
+class ArchivedTaskKind(str, Enum):
+    CONSTRUCTION = "construction"
+    TROOP_TRAINING = "troop_training"
+
+class TaskHistoryInDB(BaseModel):
+    """Schema for a processed village task moved out of the village into the task history."""
+    id: str = Field(alias="_id")  # Same as the task ID, so archiving a task twice is harmless
+    village_id: str
+    kind: ArchivedTaskKind
+    task: Dict[str, Any]  # The task as it was stored in the village
+    completion_time: datetime
+    archived_at: datetime
+
+    class Config:
+        allow_population_by_field_name = True
+        json_encoders = {
+            datetime: lambda v: v.isoformat()
+        }
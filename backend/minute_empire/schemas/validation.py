@@ -0,0 +1,31 @@
+import os
+from typing import Dict, Any, Optional
+from pydantic import BaseModel
+
+# Re-validate in-memory models before every write (for migrations and tests)
+STRICT_MODEL_VALIDATION = os.getenv("STRICT_MODEL_VALIDATION", "false").lower() in ("1", "true", "yes")
+
+def dump_for_write(model: BaseModel, label: str, data: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """
+    Get the document to write for a model that was already validated.
+
+    The model was validated when it was read or created, so its dump is trusted
+    as is. With STRICT_MODEL_VALIDATION the dump is validated again, which
+    catches fields that were assigned invalid values after loading.
+
+    Args:
+        model: The model being written
+        label: Name of the entity, used in error messages
+        data: The model's already dumped document, if the caller has it
+
+    Raises:
+        ValueError: In strict mode, if the document does not match the schema
+    """
+    if data is None:
+        data = model.dict(by_alias=True)
+    if STRICT_MODEL_VALIDATION:
+        try:
+            type(model)(**data)
+        except Exception as e:
+            raise ValueError(f"Invalid {label} data: {str(e)}")
+    return data
@@ -21,6 +21,9 @@ from minute_empire.services.authentication_service import AuthenticationService
 class RegistrationService:
     """Service for handling user and village registration"""
     
+    # How many times to pick a new location when another registration claims ours first
+    MAX_VILLAGE_PLACEMENT_ATTEMPTS = 5
+    
     def __init__(self):
         self.user_repository = UserRepository()
         self.village_repository = VillageRepository()
@@ -43,8 +46,8 @@ class RegistrationService:
         
         raise ValueError(f"Could not find available location after {max_attempts} attempts")
     
-    async def _initialize_village(self, owner_id: str, name: str, location: Location) -> VillageInDB:
-        """Create a new village with initial setup."""
+    async def _initialize_village(self, owner_id: str, name: str, location: Location) -> Optional[VillageInDB]:
+        """Create a new village with initial setup. Returns None if the location was taken meanwhile."""
         # Create initial resource fields
         initial_fields = []
         
@@ -76,12 +79,8 @@ class RegistrationService:
             "updated_at": now
         }
         
-        # Create village using repository
-        village = await self.village_repository.create(village_data)
-        if village is None:
-            raise ValueError(f"Failed to create village at location {location}")
-            
-        return village
+        # Create village using repository (None if the unique location index rejected it)
+        return await self.village_repository.create(village_data)
     
     async def register_user_and_village(
         self,
@@ -136,11 +135,12 @@ class RegistrationService:
             if user is None:
                 raise ValueError("Failed to create user")
             
-            # Generate village location
-            location = await self._generate_available_location()
-            
-            # Create village
-            village = await self._initialize_village(user.id, village_name, location)
+            # Create village, picking a new location if a concurrent registration took ours
+            for _ in range(self.MAX_VILLAGE_PLACEMENT_ATTEMPTS):
+                location = await self._generate_available_location()
+                village = await self._initialize_village(user.id, village_name, location)
+                if village is not None:
+                    break
             if village is None:
                 raise ValueError("Failed to create village")
             
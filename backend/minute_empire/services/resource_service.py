@@ -4,12 +4,23 @@ from minute_empire.domain.village import Village
 from minute_empire.repositories.village_repository import VillageRepository
 from minute_empire.schemas.schemas import TaskType, ConstructionTask, TroopTrainingTask
 from minute_empire.services.timed_tasks_service import TimedConstructionService
+import os
+import time
 import logging
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Settle every village's stored resources at startup, right after a rescan has completed the
+# overdue tasks; otherwise settlement is a maintenance action (db/scripts/settle_resources.py)
+SETTLE_RESOURCES_ON_STARTUP = os.getenv("SETTLE_RESOURCES_ON_STARTUP", "false").lower() in ("1", "true", "yes")
+# Villages written per bulk_write when settling the whole world
+RESOURCE_SETTLEMENT_BATCH_SIZE = int(os.getenv("RESOURCE_SETTLEMENT_BATCH_SIZE", "1000"))
+
+# Task arrays don't affect rates or capacities, settlement doesn't need to fetch them
+SETTLEMENT_PROJECTION = {"construction_tasks": 0, "troop_training_tasks": 0}
+
 class ResourceService:
     """Service for resource-related operations"""
     
@@ -17,86 +28,88 @@ class ResourceService:
         self.village_repository = VillageRepository()
         self.timed_tasks_service = TimedConstructionService()
     
-    async def update_village_resources(self, village_id: str) -> Optional[Village]:
+    async def project_village_resources(self, village_id: str) -> Optional[Village]:
         """
-        Update a village's resources based on elapsed time since last update.
-        Simplified version that just calculates resources from last update to now.
+        Get a village with its resources evaluated at the current time.
+        
+        The balances are computed in closed form from the stored snapshot and
+        nothing is written: the snapshot is only persisted when the rates or
+        amounts change (task completion, deductions, steals and deposits).
         
         Args:
             village_id: The ID of the village
             
         Returns:
-            Updated Village object, or None if village not found
+            Village with current resources, or None if village not found
         """
-        logger.info(f"Updating resources for village: {village_id}")
-        # Get the village
         village = await self.village_repository.get_by_id(village_id)
         if village is None:
             logger.error(f"Village not found: {village_id}")
             return None
         
-        try:
-            # Calculate elapsed time since last update
-            now = datetime.utcnow()
-            last_update = village.res_update_at
-            hours_elapsed = (now - last_update).total_seconds() / 3600
-            
-            if hours_elapsed <= 0:
-                logger.info(f"No time elapsed for village {village_id}, skipping update")
-                return village
-                
-            logger.info(f"Updating resources for village {village_id} for {hours_elapsed:.2f} hours")
-            
-            # Update resources for elapsed time
-            village.update_resources(hours_elapsed)
-            
-            # Update the resource update timestamp
-            village.res_update_at = now
-            
-            # Save changes to database
-            await self.village_repository.save(village)
-            logger.info(f"Successfully saved updated resources for village {village_id}")
-            
-            return village
-            
-        except Exception as e:
-            logger.error(f"Error updating village {village_id}: {str(e)}")
-            import traceback
-            logger.error(traceback.format_exc())
-            return None
+        village.project_resources(datetime.utcnow())
+        return village
     
-    async def update_all_user_villages(self, user_id: str) -> List[Village]:
+    async def project_all_user_villages(self, user_id: str) -> List[Village]:
         """
-        Update resources for all villages owned by a user.
+        Get all villages owned by a user with their resources evaluated at the current time.
         
         Args:
             user_id: The ID of the user
             
         Returns:
-            List of updated Village domain objects
+            List of Village domain objects with current resources
         """
-        logger.info(f"Updating all villages for user: {user_id}")
-        # Get all user villages
-        villages = await self.village_repository.get_by_owner(user_id)
-        if not villages:  # Return empty list if no villages
-            logger.info(f"No villages found for user {user_id}")
-            return []
-            
-        logger.info(f"Found {len(villages)} villages for user {user_id}")
-        updated_villages = []
+        now = datetime.utcnow()
+        villages = []
+        async for village in self.village_repository.iter_by_owner(user_id):
+            village.project_resources(now)
+            villages.append(village)
+        return villages
+    
+    async def settle_all_villages(self, target_time: Optional[datetime] = None,
+                                  batch_size: int = RESOURCE_SETTLEMENT_BATCH_SIZE) -> Dict[str, Any]:
+        """
+        Advance the stored resource snapshot of every village to a point in time.
         
-        # Update each village
-        for village in villages:
-            if village is None:  # Skip if village is None
-                continue
-                
-            logger.info(f"Processing village: {village.id}")
-            updated_village = await self.update_village_resources(village.id)
-            if updated_village:
-                updated_villages.append(updated_village)
+        Villages are streamed without their task arrays, settled in memory with
+        the closed-form balances and written back with one bulk_write per batch,
+        instead of a read and a save per village. Villages written concurrently
+        keep their newer snapshot.
+        
+        Args:
+            target_time: Time to settle to, defaults to now
+            batch_size: Villages per bulk_write
             
-        logger.info(f"Successfully updated {len(updated_villages)} villages")
-        return updated_villages
+        Returns:
+            Dict with the number of villages checked and settled, and conflicts
+        """
+        if target_time is None:
+            target_time = datetime.utcnow()
+        started = time.monotonic()
+        stats = {"villages_checked": 0, "villages_settled": 0, "conflicts": 0, "batches": 0}
+        
+        batch = []
+        async def flush() -> None:
+            written = await self.village_repository.bulk_save(batch)
+            stats["villages_settled"] += written
+            stats["conflicts"] += len(batch) - written
+            stats["batches"] += 1
+            batch.clear()
+        
+        async for village in self.village_repository.iter_villages({}, SETTLEMENT_PROJECTION):
+            stats["villages_checked"] += 1
+            if village.settle_resources(target_time):
+                batch.append(village)
+            if len(batch) >= batch_size:
+                await flush()
+        if batch:
+            await flush()
+        
+        stats["duration_seconds"] = round(time.monotonic() - started, 3)
+        logger.info(f"Settled resources of {stats['villages_settled']} villages until {target_time} "
+                    f"in {stats['duration_seconds']}s ({stats['conflicts']} conflicts)")
+        return stats
     
     async def calculate_time_to_resource_goal(self, village_id: str, resource_goals: Dict[str, float]) -> Dict[str, float]:
         """
@@ -109,8 +122,8 @@ class ResourceService:
         Returns:
             Dictionary with hours needed for each resource
         """
-        # Get the village
-        village = await self.village_repository.get_by_id(village_id)
+        # Get the village with its current resources
+        village = await self.project_village_resources(village_id)
         if village is None:
             return {}
         
@@ -0,0 +1,194 @@
+"""
+Instrumentation of the task scheduler, exported by /metrics in the Prometheus
+text format and summarised by /debug/scheduler.
+
+Everything is kept in memory and counts from the start of the process.
+"""
+
+import bisect
+import time
+from collections import deque
+from typing import Any, Deque, Dict, List, Sequence, Tuple
+
+# Upper bounds, in seconds, of the histogram buckets
+LAG_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+EXECUTION_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Queue depth samples: at most one every DEPTH_SAMPLE_SECONDS, the last DEPTH_SAMPLES of them (an hour)
+DEPTH_SAMPLE_SECONDS = 10
+DEPTH_SAMPLES = 360
+
+class Histogram:
+    """Cumulative histogram with fixed buckets, like a Prometheus histogram"""
+
+    def __init__(self, buckets: Sequence[float]):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)  # the last one is +Inf
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    def quantile(self, q: float) -> float:
+        """Upper bound of the bucket holding the q-quantile, capped at the maximum"""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank:
+                return min(self.buckets[index], self.max) if index < len(self.buckets) else self.max
+        return self.max
+
+    def summary(self) -> Dict[str, float]:
+        """Count, average, p50, p99 and maximum, in milliseconds"""
+        return {
+            "count": self.count,
+            "avg_ms": round(self.sum / self.count * 1000, 3) if self.count else 0.0,
+            "p50_ms": round(self.quantile(0.5) * 1000, 3),
+            "p99_ms": round(self.quantile(0.99) * 1000, 3),
+            "max_ms": round(self.max * 1000, 3)
+        }
+
+    def prometheus(self, name: str, labels: str = "") -> List[str]:
+        """Sample lines of the histogram; labels is a rendered label list without braces"""
+        lines = []
+        cumulative = 0
+        prefix = f"{labels}," if labels else ""
+        for bound, count in zip(self.buckets + (float("inf"),), self.counts):
+            cumulative += count
+            le = "+Inf" if bound == float("inf") else repr(bound)
+            lines.append(f'{name}_bucket{{{prefix}le="{le}"}} {cumulative}')
+        suffix = f"{{{labels}}}" if labels else ""
+        lines.append(f"{name}_sum{suffix} {self.sum}")
+        lines.append(f"{name}_count{suffix} {self.count}")
+        return lines
+
+def _label(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+class SchedulerMetrics:
+    """
+    Lag, execution time, throughput and queue depth of the task scheduler.
+
+    Lag is how long after it was due a task started running (from when it
+    was scheduled, for tasks scheduled already overdue). It is the sum of the
+    dispatch latency (due to handed to the workers) of the task and the queue
+    wait (handed to the workers to started) of its job, also kept separately;
+    a batch waits once, but counts a lag per task. Execution time, completions and
+    failures are kept per task kind; a batch counts as one completion or
+    failure per task, each with an equal share of its execution time.
+    """
+
+    def __init__(self):
+        self.lag = Histogram(LAG_BUCKETS)
+        self.dispatch_latency = Histogram(LAG_BUCKETS)
+        self.queue_wait = Histogram(LAG_BUCKETS)
+        self.execution: Dict[str, Histogram] = {}
+        self.completed: Dict[str, int] = {}
+        self.failed: Dict[str, int] = {}
+        # (time.time(), pending, queued) samples of the queue depth
+        self.depth: Deque[Tuple[float, int, int]] = deque(maxlen=DEPTH_SAMPLES)
+        self._next_depth_sample = 0.0
+
+    def record_lag(self, lag_seconds: float) -> None:
+        self.lag.observe(max(lag_seconds, 0.0))
+
+    def record_dispatch(self, latency_seconds: float) -> None:
+        self.dispatch_latency.observe(max(latency_seconds, 0.0))
+
+    def record_queue_wait(self, wait_seconds: float) -> None:
+        self.queue_wait.observe(max(wait_seconds, 0.0))
+
+    def executed(self) -> Dict[str, float]:
+        """Tasks run, of every kind, with their total and longest execution time in seconds"""
+        histograms = self.execution.values()
+        return {
+            "count": sum(histogram.count for histogram in histograms),
+            "sum": sum(histogram.sum for histogram in histograms),
+            "max": max((histogram.max for histogram in histograms), default=0.0)
+        }
+
+    def record_execution(self, kinds: List[str], seconds: float, failed: bool) -> None:
+        """Record a job that ran the tasks of the given kinds, one entry per task"""
+        share = seconds / len(kinds)
+        counters = self.failed if failed else self.completed
+        for kind in kinds:
+            if kind not in self.execution:
+                self.execution[kind] = Histogram(EXECUTION_BUCKETS)
+            self.execution[kind].observe(share)
+            counters[kind] = counters.get(kind, 0) + 1
+
+    def sample_depth(self, pending: int, queued: int) -> None:
+        """Keep a queue depth sample, unless one was taken less than DEPTH_SAMPLE_SECONDS ago"""
+        now = time.monotonic()
+        if now < self._next_depth_sample:
+            return
+        self._next_depth_sample = now + DEPTH_SAMPLE_SECONDS
+        self.depth.append((time.time(), pending, queued))
+
+    def summary(self) -> Dict[str, Any]:
+        """Lag and per-kind figures for the debug endpoint"""
+        return {
+            "lag": self.lag.summary(),
+            "dispatch_latency": self.dispatch_latency.summary(),
+            "queue_wait": self.queue_wait.summary(),
+            "kinds": {
+                kind: {
+                    "completed": self.completed.get(kind, 0),
+                    "failed": self.failed.get(kind, 0),
+                    "execution": self.execution[kind].summary()
+                }
+                for kind in sorted(self.execution)
+            }
+        }
+
+    def depth_history(self) -> List[Dict[str, Any]]:
+        return [{"time": at, "pending": pending, "queued": queued} for at, pending, queued in self.depth]
+
+    def prometheus(self, gauges: Dict[str, Tuple[str, float]], counters: Dict[str, Tuple[str, float]],
+                   prefix: str = "minute_empire_scheduler") -> str:
+        """
+        Render the metrics in the Prometheus text format.
+
+        Args:
+            gauges: Current values to export alongside, name -> (help text, value)
+            counters: Totals kept by the scheduler itself, name -> (help text, value)
+            prefix: Prefix of every metric name
+        """
+        lines = []
+
+        def header(name: str, kind: str, help_text: str) -> None:
+            lines.append(f"# HELP {prefix}_{name} {help_text}")
+            lines.append(f"# TYPE {prefix}_{name} {kind}")
+
+        for metrics, kind in ((gauges, "gauge"), (counters, "counter")):
+            for name, (help_text, value) in metrics.items():
+                header(name, kind, help_text)
+                lines.append(f"{prefix}_{name} {value}")
+
+        for name, histogram, help_text in (
+            ("lag_seconds", self.lag, "Time from when a task was due to when it started running"),
+            ("dispatch_latency_seconds", self.dispatch_latency, "Time from when a task was due to when it was dispatched"),
+            ("queue_wait_seconds", self.queue_wait, "Time a dispatched job waited for a worker or its serial key")
+        ):
+            header(name, "histogram", help_text)
+            lines.extend(histogram.prometheus(f"{prefix}_{name}"))
+
+        header("execution_seconds", "histogram", "Execution time of the tasks, by kind")
+        for kind in sorted(self.execution):
+            lines.extend(self.execution[kind].prometheus(f"{prefix}_execution_seconds", f'kind="{_label(kind)}"'))
+
+        for name, per_kind, help_text in (("tasks_completed_total", self.completed, "Tasks that ran successfully, by kind"),
+                                          ("tasks_failed_total", self.failed, "Tasks whose handler raised, by kind")):
+            header(name, "counter", help_text)
+            for kind in sorted(per_kind):
+                lines.append(f'{prefix}_{name}{{kind="{_label(kind)}"}} {per_kind[kind]}')
+
+        return "\n".join(lines) + "\n"
@@ -0,0 +1,281 @@
+"""
+Pending-task queues behind the task scheduler, selected with SCHEDULER_BACKEND.
+
+Both store the scheduler's entries, tuples that start with (timestamp,
+sequence, task_id, execution_time, deadline, ...), where deadline is the
+time.monotonic() time the task is due. They share one interface:
+
+    push(entry)          add the entry of a task ID that is not queued
+    get(task_id)         the queued entry of a task ID, or None
+    remove(task_id)      drop and return the entry of a task ID, or None
+    peek()               the entry that is due first, or None
+    due_time(entry)      monotonic time from which pop_due() returns the entry
+    pop_due(now)         remove and return every entry due by now, in
+                         (timestamp, sequence) order
+    upcoming(limit)      the first limit entries in due order, without removing them
+    stats()              backend-specific sizes for the debug endpoint
+"""
+
+import heapq
+import math
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+class HeapTaskQueue:
+    """
+    Binary heap ordered by (timestamp, sequence), with lazy deletion.
+
+    Inserting costs O(log n). Removing a task only drops it from the map in
+    O(1); its heap entry becomes a tombstone that is skipped when it reaches
+    the head, and the heap is rebuilt once tombstones outnumber the live
+    entries.
+    """
+
+    def __init__(self):
+        self.heap: List[tuple] = []
+        self.entries: Dict[str, tuple] = {}  # task_id -> live heap entry
+        self.tombstones = 0  # heap entries that are no longer live
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def _is_live(self, entry: tuple) -> bool:
+        return self.entries.get(entry[2]) is entry
+
+    def _drop_dead_head(self) -> None:
+        """Pop the tombstones sitting at the head of the heap"""
+        while self.heap and not self._is_live(self.heap[0]):
+            heapq.heappop(self.heap)
+            self.tombstones -= 1
+
+    def push(self, entry: tuple) -> None:
+        heapq.heappush(self.heap, entry)
+        self.entries[entry[2]] = entry
+
+    def get(self, task_id: str) -> Optional[tuple]:
+        return self.entries.get(task_id)
+
+    def remove(self, task_id: str) -> Optional[tuple]:
+        entry = self.entries.pop(task_id, None)
+        if entry is None:
+            return None
+        self.tombstones += 1
+        if self.tombstones > len(self.entries):
+            self.heap = list(self.entries.values())
+            heapq.heapify(self.heap)
+            self.tombstones = 0
+        return entry
+
+    def peek(self) -> Optional[tuple]:
+        self._drop_dead_head()
+        return self.heap[0] if self.heap else None
+
+    def due_time(self, entry: tuple) -> float:
+        return entry[4]
+
+    def pop_due(self, now: float) -> List[tuple]:
+        due = []
+        while self.heap and self.heap[0][4] <= now:
+            entry = heapq.heappop(self.heap)
+            if not self._is_live(entry):
+                self.tombstones -= 1
+                continue
+            del self.entries[entry[2]]
+            due.append(entry)
+        return due
+
+    def upcoming(self, limit: int) -> List[tuple]:
+        return heapq.nsmallest(limit, self.entries.values())
+
+    def stats(self) -> Dict[str, Any]:
+        return {"heap_size": len(self.heap), "tombstones": self.tombstones}
+
+# Sentinel for a head that has to be looked up again
+_UNKNOWN = object()
+
+class TimingWheelTaskQueue:
+    """
+    Hierarchical timing wheel.
+
+    Time is cut into ticks of `resolution` seconds and every level has
+    2**bits slots: a slot of level 0 holds the tasks of one tick of the
+    current level-0 round, a slot of level 1 the tasks of one whole level-0
+    round of the current level-1 round, and so on. Each slot is a dict keyed
+    by task ID, so inserting and removing a task are O(1). When the wheel
+    reaches the start of a round, the slot of that round one level up is
+    cascaded, its tasks redistributed to the lower levels, and empty slots
+    and levels are skipped. A task is returned by pop_due() once the tick its
+    deadline falls in has ended, so never early and at most one resolution
+    late.
+
+    The earliest entry of every slot is cached, so peek() only scans slot
+    occupancy, not the tasks.
+
+    With the defaults (10 ms ticks, 6 levels of 64 slots) the wheel spans
+    about 21 years; tasks farther away go to the top level and are placed
+    again every time their slot is cascaded.
+    """
+
+    def __init__(self, resolution: float = 0.01, bits: int = 6, levels: int = 6):
+        self.resolution = resolution
+        self.bits = bits
+        self.size = 1 << bits
+        self.mask = self.size - 1
+        self.levels = levels
+        self.wheels: List[List[Dict[str, tuple]]] = [[{} for _ in range(self.size)] for _ in range(levels)]
+        # Earliest entry of each slot, None when it has to be looked up again
+        self.slot_min: List[List[Optional[tuple]]] = [[None] * self.size for _ in range(levels)]
+        self.counts = [0] * levels  # tasks held by each level
+        self.expired: Dict[str, tuple] = {}  # tasks whose tick has passed, waiting for pop_due()
+        self.where: Dict[str, Tuple[int, int]] = {}  # task_id -> (level, slot index), level -1 for expired
+        self.current_tick = math.floor(time.monotonic() / resolution)  # last tick processed
+        self._head: Any = _UNKNOWN
+
+    def __len__(self) -> int:
+        return len(self.where)
+
+    def _tick(self, entry: tuple) -> int:
+        return math.ceil(entry[4] / self.resolution)
+
+    def _key(self, entry: tuple) -> tuple:
+        return (self._tick(entry), entry[0], entry[1])
+
+    def _place(self, entry: tuple) -> None:
+        """Put an entry in the slot of its tick, relative to the current tick"""
+        task_id = entry[2]
+        tick = self._tick(entry)
+        if tick <= self.current_tick:
+            self.expired[task_id] = entry
+            self.where[task_id] = (-1, 0)
+            return
+
+        level = 0
+        # The lowest level whose round, one level up, contains both ticks
+        while level < self.levels - 1 and (tick >> (self.bits * (level + 1))) != (self.current_tick >> (self.bits * (level + 1))):
+            level += 1
+        index = (tick >> (self.bits * level)) & self.mask
+        slot = self.wheels[level][index]
+        if not slot:
+            self.slot_min[level][index] = entry
+        else:
+            current = self.slot_min[level][index]
+            if current is not None and self._key(entry) < self._key(current):
+                self.slot_min[level][index] = entry
+        slot[task_id] = entry
+        self.counts[level] += 1
+        self.where[task_id] = (level, index)
+
+    def push(self, entry: tuple) -> None:
+        self._place(entry)
+        head = self._head
+        if head is not _UNKNOWN and (head is None or self._key(entry) < self._key(head)):
+            self._head = entry
+
+    def get(self, task_id: str) -> Optional[tuple]:
+        location = self.where.get(task_id)
+        if location is None:
+            return None
+        level, index = location
+        return self.expired[task_id] if level < 0 else self.wheels[level][index][task_id]
+
+    def remove(self, task_id: str) -> Optional[tuple]:
+        location = self.where.pop(task_id, None)
+        if location is None:
+            return None
+        level, index = location
+        if level < 0:
+            entry = self.expired.pop(task_id)
+        else:
+            entry = self.wheels[level][index].pop(task_id)
+            self.counts[level] -= 1
+            if self.slot_min[level][index] is entry:
+                self.slot_min[level][index] = None
+        if entry is self._head:
+            self._head = _UNKNOWN
+        return entry
+
+    def _take(self, level: int, index: int) -> Dict[str, tuple]:
+        """Empty a slot, returning its tasks"""
+        slot = self.wheels[level][index]
+        if slot:
+            self.wheels[level][index] = {}
+            self.slot_min[level][index] = None
+            self.counts[level] -= len(slot)
+        return slot
+
+    def _advance(self, target: int) -> None:
+        """Process every tick up to target, moving the tasks that became due to expired"""
+        level0 = self.wheels[0]
+        while self.current_tick < target:
+            # Jump straight to the next tick where something can happen
+            lowest = next((level for level, count in enumerate(self.counts) if count), None)
+            if lowest is None:
+                self.current_tick = target
+                break
+            if lowest == 0:
+                # The next occupied slot of this level-0 round, or the start of the next round
+                tick = self.current_tick + 1
+                round_end = ((self.current_tick >> self.bits) + 1) << self.bits
+                while tick < round_end and tick < target and not level0[tick & self.mask]:
+                    tick += 1
+            else:
+                shift = self.bits * lowest
+                tick = ((self.current_tick >> shift) + 1) << shift
+            tick = min(tick, target)
+            self.current_tick = tick
+
+            # At the start of a round, cascade the slot one level up (highest levels first)
+            if tick & self.mask == 0:
+                for level in range(self.levels - 1, 0, -1):
+                    if tick & ((1 << (self.bits * level)) - 1) == 0:
+                        for entry in self._take(level, (tick >> (self.bits * level)) & self.mask).values():
+                            self._place(entry)
+            for task_id, entry in self._take(0, tick & self.mask).items():
+                self.expired[task_id] = entry
+                self.where[task_id] = (-1, 0)
+
+    def peek(self) -> Optional[tuple]:
+        if self._head is _UNKNOWN:
+            self._head = self._find_head()
+        return self._head
+
+    def _find_head(self) -> Optional[tuple]:
+        """The earliest entry: the expired ones, then the first occupied slot, lowest level first"""
+        if self.expired:
+            return min(self.expired.values())
+        for level in range(self.levels):
+            if not self.counts[level]:
+                continue
+            digit = (self.current_tick >> (self.bits * level)) & self.mask
+            order = range(digit + 1, self.size)
+            if level == self.levels - 1:
+                # The top level wraps around for tasks beyond the span of the wheel
+                order = list(order) + list(range(0, digit + 1))
+            for index in order:
+                slot = self.wheels[level][index]
+                if slot:
+                    if self.slot_min[level][index] is None:
+                        self.slot_min[level][index] = min(slot.values(), key=self._key)
+                    return self.slot_min[level][index]
+        return None
+
+    def due_time(self, entry: tuple) -> float:
+        return self._tick(entry) * self.resolution
+
+    def pop_due(self, now: float) -> List[tuple]:
+        self._advance(math.floor(now / self.resolution))
+        if not self.expired:
+            return []
+        due = sorted(self.expired.values())
+        for entry in due:
+            del self.where[entry[2]]
+        self.expired = {}
+        self._head = _UNKNOWN
+        return due
+
+    def upcoming(self, limit: int) -> List[tuple]:
+        entries = (self.get(task_id) for task_id in self.where)
+        return heapq.nsmallest(limit, entries, key=self._key)
+
+    def stats(self) -> Dict[str, Any]:
+        return {"wheel_levels": self.counts[:], "expired": len(self.expired), "tick": self.current_tick}
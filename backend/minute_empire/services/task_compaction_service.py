@@ -0,0 +1,82 @@
+from typing import Dict, Any
+from minute_empire.domain.village import Village
+from minute_empire.repositories.village_repository import VillageRepository
+from minute_empire.repositories.task_history_repository import TaskHistoryRepository
+from minute_empire.repositories.concurrency import ConcurrentModificationError, retry_on_conflict
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Villages that still carry processed tasks in their documents
+PROCESSED_TASKS_QUERY = {"$or": [
+    {"construction_tasks.processed": True},
+    {"troop_training_tasks.processed": True}
+]}
+
+class TaskCompactionService:
+    """
+    Moves processed construction and troop training tasks out of the village
+    documents into the task history.
+
+    Task completion already does this inline (ARCHIVE_PROCESSED_TASKS); this
+    service backfills the villages written before that, or with it disabled.
+    """
+
+    def __init__(self):
+        self.village_repository = VillageRepository()
+        self.task_history_repository = TaskHistoryRepository()
+
+    async def _compact(self, village: Village) -> int:
+        """Archive the processed tasks, then save the village without them"""
+        archived = village.compact_processed_tasks()
+        if not archived:
+            return 0
+        # Archived first: if the save fails the tasks are still on the village and
+        # a rerun archives them again (an idempotent upsert), never losing them
+        count = await self.task_history_repository.archive(village.id, archived)
+        await self.village_repository.save(village)
+        return count
+
+    @retry_on_conflict
+    async def compact_village(self, village_id: str) -> int:
+        """
+        Archive the processed tasks of one village.
+
+        Returns:
+            Number of tasks moved to the history
+        """
+        village = await self.village_repository.get_by_id(village_id)
+        if not village:
+            return 0
+        return await self._compact(village)
+
+    async def compact_all_villages(self) -> Dict[str, Any]:
+        """
+        Archive the processed tasks of every village that still has some.
+
+        Villages are streamed and compacted one by one; a village written
+        concurrently is reloaded and compacted again.
+
+        Returns:
+            Dict with the number of villages compacted, tasks archived and errors
+        """
+        stats = {"villages_compacted": 0, "tasks_archived": 0, "errors": []}
+
+        async for village in self.village_repository.iter_villages(PROCESSED_TASKS_QUERY):
+            try:
+                try:
+                    archived = await self._compact(village)
+                except ConcurrentModificationError:
+                    archived = await self.compact_village(village.id)
+            except Exception as e:
+                error_msg = f"Error compacting tasks of village {village.id}: {str(e)}"
+                logger.error(error_msg)
+                stats["errors"].append(error_msg)
+                continue
+            if archived:
+                stats["villages_compacted"] += 1
+                stats["tasks_archived"] += archived
+
+        logger.info(f"Archived {stats['tasks_archived']} processed tasks "
+                    f"from {stats['villages_compacted']} villages")
+        return stats
@@ -1,113 +1,661 @@
 import asyncio
+import itertools
+import os
 import time
-from datetime import datetime
-from typing import Dict, List, Callable, Coroutine, Any, Optional
-import heapq
+from datetime import datetime, timedelta, timezone
+from typing import Deque, Dict, Callable, Coroutine, Any, List, Optional, Tuple
 import logging
+from collections import deque
+from minute_empire.repositories.scheduled_task_repository import ScheduledTaskRepository
+from minute_empire.services.scheduler_queues import HeapTaskQueue, TimingWheelTaskQueue
+from minute_empire.services.scheduler_metrics import SchedulerMetrics
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# How far ahead, and how many tasks per query, the scheduler loads from the durable queue
+SCHEDULER_WINDOW_SECONDS = int(os.getenv("SCHEDULER_WINDOW_SECONDS", "300"))
+SCHEDULER_PAGE_SIZE = int(os.getenv("SCHEDULER_PAGE_SIZE", "1000"))
+
+# Due tasks run on this many workers at most; tasks sharing a serial key never run concurrently
+SCHEDULER_MAX_WORKERS = int(os.getenv("SCHEDULER_MAX_WORKERS", "16"))
+
+# Hold tasks that have a batch handler this long after they are due, so the ones due just after join their batch
+SCHEDULER_COALESCE_MS = int(os.getenv("SCHEDULER_COALESCE_MS", "250"))
+
+# Failed queued tasks run again after SCHEDULER_RETRY_BACKOFF_MS, doubling at every attempt, up to
+# SCHEDULER_MAX_ATTEMPTS runs in all; after that they stay in the durable queue until the next start
+SCHEDULER_MAX_ATTEMPTS = int(os.getenv("SCHEDULER_MAX_ATTEMPTS", "5"))
+SCHEDULER_RETRY_BACKOFF_MS = int(os.getenv("SCHEDULER_RETRY_BACKOFF_MS", "1000"))
+
+# Pending-task queue: "heap" (binary heap) or "wheel" (hierarchical timing wheel, O(1) insert and cancel)
+SCHEDULER_BACKEND = os.getenv("SCHEDULER_BACKEND", "heap").lower()
+if SCHEDULER_BACKEND not in ("heap", "wheel"):
+    raise ValueError(f"Unknown SCHEDULER_BACKEND: {SCHEDULER_BACKEND}")
+# Tick of the timing wheel; tasks fire at most this late
+SCHEDULER_WHEEL_RESOLUTION_MS = int(os.getenv("SCHEDULER_WHEEL_RESOLUTION_MS", "10"))
+
+# Rebuild the queue from a scan of every village and troop action at startup, not only the first time
+SCHEDULER_RESCAN_ON_STARTUP = os.getenv("SCHEDULER_RESCAN_ON_STARTUP", "false").lower() in ("1", "true", "yes")
+
+class TaskFailedError(Exception):
+    """A task handler reported failure with a {"success": False, "error": ...} result instead of raising"""
+
+def check_result(task: str, result: Any) -> None:
+    """Raise TaskFailedError if a handler result reports failure"""
+    if isinstance(result, dict) and result.get("success") is False:
+        raise TaskFailedError(f"Task {task} failed: {result.get('error', 'unknown error')}")
+
+def to_monotonic_deadline(execution_time: datetime) -> float:
+    """
+    Convert a wall-clock execution time into a time.monotonic() deadline.
+
+    Naive datetimes are UTC, like everything the game stores (datetime.utcnow()).
+    The deadline is fixed when the task is scheduled, so later wall-clock jumps
+    don't make tasks fire early or late.
+    """
+    if execution_time.tzinfo is None:
+        now = datetime.utcnow()
+    else:
+        now = datetime.now(timezone.utc)
+    return time.monotonic() + (execution_time - now).total_seconds()
+
+def to_timestamp(execution_time: datetime) -> float:
+    """POSIX timestamp of an execution time (naive datetimes are UTC), the queue's sort key"""
+    if execution_time.tzinfo is None:
+        execution_time = execution_time.replace(tzinfo=timezone.utc)
+    return execution_time.timestamp()
+
 class TaskScheduler:
-    """Task scheduler for executing game tasks at specific times"""
-    
-    def __init__(self):
-        self.tasks = []  # priority queue based on execution time
-        self.task_map = {}  # mapping from task_id to task
+    """
+    Task scheduler for executing game tasks at specific times.
+
+    A single loop sleeps until the earliest deadline in the queue. Scheduling a
+    task that is due before the current head, or cancelling the head, wakes it
+    up early through an asyncio.Event, so tasks fire as soon as they are due and
+    an idle scheduler only wakes up to page in the next window of the queue.
+
+    Pending tasks are kept in a queue from scheduler_queues, picked with
+    SCHEDULER_BACKEND: a binary heap with lazy deletion (O(log n) insert, O(1)
+    cancel), or a hierarchical timing wheel (O(1) insert and cancel, tasks
+    fire up to one tick late) for very large numbers of pending tasks.
+
+    Game tasks are scheduled with schedule(), by a kind registered with
+    register_kind() and a payload of keyword arguments. When durable, they are
+    stored in the scheduled_tasks collection, and the heap only holds the
+    next window of them: the loop pages tasks in, in (due_at, _id) order,
+    SCHEDULER_PAGE_SIZE at a time and up to SCHEDULER_WINDOW_SECONDS ahead.
+    A task leaves the collection once its handler has run, so a restart picks
+    up where the previous process stopped. A task whose handler raises, or
+    returns {"success": False}, stays in the collection and is pushed back
+    into the heap with an exponential backoff, up to max_attempts runs; past
+    that it waits for the next start. schedule_task() keeps scheduling plain
+    in-memory callbacks.
+
+    Due tasks are handed to a pool of max_workers workers, which bounds how
+    many run at once. Tasks can carry a serial key (the village or troop they
+    write to): tasks sharing a key run one after the other in the order they
+    became due, while tasks with different keys run in parallel.
+
+    Kinds can also register a batch handler. Queued tasks of such kinds are
+    held coalesce_ms after they are due; every task with the same serial key
+    and batch handler that is due by then is handed to the batch handler in
+    one call, with the list of their payloads, e.g. to complete all the
+    co-due tasks of a village with a single load and save.
+
+    Lag, execution time per kind, failures and queue depth are recorded in a
+    SchedulerMetrics, exported by get_metrics() in the Prometheus text format.
+    """
+
+    def __init__(self, durable: bool = True, max_workers: int = SCHEDULER_MAX_WORKERS,
+                 coalesce_ms: int = SCHEDULER_COALESCE_MS, backend: str = SCHEDULER_BACKEND,
+                 max_attempts: int = SCHEDULER_MAX_ATTEMPTS, retry_backoff_ms: int = SCHEDULER_RETRY_BACKOFF_MS):
+        # Queue of (timestamp, sequence, task_id, execution_time, deadline, scheduled_at,
+        # callback, args, kwargs, serial_key) entries; ordered by execution time, so tasks due at
+        # the same time run in the order they were scheduled, and fired at their monotonic deadline
+        self.backend = backend
+        if backend == "wheel":
+            self.queue = TimingWheelTaskQueue(resolution=SCHEDULER_WHEEL_RESOLUTION_MS / 1000)
+        else:
+            self.queue = HeapTaskQueue()
         self.running = False
-        self.task_lock = asyncio.Lock()
-    
-    async def schedule_task(self, task_id: str, execution_time: datetime, 
-                           callback: Callable[..., Coroutine], *args, **kwargs):
-        """Schedule a task to run at a specific time"""
-        execution_timestamp = execution_time.timestamp()
-        task_data = (execution_timestamp, task_id, callback, args, kwargs)
-        
-        async with self.task_lock:
-            # Add to priority queue (heap)
-            heapq.heappush(self.tasks, task_data)
-            # Store in map for easy access
-            self.task_map[task_id] = task_data
-            
-        logger.info(f"Scheduled task {task_id} to run at {execution_time}")
-        
+        self._sequence = itertools.count()  # tie-breaker so entries due at the same time never compare callbacks
+        self._wakeup = asyncio.Event()
+        self._loop_task: Optional[asyncio.Task] = None
+        # Worker pool: due tasks wait in the ready queue for one of max_workers workers
+        self.max_workers = max_workers
+        self._ready: asyncio.Queue = asyncio.Queue()
+        self._workers: List[asyncio.Task] = []
+        # Serial keys with a task running, and the tasks waiting behind it in order
+        self._busy_keys: Dict[str, Deque[tuple]] = {}
+        self.executing = 0
+        # Coalescing: batches run and the tasks they covered
+        self.coalesce_seconds = coalesce_ms / 1000
+        self.batches = 0
+        self.batched_tasks = 0
+        # Retries: failed runs so far of the queued tasks that failed, by task ID
+        self.max_attempts = max_attempts
+        self.retry_backoff_seconds = retry_backoff_ms / 1000
+        self._failures: Dict[str, int] = {}
+        self.retries = 0
+        # Dispatch latency, queue wait, lag, per-kind execution time and failures, queue depth over time
+        self.metrics = SchedulerMetrics()
+        # Durable queue
+        self.durable = durable
+        self.repository = ScheduledTaskRepository()
+        self.kinds: Dict[str, Callable[..., Coroutine]] = {}
+        self.batch_handlers: Dict[str, Callable[..., Coroutine]] = {}
+        # (due_at, task_id) of the last queued task loaded into the heap; a task_id
+        # of None means every task due up to due_at is loaded. None before the first page.
+        self._loaded_until: Optional[Tuple[datetime, Optional[str]]] = None
+        # Tasks scheduled while a page query was in flight, re-checked once it returns
+        self._paging = False
+        self._scheduled_while_paging = []
+        self.pages_loaded = 0
+
+    def start(self) -> None:
+        """Start the scheduler loop and its workers, unless they are already running"""
+        if self._loop_task is None or self._loop_task.done():
+            self._loop_task = asyncio.create_task(self.run_scheduler())
+        self._workers = [worker for worker in self._workers if not worker.done()]
+        while len(self._workers) < self.max_workers:
+            self._workers.append(asyncio.create_task(self._worker()))
+
+    async def stop(self) -> None:
+        """
+        Stop the scheduler loop and its workers.
+
+        Scheduled tasks stay queued. Tasks that were due but had not finished
+        are dropped; the durable ones run again on the next start.
+        """
+        running = [task for task in [self._loop_task, *self._workers] if task is not None and not task.done()]
+        for task in running:
+            task.cancel()
+        await asyncio.gather(*running, return_exceptions=True)
+        self._loop_task = None
+        self._workers = []
+        self._ready = asyncio.Queue()
+        self._busy_keys.clear()
+        self.executing = 0
+
+    async def schedule_task(self, task_id: str, execution_time: datetime,
+                           callback: Callable[..., Coroutine], *args,
+                           serial_key: Optional[str] = None, **kwargs) -> bool:
+        """
+        Schedule a task to run at a specific time.
+
+        Scheduling a task ID that is already queued for the same time does
+        nothing; for another time it moves the task, so a task never runs twice.
+        Tasks with the same serial_key never run concurrently.
+
+        Returns:
+            bool: False if the task was already scheduled for that time
+        """
+        existing = self.queue.get(task_id)
+        if existing is not None:
+            if existing[3] == execution_time:
+                return False
+            self.queue.remove(task_id)
+
+        task_data = (to_timestamp(execution_time), next(self._sequence), task_id, execution_time,
+                     to_monotonic_deadline(execution_time), time.monotonic(), callback, args, kwargs, serial_key)
+        self.queue.push(task_data)
+
+        # The loop only needs waking if it is now sleeping past the new head
+        if self.queue.peek() is task_data:
+            self._wakeup.set()
+
+        # Debug level: with many thousands of tasks, logging each one is a cost of its own
+        logger.debug(f"Scheduled task {task_id} to run at {execution_time}")
+
         # Start the scheduler if not already running
-        if not self.running:
-            asyncio.create_task(self.run_scheduler())
-    
+        self.start()
+        return True
+
+    def register_kind(self, kind: str, handler: Callable[..., Coroutine],
+                      batch_handler: Optional[Callable[..., Coroutine]] = None) -> None:
+        """
+        Register the coroutine function that runs the tasks of a kind, called with their payload.
+
+        A batch_handler, called with a list of payloads, runs co-due tasks that
+        share a serial key together; kinds registered with the same batch
+        handler are batched with each other.
+        """
+        self.kinds[kind] = handler
+        if batch_handler is not None:
+            self.batch_handlers[kind] = batch_handler
+        else:
+            self.batch_handlers.pop(kind, None)
+
+    def _is_loaded(self, task_id: str, due_at: datetime) -> bool:
+        """Whether a queued task falls in the part of the queue already loaded into the heap"""
+        if self._loaded_until is None:
+            return False
+        loaded_due, loaded_id = self._loaded_until
+        if loaded_id is None:
+            return due_at <= loaded_due
+        return (due_at, task_id) <= (loaded_due, loaded_id)
+
+    async def schedule(self, task_id: str, kind: str, execution_time: datetime,
+                       serial_key: Optional[str] = None, **payload) -> bool:
+        """
+        Schedule a task of a registered kind to run at a specific time.
+
+        The task is written to the durable queue first; it only enters the heap
+        if it is due within the window already loaded, otherwise the page that
+        covers its time loads it. Scheduling a task ID again moves it.
+
+        Args:
+            task_id: Unique ID of the task, also the key of its queue document
+            kind: Name the handler was registered under
+            execution_time: When to run it (naive datetimes are UTC)
+            serial_key: Tasks with the same key run one at a time, e.g. "village:<id>"
+            **payload: Keyword arguments for the handler, stored as-is
+
+        Returns:
+            bool: False if the task was already scheduled for that time
+        """
+        if kind not in self.kinds:
+            raise ValueError(f"Unknown task kind: {kind}")
+        # MongoDB keeps milliseconds; truncate so the stored due_at matches the one in memory
+        execution_time = execution_time.replace(microsecond=execution_time.microsecond // 1000 * 1000)
+        if not self.durable:
+            return await self.schedule_task(task_id, execution_time, self._run_kind, kind, payload,
+                                            serial_key=serial_key)
+
+        await self.repository.upsert(task_id, kind, execution_time, payload, serial_key)
+        if self._paging:
+            self._scheduled_while_paging.append((task_id, kind, execution_time, payload, serial_key))
+        if self._is_loaded(task_id, execution_time):
+            return await self.schedule_task(task_id, execution_time, self._run_queued,
+                                            task_id, kind, execution_time, payload, serial_key=serial_key)
+
+        # Past the loaded window: drop any earlier in-memory entry, the page that covers it loads it
+        await self.cancel_task(task_id)
+        logger.debug(f"Queued task {task_id} ({kind}) to run at {execution_time}")
+        return True
+
+    async def cancel(self, task_id: str) -> bool:
+        """Cancel a task scheduled with schedule(), removing it from the durable queue"""
+        removed = self.durable and await self.repository.delete(task_id)
+        return await self.cancel_task(task_id) or removed
+
+    async def _run_kind(self, kind: str, payload: Dict[str, Any]) -> None:
+        """Run an in-memory task of a registered kind"""
+        await self.kinds[kind](**payload)
+
+    async def _run_queued(self, task_id: str, kind: str, due_at: datetime, payload: Dict[str, Any]) -> None:
+        """Run a queued task and remove it from the queue; if the handler fails, it stays queued"""
+        handler = self.kinds.get(kind)
+        if handler is None:
+            raise ValueError(f"No handler registered for task kind {kind}")
+        check_result(task_id, await handler(**payload))
+        # Matched on the due time too, so a task moved while it ran stays queued
+        await self.repository.delete(task_id, due_at)
+        self._failures.pop(task_id, None)
+
+    async def _run_queued_batch(self, batch_handler: Callable[..., Coroutine], tasks: List[tuple]) -> None:
+        """Run co-due queued tasks through their batch handler and remove them from the queue together"""
+        result = await batch_handler([payload for _, _, _, payload in tasks])
+        check_result(", ".join(task_id for task_id, _, _, _ in tasks), result)
+        await self.repository.delete_many([(task_id, due_at) for task_id, _, due_at, _ in tasks])
+        for task_id, _, _, _ in tasks:
+            self._failures.pop(task_id, None)
+
+    async def _retry_failed(self, callback: Callable[..., Coroutine], args: tuple, serial_key: Optional[str]) -> None:
+        """
+        Push the queued tasks of a failed job back into the heap after a backoff.
+
+        The delay doubles with every failure of a task; after max_attempts runs
+        it is left in the durable queue for the next start. A task moved or
+        cancelled while it ran is not retried: the queue already holds its new
+        version, if any.
+        """
+        if callback == self._run_queued:
+            tasks = [args]
+        elif callback == self._run_queued_batch:
+            tasks = args[1]
+        else:
+            return
+
+        for task_id, kind, due_at, payload in tasks:
+            failures = self._failures.get(task_id, 0) + 1
+            if failures >= self.max_attempts:
+                self._failures.pop(task_id, None)
+                logger.error(f"Task {task_id} ({kind}) failed {failures} times, it stays queued until the next start")
+                continue
+            if self.queue.get(task_id) is not None:
+                continue
+            document = await self.repository.get(task_id)
+            if document is None or document["due_at"] != due_at:
+                continue
+
+            self._failures[task_id] = failures
+            self.retries += 1
+            retry_at = datetime.utcnow() + timedelta(seconds=self.retry_backoff_seconds * 2 ** (failures - 1))
+            logger.warning(f"Retrying task {task_id} ({kind}) at {retry_at}, attempt {failures + 1} of {self.max_attempts}")
+            # due_at stays the queued one, which the delete matches once it succeeds
+            await self.schedule_task(task_id, retry_at, self._run_queued, task_id, kind, due_at, payload,
+                                     serial_key=serial_key)
+
+    def _kind(self, callback: Callable[..., Coroutine], args: tuple) -> str:
+        """Kind a task is counted under in the metrics: its registered kind, or the callback name"""
+        if callback == self._run_queued:
+            return args[1]
+        if callback == self._run_kind:
+            return args[0]
+        return getattr(callback, "__name__", "unknown")
+
+    def _batch_handler(self, entry: tuple) -> Optional[Callable[..., Coroutine]]:
+        """The batch handler of a heap entry, if it is a queued task that can be coalesced"""
+        if entry[9] is None or entry[6] != self._run_queued:
+            return None
+        return self.batch_handlers.get(entry[7][1])
+
+    def _fire_at(self, entry: tuple) -> float:
+        """Monotonic time an entry is dispatched: its deadline, plus the coalescing delay if it can be batched"""
+        if self.coalesce_seconds and self._batch_handler(entry) is not None:
+            return self.queue.due_time(entry) + self.coalesce_seconds
+        return self.queue.due_time(entry)
+
+    def _window_exhausted(self) -> bool:
+        """Whether the loop has reached the end of the loaded part of the queue"""
+        return self._loaded_until is None or datetime.utcnow() >= self._loaded_until[0]
+
+    async def _load_next_page(self) -> int:
+        """Load the next page of the durable queue into the heap and advance the window"""
+        horizon = datetime.utcnow() + timedelta(seconds=SCHEDULER_WINDOW_SECONDS)
+        self._paging = True
+        try:
+            page = await self.repository.get_due_page(horizon, self._loaded_until, SCHEDULER_PAGE_SIZE)
+        finally:
+            self._paging = False
+        raced, self._scheduled_while_paging = self._scheduled_while_paging, []
+
+        for document in page:
+            await self.schedule_task(document["_id"], document["due_at"], self._run_queued,
+                                     document["_id"], document["kind"], document["due_at"], document["payload"],
+                                     serial_key=document.get("serial_key"))
+        if len(page) < SCHEDULER_PAGE_SIZE:
+            self._loaded_until = (horizon, None)
+        else:
+            # A full page: continue right after its last task
+            self._loaded_until = (page[-1]["due_at"], page[-1]["_id"])
+
+        # Tasks scheduled during the query may or may not be in the page; the
+        # ones inside the new window are added here (again, at worst, a no-op)
+        for task_id, kind, due_at, payload, serial_key in raced:
+            if self._is_loaded(task_id, due_at):
+                await self.schedule_task(task_id, due_at, self._run_queued, task_id, kind, due_at, payload,
+                                         serial_key=serial_key)
+
+        self.pages_loaded += 1
+        return len(page)
+
     async def run_scheduler(self):
         """Main scheduler loop that executes tasks at their designated time"""
+        if self.running:
+            logger.warning("Task scheduler loop is already running")
+            return
         self.running = True
-        
+
+        try:
+            while True:
+                try:
+                    # Cleared before looking at the queue, so a task scheduled
+                    # from here on sets it again and the wait returns at once
+                    self._wakeup.clear()
+                    head = self.queue.peek()
+                    self.metrics.sample_depth(len(self.queue), self._queued_count())
+
+                    if head is not None and self._fire_at(head) <= time.monotonic():
+                        self._dispatch_due_tasks()
+                        continue
+
+                    # Everything loaded is dispatched up to now, page in what comes next
+                    if self.durable and self._window_exhausted():
+                        await self._load_next_page()
+                        continue
+
+                    deadline = self._fire_at(head) if head is not None else None
+                    if self.durable:
+                        window_end = to_monotonic_deadline(self._loaded_until[0])
+                        deadline = window_end if deadline is None else min(deadline, window_end)
+
+                    if deadline is None:
+                        await self._wakeup.wait()
+                        continue
+
+                    # Sleep until the head is due or the window ends, or an earlier task is added
+                    # (asyncio.timeout rather than wait_for, which can swallow a stop() on Python 3.11)
+                    try:
+                        async with asyncio.timeout(max(deadline - time.monotonic(), 0)):
+                            await self._wakeup.wait()
+                    except TimeoutError:
+                        pass
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    logger.error(f"Error in task scheduler: {str(e)}")
+                    await asyncio.sleep(1)  # Sleep on error to avoid tight loop
+        finally:
+            self.running = False
+
+    def _dispatch_due_tasks(self) -> None:
+        """
+        Hand every live task whose deadline has passed to the workers, in execution time order.
+
+        Queued tasks with the same serial key and batch handler become a single
+        job, at the position of the first of them.
+        """
+        now = time.monotonic()
+        jobs = []
+        batches: Dict[tuple, List[tuple]] = {}
+        for entry in self.queue.pop_due(now):
+            _, _, task_id, _, deadline, scheduled_at, callback, args, kwargs, serial_key = entry
+
+            # Tasks scheduled already overdue only count the time they waited in the queue
+            latency_ms = (now - max(deadline, scheduled_at)) * 1000
+            self.metrics.record_dispatch(latency_ms / 1000)
+
+            batch_handler = self._batch_handler(entry)
+            if batch_handler is None:
+                jobs.append((task_id, callback, args, kwargs, serial_key,
+                             [(self._kind(callback, args), latency_ms)], now))
+                continue
+            group = (serial_key, batch_handler)
+            if group not in batches:
+                batches[group] = []
+                jobs.append(group)
+            batches[group].append((args, latency_ms))
+
+        for job in jobs:
+            if len(job) == 2:  # a (serial_key, batch_handler) group
+                serial_key, batch_handler = job
+                batch = batches[job]
+                # (kind, dispatch latency) of every task the job runs
+                covered = [(args[1], latency_ms) for args, latency_ms in batch]
+                if len(batch) == 1:
+                    args, _ = batch[0]
+                    job = (args[0], self._run_queued, args, {}, serial_key, covered, now)
+                else:
+                    self.batches += 1
+                    self.batched_tasks += len(batch)
+                    tasks = [args for args, _ in batch]
+                    job = (f"batch of {len(batch)} ({serial_key})", self._run_queued_batch,
+                           (batch_handler, tasks), {}, serial_key, covered, now)
+            self._ready.put_nowait(job)
+
+    async def _worker(self) -> None:
+        """Run dispatched tasks one at a time, chaining the tasks that wait on the same serial key"""
         while True:
-            try:
-                # Check if we have any tasks
-                if not self.tasks:
-                    await asyncio.sleep(5)  # Sleep and check again if no tasks
+            job = await self._ready.get()
+            serial_key = job[4]
+            if serial_key is not None:
+                if serial_key in self._busy_keys:
+                    # Another worker is running this key; it runs this task next
+                    self._busy_keys[serial_key].append(job)
                     continue
-                
-                # Get the next task without removing it
-                next_task = self.tasks[0]
-                execution_time, task_id, callback, args, kwargs = next_task
-                
-                # Calculate time to wait
-                now = time.time()
-                wait_time = max(0, execution_time - now)
-                
-                if wait_time <= 0:
-                    # Task is due, remove from queue and execute
-                    async with self.task_lock:
-                        heapq.heappop(self.tasks)
-                        self.task_map.pop(task_id, None)
-                    
-                    # Execute the task in the background
-                    asyncio.create_task(self._execute_task(task_id, callback, args, kwargs))
-                else:
-                    # Wait until the next task is due (or new task is added)
-                    await asyncio.sleep(min(wait_time, 5))  # Check at least every 5 seconds
-            except Exception as e:
-                logger.error(f"Error in task scheduler: {str(e)}")
-                await asyncio.sleep(5)  # Sleep on error to avoid tight loop
-    
-    async def _execute_task(self, task_id, callback, args, kwargs):
-        """Execute a task with error handling"""
+                self._busy_keys[serial_key] = deque()
+
+            while job is not None:
+                await self._execute_task(*job)
+                job = None
+                if serial_key is not None:
+                    waiting = self._busy_keys[serial_key]
+                    if waiting:
+                        job = waiting.popleft()
+                    else:
+                        del self._busy_keys[serial_key]
+
+    async def _execute_task(self, task_id, callback, args, kwargs, serial_key: Optional[str] = None,
+                            covered: Optional[List[Tuple[str, float]]] = None, dispatched_at: Optional[float] = None):
+        """
+        Execute a task with error handling, recording its lag, queue wait and execution time.
+
+        covered lists the (kind, dispatch latency in ms) of the tasks the job
+        runs: one, or several for a batch.
+        """
+        started = time.monotonic()
+        wait_ms = (started - dispatched_at) * 1000 if dispatched_at is not None else 0.0
+        covered = covered or [(self._kind(callback, args), 0.0)]
+        latency_ms = max(latency for _, latency in covered)
+        self.metrics.record_queue_wait(wait_ms / 1000)
+        for _, latency in covered:
+            self.metrics.record_lag((latency + wait_ms) / 1000)
+        self.executing += 1
+        failed = False
         try:
-            logger.info(f"Executing task {task_id}")
+            logger.info(f"Executing task {task_id} ({latency_ms:.1f} ms dispatch latency, {wait_ms:.1f} ms queued)")
             await callback(*args, **kwargs)
             logger.info(f"Task {task_id} completed successfully")
         except Exception as e:
+            failed = True
             logger.error(f"Error executing task {task_id}: {str(e)}")
             import traceback
             logger.error(traceback.format_exc())
-    
+        finally:
+            self.executing -= 1
+            execution_ms = (time.monotonic() - started) * 1000
+            self.metrics.record_execution([kind for kind, _ in covered], execution_ms / 1000, failed)
+        if failed:
+            try:
+                await self._retry_failed(callback, args, serial_key)
+            except Exception as e:
+                logger.error(f"Error rescheduling failed task {task_id}: {str(e)}")
+
     async def cancel_task(self, task_id: str) -> bool:
         """Cancel a scheduled task"""
-        if task_id not in self.task_map:
+        entry = self.queue.get(task_id)
+        if entry is None:
             return False
-            
-        async with self.task_lock:
-            # We can't easily remove from heap, so we'll just mark it in the map
-            # and skip it when it comes up for execution
-            self.task_map.pop(task_id, None)
-            
-            # Rebuild the heap without the canceled task
-            self.tasks = [task for task in self.tasks if task[1] != task_id]
-            heapq.heapify(self.tasks)
-            
+
+        was_head = self.queue.peek() is entry
+        self.queue.remove(task_id)
+
+        # Let the loop recompute its sleep if the head was removed
+        if was_head:
+            self._wakeup.set()
         return True
 
+    def _queued_count(self) -> int:
+        """Tasks dispatched but not started: waiting for a worker or behind their serial key"""
+        return self._ready.qsize() + sum(len(waiting) for waiting in self._busy_keys.values())
+
     def get_pending_task_count(self) -> int:
         """Get number of pending tasks"""
-        return len(self.tasks)
-        
+        return len(self.queue)
+
     async def get_next_execution_time(self) -> Optional[datetime]:
-        """Get the timestamp of the next task to execute"""
-        if not self.tasks:
+        """Get the execution time of the next task to execute"""
+        head = self.queue.peek()
+        if head is None:
             return None
-            
-        execution_timestamp = self.tasks[0][0]
-        return datetime.fromtimestamp(execution_timestamp)
+
+        return head[3]
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get the queue size, and the latencies in milliseconds from the scheduler metrics"""
+        latency = self.metrics.dispatch_latency
+        wait = self.metrics.queue_wait
+        executed = self.metrics.executed()
+        return {
+            "running": self.running,
+            "backend": self.backend,
+            "pending_tasks": len(self.queue),
+            **self.queue.stats(),
+            "workers": self.max_workers,
+            "queued_tasks": self._queued_count(),
+            "executing_tasks": self.executing,
+            "dispatched_tasks": latency.count,
+            "completed_tasks": executed["count"],
+            "avg_latency_ms": round(latency.sum / latency.count * 1000, 3) if latency.count else 0.0,
+            "max_latency_ms": round(latency.max * 1000, 3),
+            "avg_queue_wait_ms": round(wait.sum / wait.count * 1000, 3) if wait.count else 0.0,
+            "max_queue_wait_ms": round(wait.max * 1000, 3),
+            "avg_execution_ms": round(executed["sum"] / executed["count"] * 1000, 3) if executed["count"] else 0.0,
+            "max_execution_ms": round(executed["max"] * 1000, 3),
+            "batches": self.batches,
+            "batched_tasks": self.batched_tasks,
+            "retries": self.retries,
+            "durable": self.durable,
+            "loaded_until": self._loaded_until[0] if self._loaded_until else None,
+            "pages_loaded": self.pages_loaded,
+            **self.metrics.summary(),
+            "depth_history": self.metrics.depth_history()
+        }
+
+    async def get_next_tasks(self, limit: int = 20) -> List[Dict[str, Any]]:
+        """
+        The next tasks due, in execution order.
+
+        Tasks in memory come first; when durable, the rest is read from the
+        part of the queue that is not loaded yet.
+        """
+        now = time.monotonic()
+        tasks = []
+        for entry in self.queue.upcoming(limit):
+            _, _, task_id, execution_time, deadline, _, callback, args, _, serial_key = entry
+            tasks.append({
+                "task_id": task_id,
+                "kind": self._kind(callback, args),
+                "execution_time": execution_time,
+                "due_in_ms": round((deadline - now) * 1000, 3),
+                "serial_key": serial_key,
+                "loaded": True
+            })
+
+        if self.durable and len(tasks) < limit:
+            utcnow = datetime.utcnow()
+            page = await self.repository.get_due_page(datetime.max, self._loaded_until, limit - len(tasks))
+            for document in page:
+                tasks.append({
+                    "task_id": document["_id"],
+                    "kind": document["kind"],
+                    "execution_time": document["due_at"],
+                    "due_in_ms": round((document["due_at"] - utcnow).total_seconds() * 1000, 3),
+                    "serial_key": document.get("serial_key"),
+                    "loaded": False
+                })
+        return tasks
+
+    async def get_metrics(self) -> str:
+        """The scheduler metrics in the Prometheus text format"""
+        gauges = {
+            "pending_tasks": ("Tasks waiting in memory for their execution time", len(self.queue)),
+            "queued_tasks": ("Due tasks waiting for a worker or behind their serial key", self._queued_count()),
+            "executing_tasks": ("Tasks running", self.executing),
+            "workers": ("Size of the worker pool", self.max_workers)
+        }
+        if self.durable:
+            gauges["durable_tasks"] = ("Tasks in the scheduled_tasks collection", await self.repository.count())
+        counters = {
+            "batches_total": ("Batches of coalesced tasks run", self.batches),
+            "batched_tasks_total": ("Tasks run as part of a batch", self.batched_tasks),
+            "retries_total": ("Failed queued tasks pushed back into the queue to run again", self.retries)
+        }
+        return self.metrics.prometheus(gauges, counters)
 
 # Global instance of the task scheduler
-task_scheduler = TaskScheduler() 
\ No newline at end of file
+task_scheduler = TaskScheduler()
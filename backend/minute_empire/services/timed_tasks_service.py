@@ -11,9 +11,12 @@ from minute_empire.domain.troop import Troop
 from bson import ObjectId
 from minute_empire.repositories.troops_repository import TroopsRepository
 from minute_empire.repositories.troop_action_repository import TroopActionRepository
+from minute_empire.repositories.task_history_repository import TaskHistoryRepository
+from minute_empire.repositories.concurrency import ConcurrentModificationError, retry_on_conflict
 from minute_empire.services.task_scheduler import task_scheduler
-from minute_empire.services.troop_action_service import TroopActionService
+from minute_empire.services.troop_action_service import TroopActionService, TROOP_ACTION_TASK_KIND
 from minute_empire.services.websocket_service import websocket_service
+import os
 import logging
 import asyncio
 from dataclasses import dataclass
@@ -23,6 +26,13 @@ from enum import Enum
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Move tasks to the task history as soon as they are completed, keeping only pending ones in the village
+ARCHIVE_PROCESSED_TASKS = os.getenv("ARCHIVE_PROCESSED_TASKS", "true").lower() in ("1", "true", "yes")
+
+# Names the task scheduler stores in its durable queue for the tasks of this service
+CONSTRUCTION_TASK_KIND = "complete_construction_task"
+TROOP_TRAINING_TASK_KIND = "complete_troop_training_task"
+
 class TaskCategory(str, Enum):
     """Enum to identify the category of task for sorting purposes"""
     CONSTRUCTION = "construction"
@@ -50,8 +60,16 @@ class TimedConstructionService:
         self.resource_field_service = ResourceFieldService()
         self.troops_repository = TroopsRepository()
         self.troop_action_repository = TroopActionRepository()
+        self.task_history_repository = TaskHistoryRepository()
         self.troop_action_service = None  # Initialize on first use to avoid circular imports
 
+    async def _get_village_now(self, village_id: str) -> Optional[Any]:
+        """Load a village with its resources projected to the current time"""
+        village = await self.village_repository.get_by_id(village_id)
+        if village is not None:
+            village.project_resources(datetime.utcnow())
+        return village
+    
     def _get_troop_action_service(self):
         """Lazy initialization of troop action service to avoid circular imports"""
         if self.troop_action_service is None:
@@ -78,22 +96,21 @@ class TimedConstructionService:
         now = datetime.utcnow()
         pending_tasks = []
         
-        if hasattr(village._data, 'construction_tasks'):
-            for task in village._data.construction_tasks:
-                if not task.processed:
-                    pending_tasks.append({
-                        "id": task.id,
-                        "task_type": task.task_type,
-                        "target_type": task.target_type,
-                        "slot": task.slot,
-                        "level": task.level,
-                        "started_at": task.started_at,
-                        "completion_time": task.completion_time,
-                        "time_remaining_seconds": max(0, (task.completion_time - now).total_seconds())
-                    })
+        for task in village.get_pending_construction_tasks():
+            pending_tasks.append({
+                "id": task.id,
+                "task_type": task.task_type,
+                "target_type": task.target_type,
+                "slot": task.slot,
+                "level": task.level,
+                "started_at": task.started_at,
+                "completion_time": task.completion_time,
+                "time_remaining_seconds": max(0, (task.completion_time - now).total_seconds())
+            })
             
         return pending_tasks
     
+    @retry_on_conflict
     async def start_building_construction(self, village_id: str, building_type: ConstructionType, 
                                        slot: int) -> Dict[str, Any]:
         """
@@ -113,7 +130,7 @@ class TimedConstructionService:
             return validation_result
             
         # Get the village after validation
-        village = await self.village_repository.get_by_id(village_id)
+        village = await self._get_village_now(village_id)
         
         # Deduct resources for the task
         from minute_empire.domain.building import Building
@@ -140,10 +157,11 @@ class TimedConstructionService:
         await self.village_repository.save(village)
         
         # Schedule the task completion
-        await task_scheduler.schedule_task(
+        await task_scheduler.schedule(
             task_id=task.id,
             execution_time=task.completion_time,
-            callback=self.complete_construction_task,
+            kind=CONSTRUCTION_TASK_KIND,
+            serial_key=f"village:{village_id}",
             village_id=village_id,
             task_id_param=task.id,
             completion_time=task.completion_time
@@ -157,6 +175,7 @@ class TimedConstructionService:
             "task_id": task.id
         }
         
+    @retry_on_conflict
     async def start_field_construction(self, village_id: str, field_type: ResourceFieldType, 
                                     slot: int) -> Dict[str, Any]:
         """
@@ -176,7 +195,7 @@ class TimedConstructionService:
             return validation_result
             
         # Get the village after validation
-        village = await self.village_repository.get_by_id(village_id)
+        village = await self._get_village_now(village_id)
         
         # Deduct resources for the task
         from minute_empire.domain.resource_field import ResourceProducer
@@ -203,10 +222,11 @@ class TimedConstructionService:
         await self.village_repository.save(village)
         
         # Schedule the task completion
-        await task_scheduler.schedule_task(
+        await task_scheduler.schedule(
             task_id=task.id,
             execution_time=task.completion_time,
-            callback=self.complete_construction_task,
+            kind=CONSTRUCTION_TASK_KIND,
+            serial_key=f"village:{village_id}",
             village_id=village_id,
             task_id_param=task.id,
             completion_time=task.completion_time
@@ -220,6 +240,7 @@ class TimedConstructionService:
             "task_id": task.id
         }
         
+    @retry_on_conflict
     async def start_building_upgrade(self, village_id: str, slot: int) -> Dict[str, Any]:
         """
         Start timed building upgrade instead of upgrading it immediately.
@@ -237,7 +258,7 @@ class TimedConstructionService:
             return validation_result
             
         # Get the village and building after validation
-        village = await self.village_repository.get_by_id(village_id)
+        village = await self._get_village_now(village_id)
         building = village.get_building(slot)
         
         # Deduct resources for the task
@@ -257,20 +278,19 @@ class TimedConstructionService:
             TaskType.UPGRADE_BUILDING,
             building.type.value,
             slot,
-            duration
+            duration,
+            level=building.level + 1
         )
         
-        # Set target level
-        task.level = building.level + 1
-        
         # Save changes
         await self.village_repository.save(village)
         
         # Schedule the task completion
-        await task_scheduler.schedule_task(
+        await task_scheduler.schedule(
             task_id=task.id,
             execution_time=task.completion_time,
-            callback=self.complete_construction_task,
+            kind=CONSTRUCTION_TASK_KIND,
+            serial_key=f"village:{village_id}",
             village_id=village_id,
             task_id_param=task.id,
             completion_time=task.completion_time
@@ -286,6 +306,7 @@ class TimedConstructionService:
             "task_id": task.id
         }
         
+    @retry_on_conflict
     async def start_field_upgrade(self, village_id: str, slot: int) -> Dict[str, Any]:
         """
         Start timed field upgrade instead of upgrading it immediately.
@@ -303,7 +324,7 @@ class TimedConstructionService:
             return validation_result
             
         # Get the village and field after validation
-        village = await self.village_repository.get_by_id(village_id)
+        village = await self._get_village_now(village_id)
         field = village.get_resource_field(slot)
         
         # Deduct resources for the task
@@ -323,20 +344,19 @@ class TimedConstructionService:
             TaskType.UPGRADE_FIELD,
             field.type.value,
             slot,
-            duration
+            duration,
+            level=field.level + 1
         )
         
-        # Set target level
-        task.level = field.level + 1
-        
         # Save changes
         await self.village_repository.save(village)
         
         # Schedule the task completion
-        await task_scheduler.schedule_task(
+        await task_scheduler.schedule(
             task_id=task.id,
             execution_time=task.completion_time,
-            callback=self.complete_construction_task,
+            kind=CONSTRUCTION_TASK_KIND,
+            serial_key=f"village:{village_id}",
             village_id=village_id,
             task_id_param=task.id,
             completion_time=task.completion_time
@@ -352,6 +372,7 @@ class TimedConstructionService:
             "task_id": task.id
         }
         
+    @retry_on_conflict
     async def start_troop_training(self, village_id: str, troop_type: TroopType, quantity: int) -> Dict[str, Any]:
         """
         Start timed troop training.
@@ -370,7 +391,7 @@ class TimedConstructionService:
             return validation_result
             
         # Get the village after validation
-        village = await self.village_repository.get_by_id(village_id)
+        village = await self._get_village_now(village_id)
         
         # Deduct resources for the task
         costs = Troop.get_training_cost(troop_type, quantity)
@@ -395,10 +416,11 @@ class TimedConstructionService:
         await self.village_repository.save(village)
         
         # Schedule the task completion
-        await task_scheduler.schedule_task(
+        await task_scheduler.schedule(
             task_id=task.id,
             execution_time=task.completion_time,
-            callback=self.complete_troop_training_task,
+            kind=TROOP_TRAINING_TASK_KIND,
+            serial_key=f"village:{village_id}",
             village_id=village_id,
             task_id_param=task.id,
             completion_time=task.completion_time
@@ -412,6 +434,7 @@ class TimedConstructionService:
             "task_id": task.id
         }
     
+    @retry_on_conflict
     async def update_resources_until(self, village_id: str, target_time: datetime) -> Optional[Any]:
         """
         Update village resources up to a specific point in time.
@@ -430,30 +453,132 @@ class TimedConstructionService:
             logger.error(f"Village {village_id} not found for resource update")
             return None
             
-        # Calculate how much time has passed since the last update
-        last_update = village.res_update_at
-        hours_elapsed = (target_time - last_update).total_seconds() / 3600
-        
-        if hours_elapsed <= 0:
+        # Settle the resource snapshot at the target time, before the rates change
+        if not village.settle_resources(target_time):
             logger.info(f"No time elapsed for village {village_id}, skipping update")
             return village
             
-        logger.info(f"Updating resources for village {village_id} for {hours_elapsed:.2f} hours until {target_time}")
-        
-        # Update resources
-        village.update_resources(hours_elapsed)
-        
-        # Update the resource update timestamp to the target time
-        village.res_update_at = target_time
+        logger.info(f"Settled resources for village {village_id} until {target_time}")
         
         # Save changes
         await self.village_repository.save(village)
         return village
     
+    @retry_on_conflict
+    async def complete_village_tasks_until(self, village_id: str, until: datetime) -> Dict[str, Any]:
+        """
+        Complete every task of a village that is due by a time, with one load and one save.
+        
+        The village's timeline is replayed in memory (see Village.apply_due_tasks),
+        so the resources of each piece are produced at the rates in force at the
+        time, then the village is saved once and the trained troops are created.
+        With ARCHIVE_PROCESSED_TASKS the processed tasks are archived to the task
+        history, then dropped from the village by the same save.
+        
+        Args:
+            village_id: The ID of the village
+            until: Completion time of the last task to complete
+            
+        Returns:
+            Dict[str, Any]: The village, the completed construction and troop training
+            tasks, and the created troop IDs by training task ID
+        """
+        village = await self.village_repository.get_by_id(village_id)
+        if not village:
+            return {"success": False, "error": "Village not found"}
+        
+        completed = village.apply_due_tasks(until)
+        construction_tasks = [t for t in completed if isinstance(t, ConstructionTask)]
+        training_tasks = [t for t in completed if not isinstance(t, ConstructionTask)]
+        result = {
+            "success": True,
+            "village": village,
+            "construction_tasks": construction_tasks,
+            "troop_training_tasks": training_tasks,
+            "troop_ids": {},
+            "errors": []
+        }
+        if not completed:
+            return result
+        archived = village.compact_processed_tasks() if ARCHIVE_PROCESSED_TASKS else []
+        
+        # Archive before the save drops the tasks from the village, so a crash in
+        # between leaves them in both places rather than in neither; the archive
+        # is an idempotent upsert, so a retried completion only rewrites it
+        await self.task_history_repository.archive(village_id, archived)
+        # Save the whole timeline at once
+        await self.village_repository.save(village)
+        
+        for task in training_tasks:
+            troop = await self._create_trained_troop(village, task)
+            if troop:
+                result["troop_ids"][task.id] = troop.id
+                logger.info(f"Completed troop training task {task.id}, created troop {troop.id}")
+            else:
+                result["errors"].append(f"Failed to create troop for training task {task.id}")
+        
+        if construction_tasks:
+            logger.info(f"Completed {len(construction_tasks)} construction tasks for village {village_id}")
+        # One map update per completion: to all users when troops were trained, since
+        # that affects the map for everyone (the owner included), else to the owner
+        if training_tasks:
+            await websocket_service.broadcast_troop_action_complete()
+        elif construction_tasks:
+            await websocket_service.broadcast_construction_complete(village_id)
+        
+        return result
+    
+    async def complete_task_batch(self, tasks: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """
+        Complete co-due construction and troop training tasks of one village together.
+        This is the task scheduler's batch handler for both task kinds.
+        
+        Args:
+            tasks: Payloads of the scheduled tasks (village_id, task_id_param, completion_time),
+                   all of the same village
+            
+        Returns:
+            Dict[str, Any]: Result of complete_village_tasks_until up to the latest of them
+        """
+        village_id = tasks[0]["village_id"]
+        until = max(task["completion_time"] for task in tasks)
+        logger.info(f"Completing {len(tasks)} co-due tasks for village {village_id} until {until}")
+        return await self.complete_village_tasks_until(village_id, until)
+    
+    async def _is_already_completed(self, tasks: List[Any], task_id: str) -> bool:
+        """Whether a task is processed, either still in its village's tasks or already archived"""
+        task = next((t for t in tasks if t.id == task_id), None)
+        if task is not None:
+            return task.processed
+        return await self.task_history_repository.exists(task_id)
+    
+    async def _create_trained_troop(self, village: Any, task: Any) -> Optional[Any]:
+        """Create the troop trained by a completed troop training task"""
+        troop_data = {
+            "_id": str(ObjectId()),
+            "type": task.troop_type,
+            "quantity": task.quantity,
+            "home_id": village.id,
+            "location": village.location,
+            "mode": "idle",
+            "backpack": {
+                "wood": 0,
+                "stone": 0,
+                "iron": 0,
+                "food": 0
+            },
+            "created_at": task.completion_time,  # Use completion time, not current time
+            "updated_at": task.completion_time   # Use completion time, not current time
+        }
+        return await self.troops_repository.create(troop_data)
+    
     async def complete_construction_task(self, village_id: str, task_id_param: str, completion_time: datetime) -> Dict[str, Any]:
         """
         Complete a construction task. This is called by the task scheduler.
         
+        Any other task of the village due before it is completed first, in
+        order. A task that was already completed that way succeeds as a no-op.
+        
         Args:
             village_id: The ID of the village
             task_id_param: The ID of the task that's being completed
@@ -463,36 +588,28 @@ class TimedConstructionService:
             Dict[str, Any]: Result of the operation
         """
         try:
-            # First update resources with the correct rates up to the completion time
-            village = await self.update_resources_until(village_id, completion_time)
-            if not village:
-                return {"success": False, "error": "Village not found"}
-            
-            # Find the task to complete
-            task = None
-            if hasattr(village._data, 'construction_tasks'):
-                task = next((t for t in village._data.construction_tasks if t.id == task_id_param), None)
-            
-            if not task:
-                return {"success": False, "error": "Task not found"}
-            
-            # Complete the task
-            village.complete_construction_task(task)
-            
-            # Save changes
-            await self.village_repository.save(village)
-            
-            logger.info(f"Completed construction task {task_id_param} for village {village_id}")
+            result = await self.complete_village_tasks_until(village_id, completion_time)
+            if not result["success"]:
+                return result
             
-            # Broadcast map update to the village owner via WebSocket
-            await websocket_service.broadcast_construction_complete(village_id)
+            # Find the task that was completed
+            village = result["village"]
+            task = next((t for t in result["construction_tasks"] if t.id == task_id_param), None)
+            if task:
+                return {
+                    "success": True,
+                    "task_id": task_id_param,
+                    "task_type": task.task_type,
+                    "completion_time": completion_time
+                }
             
-            return {
-                "success": True,
-                "task_id": task_id_param,
-                "task_type": task.task_type,
-                "completion_time": completion_time
-            }
+            # Otherwise it was completed earlier, or it doesn't exist
+            if await self._is_already_completed(village._data.construction_tasks, task_id_param):
+                return {"success": True, "task_id": task_id_param, "already_completed": True}
+            return {"success": False, "error": "Task not found"}
+        except ConcurrentModificationError:
+            # Retries are exhausted, let the scheduler see the conflict
+            raise
         except Exception as e:
             logger.error(f"Error completing construction task {task_id_param}: {str(e)}")
             import traceback
@@ -503,6 +620,9 @@ class TimedConstructionService:
         """
         Complete a troop training task by creating the trained troops.
         
+        Any other task of the village due before it is completed first, in
+        order. A task that was already completed that way succeeds as a no-op.
+        
         Args:
             village_id: The ID of the village
             task_id_param: The ID of the task that's being completed
@@ -512,56 +632,25 @@ class TimedConstructionService:
             Dict[str, Any]: Result of the operation
         """
         try:
-            # First update resources with the correct rates up to the completion time
-            village = await self.update_resources_until(village_id, completion_time)
-            if not village:
-                return {"success": False, "error": "Village not found"}
-            
-            # Find the task to get its details
-            task = None
-            if hasattr(village._data, 'troop_training_tasks'):
-                task = next((t for t in village._data.troop_training_tasks if t.id == task_id_param), None)
+            result = await self.complete_village_tasks_until(village_id, completion_time)
+            if not result["success"]:
+                return result
             
-            if not task:
+            # A task that was not completed now was completed earlier, or doesn't exist
+            village = result["village"]
+            if all(t.id != task_id_param for t in result["troop_training_tasks"]):
+                if await self._is_already_completed(village._data.troop_training_tasks, task_id_param):
+                    return {"success": True, "already_completed": True}
                 return {"success": False, "error": "Task not found"}
             
-            # Mark the task as processed
-            task.processed = True
-            village.mark_as_changed()
-            
-            # Create the troop data
-            troop_data = {
-                "_id": str(ObjectId()),
-                "type": task.troop_type,
-                "quantity": task.quantity,
-                "home_id": village_id,
-                "location": village.location,
-                "mode": "idle",
-                "backpack": {
-                    "wood": 0,
-                    "stone": 0,
-                    "iron": 0,
-                    "food": 0
-                },
-                "created_at": completion_time,  # Use completion time, not current time
-                "updated_at": completion_time   # Use completion time, not current time
-            }
-            
-            # Save the village with the processed task
-            await self.village_repository.save(village)
-            
-            # Save the troop to the database
-            troop = await self.troops_repository.create(troop_data)
-            if not troop:
+            troop_id = result["troop_ids"].get(task_id_param)
+            if not troop_id:
                 return {"success": False, "error": "Failed to create troop"}
+            return {"success": True, "troop_id": troop_id}
             
-            logger.info(f"Completed troop training task {task_id_param}, created troop {troop.id}")
-            
-            # Broadcast to all users since troop training affects the map for everyone
-            await websocket_service.broadcast_troop_action_complete()
-            
-            return {"success": True, "troop_id": troop.id}
-            
+        except ConcurrentModificationError:
+            # Retries are exhausted, let the scheduler see the conflict
+            raise
         except Exception as e:
             logger.error(f"Error completing troop training task {task_id_param}: {str(e)}")
             import traceback
@@ -595,48 +684,27 @@ class TimedConstructionService:
         }
         
         try:
-            # 1. Get all villages that might have pending tasks
-            all_villages = await self.village_repository.get_all()
-            if not all_villages:
-                logger.info("No villages found when scheduling tasks")
-                return stats
-                
-            logger.info(f"Found {len(all_villages)} villages to check for pending tasks")
-            
-            # 2. Collect construction tasks from all villages
-            for village in all_villages:
-                if not village:
-                    continue
+            # 1-2. Stream the villages that have pending tasks and collect the due ones
+            villages_checked = 0
+            async for village in self.village_repository.iter_with_pending_tasks():
+                villages_checked += 1
                     
-                # Collect construction tasks
-                if hasattr(village._data, 'construction_tasks'):
-                    for task in village._data.construction_tasks:
-                        if not task.processed and task.completion_time <= target_time:
-                            all_tasks.append(TaskData(
-                                task_id=task.id,
-                                village_id=village.id,
-                                completion_time=task.completion_time,
-                                category=TaskCategory.CONSTRUCTION,
-                                data=task
-                            ))
-                            stats["total_tasks_found"] += 1
-                
-                # Collect troop training tasks
-                if hasattr(village._data, 'troop_training_tasks'):
-                    for task in village._data.troop_training_tasks:
-                        if not task.processed and task.completion_time <= target_time:
-                            all_tasks.append(TaskData(
-                                task_id=task.id,
-                                village_id=village.id,
-                                completion_time=task.completion_time,
-                                category=TaskCategory.TROOP_TRAINING,
-                                data=task
-                            ))
-                            stats["total_tasks_found"] += 1
+                # Collect the due construction and troop training tasks
+                for task in village.get_due_tasks(target_time):
+                    all_tasks.append(TaskData(
+                        task_id=task.id,
+                        village_id=village.id,
+                        completion_time=task.completion_time,
+                        category=(TaskCategory.CONSTRUCTION if isinstance(task, ConstructionTask)
+                                  else TaskCategory.TROOP_TRAINING),
+                        data=task
+                    ))
+                    stats["total_tasks_found"] += 1
+            
+            logger.info(f"Checked {villages_checked} villages with pending tasks")
             
             # 3. Collect troop action tasks that are pending
-            troop_actions = await self.troop_action_repository.get_all_active()
-            for action in troop_actions:
+            async for action in self.troop_action_repository.iter_all_active():
                 if not action.processed and action.completion_time <= target_time:
                     all_tasks.append(TaskData(
                         task_id=action.id,
@@ -650,49 +718,53 @@ class TimedConstructionService:
             # 4. Sort all tasks by completion time (earlier first)
             sorted_tasks = sorted(all_tasks, key=lambda x: x.completion_time)
             
-            # 5. Execute tasks in chronological order
+            # 5. Execute tasks in chronological order. A village's own tasks only
+            # depend on each other, so they are batched into one timeline per
+            # village; the batches are flushed before each troop action, which
+            # may touch any village, so the overall chronology stays exact.
+            pending_villages: Dict[str, datetime] = {}
+            
+            async def flush_villages() -> None:
+                for village_id, until in pending_villages.items():
+                    try:
+                        result = await self.complete_village_tasks_until(village_id, until)
+                        if not result.get("success", False):
+                            stats["errors"].append(f"Failed to complete tasks of village {village_id}: {result.get('error', 'Unknown error')}")
+                            continue
+                        stats["construction_tasks_completed"] += len(result["construction_tasks"])
+                        stats["troop_training_tasks_completed"] += len(result["troop_ids"])
+                        stats["errors"].extend(result["errors"])
+                    except Exception as village_error:
+                        error_msg = f"Error completing tasks of village {village_id}: {str(village_error)}"
+                        logger.error(error_msg)
+                        stats["errors"].append(error_msg)
+                pending_villages.clear()
+            
             for task in sorted_tasks:
+                if task.category != TaskCategory.TROOP_ACTION:
+                    # Sorted, so the last task seen is the latest one of the village
+                    pending_villages[task.village_id] = task.completion_time
+                    continue
+                
+                await flush_villages()
                 try:
-                    if task.category == TaskCategory.CONSTRUCTION:
-                        # Execute construction task
-                        result = await self.complete_construction_task(
-                            village_id=task.village_id,
-                            task_id_param=task.task_id,
-                            completion_time=task.completion_time
-                        )
-                        if result.get("success", False):
-                            stats["construction_tasks_completed"] += 1
-                        else:
-                            stats["errors"].append(f"Failed to complete construction task {task.task_id}: {result.get('error', 'Unknown error')}")
-                            
-                    elif task.category == TaskCategory.TROOP_TRAINING:
-                        # Execute troop training task
-                        result = await self.complete_troop_training_task(
-                            village_id=task.village_id,
-                            task_id_param=task.task_id,
-                            completion_time=task.completion_time
-                        )
-                        if result.get("success", False):
-                            stats["troop_training_tasks_completed"] += 1
-                        else:
-                            stats["errors"].append(f"Failed to complete troop training task {task.task_id}: {result.get('error', 'Unknown error')}")
-                            
-                    elif task.category == TaskCategory.TROOP_ACTION:
-                        # Execute troop action task
-                        troop_action_service = self._get_troop_action_service()
-                        result = await troop_action_service.complete_troop_action(
-                            action_id=task.task_id,
-                            completion_time=task.completion_time
-                        )
-                        if result.get("success", False):
-                            stats["troop_action_tasks_completed"] += 1
-                        else:
-                            stats["errors"].append(f"Failed to complete troop action task {task.task_id}: {result.get('error', 'Unknown error')}")
+                    # Execute troop action task
+                    troop_action_service = self._get_troop_action_service()
+                    result = await troop_action_service.complete_troop_action(
+                        action_id=task.task_id,
+                        completion_time=task.completion_time
+                    )
+                    if result.get("success", False):
+                        stats["troop_action_tasks_completed"] += 1
+                    else:
+                        stats["errors"].append(f"Failed to complete troop action task {task.task_id}: {result.get('error', 'Unknown error')}")
                 
                 except Exception as task_error:
                     error_msg = f"Error completing task {task.task_id} of type {task.category}: {str(task_error)}"
                     logger.error(error_msg)
                     stats["errors"].append(error_msg)
+            
+            await flush_villages()
                     
             # Calculate total completed tasks
             stats["total_tasks_completed"] = (
@@ -720,7 +792,7 @@ class TimedConstructionService:
     async def _validate_building_creation(self, village_id: str, building_type: ConstructionType, 
                                         slot: int) -> Dict[str, Any]:
         """Validate building creation parameters without creating the building"""
-        village = await self.village_repository.get_by_id(village_id)
+        village = await self._get_village_now(village_id)
         if not village:
             return {"success": False, "error": "Village not found"}
             
@@ -732,14 +804,11 @@ class TimedConstructionService:
             }
             
         # Check if there's already a pending task for this slot
-        if hasattr(village._data, 'construction_tasks'):
-            for task in village._data.construction_tasks:
-                if not task.processed and task.slot == slot and (
-                    task.task_type == TaskType.CREATE_BUILDING or task.task_type == TaskType.UPGRADE_BUILDING):
-                    return {
-                        "success": False, 
-                        "error": f"There is already a pending building task for slot {slot}"
-                    }
+        if village.has_pending_construction_task(slot, TaskType.CREATE_BUILDING, TaskType.UPGRADE_BUILDING):
+            return {
+                "success": False, 
+                "error": f"There is already a pending building task for slot {slot}"
+            }
             
         # Check if we've reached the maximum number of buildings
         if len(village.get_all_buildings()) >= village.MAX_CONSTRUCTIONS:
@@ -791,7 +860,7 @@ class TimedConstructionService:
     async def _validate_field_creation(self, village_id: str, field_type: ResourceFieldType, 
                                      slot: int) -> Dict[str, Any]:
         """Validate resource field creation parameters without creating the field"""
-        village = await self.village_repository.get_by_id(village_id)
+        village = await self._get_village_now(village_id)
         if not village:
             return {"success": False, "error": "Village not found"}
             
@@ -803,14 +872,11 @@ class TimedConstructionService:
             }
             
         # Check if there's already a pending task for this slot
-        if hasattr(village._data, 'construction_tasks'):
-            for task in village._data.construction_tasks:
-                if not task.processed and task.slot == slot and (
-                    task.task_type == TaskType.CREATE_FIELD or task.task_type == TaskType.UPGRADE_FIELD):
-                    return {
-                        "success": False, 
-                        "error": f"There is already a pending resource field task for slot {slot}"
-                    }
+        if village.has_pending_construction_task(slot, TaskType.CREATE_FIELD, TaskType.UPGRADE_FIELD):
+            return {
+                "success": False, 
+                "error": f"There is already a pending resource field task for slot {slot}"
+            }
             
         # Check if we've reached the maximum number of fields
         if len(village.get_all_resource_fields()) >= village.MAX_FIELDS:
@@ -826,27 +892,17 @@ class TimedConstructionService:
                 village_center = building
                 break
         
-        # Define slot restrictions based on village center level
-        restricted_slots = {
-            1: [0, 1, 2, 3, 4, 5, 6, 7],
-            3: [0, 1, 2, 3, 4, 5, 6, 7, 11, 12, 13],
-            5: [0, 1, 2, 3, 4, 5, 6, 7, 11, 12, 13, 17, 18, 19],
-            7: [0, 1, 2, 3, 4, 5, 6, 7, 11, 12, 13, 17, 18, 19, 8, 9, 10],
-            9: [0, 1, 2, 3, 4, 5, 6, 7, 11, 12, 13, 17, 18, 19, 8, 9, 10, 14, 15, 16]
-        }
-        
-        # Check if the requested slot is restricted
-        for required_level, slots in restricted_slots.items():
-            if slot in slots:
-                # If village center doesn't exist or its level is too low
-                if not village_center or village_center.level < required_level:
-                    return {
-                        "success": False,
-                        "error": f"Resource field in slot {slot} requires Village Center level {required_level}",
-                        "required_village_center_level": required_level,
-                        "current_village_center_level": village_center.level if village_center else 0
-                    }
-                break
+        # Check the Village Center level the requested slot is unlocked at
+        required_level = village.get_field_slot_required_level(slot)
+        if required_level is not None:
+            # If village center doesn't exist or its level is too low
+            if not village_center or village_center.level < required_level:
+                return {
+                    "success": False,
+                    "error": f"Resource field in slot {slot} requires Village Center level {required_level}",
+                    "required_village_center_level": required_level,
+                    "current_village_center_level": village_center.level if village_center else 0
+                }
             
         # Check if we can afford the field
         from minute_empire.domain.resource_field import ResourceProducer
@@ -890,7 +946,7 @@ class TimedConstructionService:
         
     async def _validate_building_upgrade(self, village_id: str, slot: int) -> Dict[str, Any]:
         """Validate building upgrade parameters without upgrading the building"""
-        village = await self.village_repository.get_by_id(village_id)
+        village = await self._get_village_now(village_id)
         if not village:
             return {"success": False, "error": "Village not found"}
             
@@ -900,13 +956,11 @@ class TimedConstructionService:
             return {"success": False, "error": f"No building found in slot {slot}"}
             
         # Check if there's already a pending upgrade task for this building
-        if hasattr(village._data, 'construction_tasks'):
-            for task in village._data.construction_tasks:
-                if not task.processed and task.slot == slot and task.task_type == TaskType.UPGRADE_BUILDING:
-                    return {
-                        "success": False, 
-                        "error": f"There is already a pending upgrade task for building in slot {slot}"
-                    }
+        if village.has_pending_construction_task(slot, TaskType.UPGRADE_BUILDING):
+            return {
+                "success": False, 
+                "error": f"There is already a pending upgrade task for building in slot {slot}"
+            }
             
         # Check if we can afford the upgrade
         if not building.can_upgrade():
@@ -953,7 +1007,7 @@ class TimedConstructionService:
         
     async def _validate_field_upgrade(self, village_id: str, slot: int) -> Dict[str, Any]:
         """Validate field upgrade parameters without upgrading the field"""
-        village = await self.village_repository.get_by_id(village_id)
+        village = await self._get_village_now(village_id)
         if not village:
             return {"success": False, "error": "Village not found"}
             
@@ -963,13 +1017,11 @@ class TimedConstructionService:
             return {"success": False, "error": f"No resource field found in slot {slot}"}
             
         # Check if there's already a pending upgrade task for this field
-        if hasattr(village._data, 'construction_tasks'):
-            for task in village._data.construction_tasks:
-                if not task.processed and task.slot == slot and task.task_type == TaskType.UPGRADE_FIELD:
-                    return {
-                        "success": False, 
-                        "error": f"There is already a pending upgrade task for field in slot {slot}"
-                    }
+        if village.has_pending_construction_task(slot, TaskType.UPGRADE_FIELD):
+            return {
+                "success": False, 
+                "error": f"There is already a pending upgrade task for field in slot {slot}"
+            }
             
         # Check if we can afford the upgrade
         if not field.can_upgrade():
@@ -1016,18 +1068,16 @@ class TimedConstructionService:
         
     async def _validate_troop_training(self, village_id: str, troop_type: TroopType, quantity: int) -> Dict[str, Any]:
         """Validate troop training parameters without training the troops"""
-        village = await self.village_repository.get_by_id(village_id)
+        village = await self._get_village_now(village_id)
         if not village:
             return {"success": False, "error": "Village not found"}
             
         # Check if there's already a pending training task for this troop
-        if hasattr(village._data, 'troop_training_tasks'):
-            for task in village._data.troop_training_tasks:
-                if not task.processed and task.troop_type == troop_type.value:
-                    return {
-                        "success": False, 
-                        "error": f"There is already a pending troop training task for troop type {troop_type.value}"
-                    }
+        if village.has_pending_troop_training(troop_type.value):
+            return {
+                "success": False, 
+                "error": f"There is already a pending troop training task for troop type {troop_type.value}"
+            }
             
         # Check if we can afford the training
         costs = Troop.get_training_cost(troop_type, quantity)
@@ -1062,6 +1112,8 @@ class TimedConstructionService:
         Schedule all pending tasks that are due after the specified time.
         This function scans for all pending construction tasks, troop training tasks, 
         and troop actions across all villages and schedules them for execution.
+        Scheduled tasks are kept in the durable scheduler queue, so this scan is
+        only needed to fill that queue the first time, or to rebuild it.
         
         Args:
             after_time: Schedule only tasks that are due after this time
@@ -1086,29 +1138,20 @@ class TimedConstructionService:
         troop_action_repo = TroopActionRepository()
         
         try:
-            # 1. Get all villages that might have pending tasks
-            all_villages = await village_repository.get_all()
-            if not all_villages:
-                logger.info("No villages found when scheduling tasks")
-                return result
-            
-            logger.info(f"Found {len(all_villages)} villages to check for pending future tasks")
-            
-            # 2. Process villages to find all pending future tasks
-            for village in all_villages:
-                if not village:
-                    continue
+            # 1-2. Stream the villages that have pending tasks and schedule the future ones
+            async for village in village_repository.iter_with_pending_tasks():
                     
                 # A. Schedule construction tasks (buildings and fields)
                 if hasattr(village._data, 'construction_tasks'):
                     construction_count = 0
-                    for task in village._data.construction_tasks:
-                        if not task.processed and task.completion_time > after_time:
+                    for task in village.get_pending_construction_tasks():
+                        if task.completion_time > after_time:
                             # Schedule the task based on type
-                            await task_scheduler.schedule_task(
+                            await task_scheduler.schedule(
                                 task_id=task.id,
                                 execution_time=task.completion_time,
-                                callback=self.complete_construction_task,
+                                kind=CONSTRUCTION_TASK_KIND,
+                                serial_key=f"village:{village.id}",
                                 village_id=village.id,
                                 task_id_param=task.id,
                                 completion_time=task.completion_time
@@ -1123,13 +1166,14 @@ class TimedConstructionService:
                 # B. Schedule troop training tasks
                 if hasattr(village._data, 'troop_training_tasks'):
                     training_count = 0
-                    for task in village._data.troop_training_tasks:
-                        if not task.processed and task.completion_time > after_time:
+                    for task in village.get_pending_troop_training_tasks():
+                        if task.completion_time > after_time:
                             # Schedule the troop training task
-                            await task_scheduler.schedule_task(
+                            await task_scheduler.schedule(
                                 task_id=task.id,
                                 execution_time=task.completion_time,
-                                callback=self.complete_troop_training_task,
+                                kind=TROOP_TRAINING_TASK_KIND,
+                                serial_key=f"village:{village.id}",
                                 village_id=village.id,
                                 task_id_param=task.id,
                                 completion_time=task.completion_time
@@ -1142,18 +1186,16 @@ class TimedConstructionService:
                         logger.info(f"Scheduled {training_count} future troop training tasks for village {village.id}")
             
             # 3. Schedule troop action tasks (movements and attacks)
-            pending_actions = await troop_action_repo.get_pending_actions()
-            
             action_count = 0
-            troop_action_service = self._get_troop_action_service()
             
-            for action in pending_actions:
+            async for action in troop_action_repo.iter_all_active():
                 if not action.processed and action.completion_time > after_time:
                     # Schedule future actions
-                    await task_scheduler.schedule_task(
+                    await task_scheduler.schedule(
                         task_id=action.id,
                         execution_time=action.completion_time,
-                        callback=troop_action_service.complete_troop_action,
+                        kind=TROOP_ACTION_TASK_KIND,
+                        serial_key=f"troop:{action.troop_id}",
                         action_id=action.id,
                         completion_time=action.completion_time
                     )
@@ -1175,6 +1217,7 @@ class TimedConstructionService:
         
         return result 
 
+    @retry_on_conflict
     async def start_building_destruction(self, village_id: str, slot: int) -> Dict[str, Any]:
         """
         Start timed building destruction.
@@ -1192,7 +1235,7 @@ class TimedConstructionService:
             return validation_result
             
         # Get the village and building after validation
-        village = await self.village_repository.get_by_id(village_id)
+        village = await self._get_village_now(village_id)
         building = village.get_building(slot)
         
         # Deduct resources for the task (costs were already validated in _validate_building_destruction)
@@ -1217,10 +1260,11 @@ class TimedConstructionService:
         await self.village_repository.save(village)
         
         # Schedule the task completion
-        await task_scheduler.schedule_task(
+        await task_scheduler.schedule(
             task_id=task.id,
             execution_time=task.completion_time,
-            callback=self.complete_construction_task,
+            kind=CONSTRUCTION_TASK_KIND,
+            serial_key=f"village:{village_id}",
             village_id=village_id,
             task_id_param=task.id,
             completion_time=task.completion_time
@@ -1235,6 +1279,7 @@ class TimedConstructionService:
             "task_id": task.id
         }
         
+    @retry_on_conflict
     async def start_field_destruction(self, village_id: str, slot: int) -> Dict[str, Any]:
         """
         Start timed field destruction.
@@ -1252,7 +1297,7 @@ class TimedConstructionService:
             return validation_result
             
         # Get the village and field after validation
-        village = await self.village_repository.get_by_id(village_id)
+        village = await self._get_village_now(village_id)
         field = village.get_resource_field(slot)
         
         # Deduct resources for the task (costs were already validated in _validate_field_destruction)
@@ -1277,10 +1322,11 @@ class TimedConstructionService:
         await self.village_repository.save(village)
         
         # Schedule the task completion
-        await task_scheduler.schedule_task(
+        await task_scheduler.schedule(
             task_id=task.id,
             execution_time=task.completion_time,
-            callback=self.complete_construction_task,
+            kind=CONSTRUCTION_TASK_KIND,
+            serial_key=f"village:{village_id}",
             village_id=village_id,
             task_id_param=task.id,
             completion_time=task.completion_time
@@ -1307,7 +1353,7 @@ class TimedConstructionService:
             Dict[str, Any]: Validation result with success flag and error message
         """
         # Get the village
-        village = await self.village_repository.get_by_id(village_id)
+        village = await self._get_village_now(village_id)
         if not village:
             return {
                 "success": False,
@@ -1323,13 +1369,11 @@ class TimedConstructionService:
             }
             
         # Check if there is already a task for this building
-        if hasattr(village._data, 'construction_tasks'):
-            for task in village._data.construction_tasks:
-                if not task.processed and task.slot == slot:
-                    return {
-                        "success": False,
-                        "error": f"There is already an ongoing task for the building in slot {slot}"
-                    }
+        if village.has_pending_construction_task(slot):
+            return {
+                "success": False,
+                "error": f"There is already an ongoing task for the building in slot {slot}"
+            }
         
         # Check if there are sufficient resources for the task
         costs = building.get_upgrade_cost()
@@ -1359,7 +1403,7 @@ class TimedConstructionService:
             Dict[str, Any]: Validation result with success flag and error message
         """
         # Get the village
-        village = await self.village_repository.get_by_id(village_id)
+        village = await self._get_village_now(village_id)
         if not village:
             return {
                 "success": False,
@@ -1375,13 +1419,11 @@ class TimedConstructionService:
             }
             
         # Check if there is already a task for this field
-        if hasattr(village._data, 'construction_tasks'):
-            for task in village._data.construction_tasks:
-                if not task.processed and task.slot == slot:
-                    return {
-                        "success": False,
-                        "error": f"There is already an ongoing task for the field in slot {slot}"
-                    }
+        if village.has_pending_construction_task(slot):
+            return {
+                "success": False,
+                "error": f"There is already an ongoing task for the field in slot {slot}"
+            }
         
         # Check if there are sufficient resources for the task
         costs = field.get_upgrade_cost()
@@ -1397,4 +1439,20 @@ class TimedConstructionService:
         return {
             "success": True,
             "cost": costs  # Include the cost in the result for reference
-        } 
\ No newline at end of file
+        } 
+
+# Handlers of the durable task kinds; a fresh service per task, like the API endpoints use.
+# Both kinds share one batch handler, so co-due tasks of a village complete together.
+async def _complete_construction_task(**payload) -> Dict[str, Any]:
+    return await TimedConstructionService().complete_construction_task(**payload)
+
+async def _complete_troop_training_task(**payload) -> Dict[str, Any]:
+    return await TimedConstructionService().complete_troop_training_task(**payload)
+
+async def _complete_task_batch(tasks: List[Dict[str, Any]]) -> Dict[str, Any]:
+    return await TimedConstructionService().complete_task_batch(tasks)
+
+task_scheduler.register_kind(CONSTRUCTION_TASK_KIND, _complete_construction_task,
+                             batch_handler=_complete_task_batch)
+task_scheduler.register_kind(TROOP_TRAINING_TASK_KIND, _complete_troop_training_task,
+                             batch_handler=_complete_task_batch)
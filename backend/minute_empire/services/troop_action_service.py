@@ -7,6 +7,8 @@ import logging
 from minute_empire.repositories.village_repository import VillageRepository
 from minute_empire.repositories.troops_repository import TroopsRepository
 from minute_empire.repositories.troop_action_repository import TroopActionRepository
+from minute_empire.repositories.unit_of_work import UnitOfWork
+from minute_empire.repositories.concurrency import ConcurrentModificationError, retry_on_conflict
 from minute_empire.schemas.schemas import ActionType, TroopType, TroopMode, Location, VillageInDB
 from minute_empire.domain.troop import Troop
 from minute_empire.services.task_scheduler import task_scheduler
@@ -16,6 +18,9 @@ from minute_empire.services.websocket_service import websocket_service
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Name the task scheduler stores in its durable queue for troop action completions
+TROOP_ACTION_TASK_KIND = "complete_troop_action"
+
 class TroopActionService:
     """Service for managing troop actions like movement and combat"""
     
@@ -157,10 +162,11 @@ class TroopActionService:
                 return {"success": False, "error": f"Failed to update troop status to {TroopMode.MOVE}"}
             
             # Schedule the action to be completed at the completion time
-            await task_scheduler.schedule_task(
+            await task_scheduler.schedule(
                 task_id=action.id,
                 execution_time=completion_time,
-                callback=self.complete_troop_action,
+                kind=TROOP_ACTION_TASK_KIND,
+                serial_key=f"troop:{troop_id}",
                 action_id=action.id,
                 completion_time=completion_time
             )
@@ -238,10 +244,11 @@ class TroopActionService:
                 return {"success": False, "error": f"Failed to update troop status to {TroopMode.ATTACK}"}
             
             # Schedule the action to be completed at the completion time
-            await task_scheduler.schedule_task(
+            await task_scheduler.schedule(
                 task_id=action.id,
                 execution_time=completion_time,
-                callback=self.complete_troop_action,
+                kind=TROOP_ACTION_TASK_KIND,
+                serial_key=f"troop:{troop_id}",
                 action_id=action.id,
                 completion_time=completion_time
             )
@@ -261,6 +268,7 @@ class TroopActionService:
             logger.error(f"Error creating attack action: {str(e)}")
             return {"success": False, "error": f"Error creating attack action: {str(e)}"}
     
+    @retry_on_conflict
     async def complete_troop_action(self, action_id: str, completion_time: datetime) -> Dict[str, Any]:
         """
         Complete a troop action at its scheduled time.
@@ -279,6 +287,9 @@ class TroopActionService:
             if not action:
                 logger.error(f"Action {action_id} not found for completion")
                 return {"success": False, "error": "Action not found"}
+            if action.processed:
+                # Already completed, e.g. a queued task run again after a restart
+                return {"success": True, "already_completed": True}
                 
             # Get the troop
             troop = await self.troops_repository.get_by_id(action.troop_id)
@@ -289,6 +300,9 @@ class TroopActionService:
             
             logger.info(f"Completing action {action_id} for troop {troop.id}: {action.action_type.value} to ({action.target_location.x}, {action.target_location.y})")
             
+            # Collect every troop and village write of this action and flush them together
+            uow = UnitOfWork(operation_id=action_id)
+            
             # Initialize a list to track villages that need resource updates
             involved_villages = set()
             
@@ -329,14 +343,15 @@ class TroopActionService:
                         defender_troops=enemy_troops,
                         target_location=action.target_location,
                         is_movement=True,
-                        start_location=action.start_location
+                        start_location=action.start_location,
+                        uow=uow
                     )
                     
                     # If the attacker lost all troops or didn't defeat all defenders, don't move
                     if combat_result["attacker_all_dead"] or not combat_result["all_defenders_defeated"]:
                         # Don't move, update only mode if alive
                         if not combat_result["attacker_all_dead"]:
-                            await self.troops_repository.update(troop.id, {"mode": TroopMode.IDLE.value})
+                            uow.update_troop(troop.id, {"mode": TroopMode.IDLE.value}, version=troop.version)
                     else:
                         # Attacker won, can move to the location
                         update_data = {
@@ -346,11 +361,8 @@ class TroopActionService:
                             },
                             "mode": TroopMode.IDLE.value
                         }
-                        update_result = await self.troops_repository.update(troop.id, update_data)
-                        if update_result:
-                            logger.info(f"Moved troop {troop.id} to ({action.target_location.x}, {action.target_location.y}) after combat")
-                        else:
-                            logger.error(f"Failed to update troop {troop.id} location after combat")
+                        uow.update_troop(troop.id, update_data, version=troop.version)
+                        logger.info(f"Moved troop {troop.id} to ({action.target_location.x}, {action.target_location.y}) after combat")
                             
                     result["combat"] = combat_result
                     
@@ -374,13 +386,8 @@ class TroopActionService:
                         "mode": TroopMode.IDLE.value
                     }
                     
-                    update_result = await self.troops_repository.update(troop.id, update_data)
-                    if update_result:
-                        logger.info(f"Moved troop {troop.id} to ({action.target_location.x}, {action.target_location.y})")
-                    else:
-                        logger.error(f"Failed to update troop {troop.id} location")
-                        result["success"] = False
-                        result["error"] = "Failed to update troop location"
+                    uow.update_troop(troop.id, update_data, version=troop.version)
+                    logger.info(f"Moved troop {troop.id} to ({action.target_location.x}, {action.target_location.y})")
                     
                     # Check if we moved to an undefended enemy village - if so, steal resources
                     if target_village and target_village.owner_id != troop.home_id:
@@ -391,7 +398,8 @@ class TroopActionService:
                             stolen_resources = await self._steal_resources(
                                 attacker_troop=troop,
                                 target_village=target_village,
-                                new_attacker_quantity=troop.quantity
+                                new_attacker_quantity=troop.quantity,
+                                uow=uow
                             )
                             
                             if any(value > 0 for value in stolen_resources.values()):
@@ -411,7 +419,8 @@ class TroopActionService:
                                 # This is a friendly village, deposit resources
                                 deposited_resources = await self._deposit_resources(
                                     troop=troop,
-                                    target_village=target_village
+                                    target_village=target_village,
+                                    uow=uow
                                 )
                                 
                                 if any(value > 0 for value in deposited_resources.values()):
@@ -447,13 +456,14 @@ class TroopActionService:
                         defender_troops=enemy_troops,
                         target_location=action.target_location,
                         is_movement=False,
-                        start_location=action.start_location
+                        start_location=action.start_location,
+                        uow=uow
                     )
                     
                     # For attack actions, we never move the troop to the target location
                     # We just update the troop's mode back to IDLE if it survived
                     if not combat_result["attacker_all_dead"]:
-                        await self.troops_repository.update(troop.id, {"mode": TroopMode.IDLE.value})
+                        uow.update_troop(troop.id, {"mode": TroopMode.IDLE.value}, version=troop.version)
                         
                     result["combat"] = combat_result
                     
@@ -472,7 +482,7 @@ class TroopActionService:
                     # Even without combat, still update resources for the attacker's home village
                     await self._update_all_village_resources([troop.home_id], completion_time)
                     
-                    await self.troops_repository.update(troop.id, {"mode": TroopMode.IDLE.value})
+                    uow.update_troop(troop.id, {"mode": TroopMode.IDLE.value}, version=troop.version)
                     logger.info(f"Attack completed for troop {troop.id} but no enemies found at ({action.target_location.x}, {action.target_location.y})")
                     
                     # If there's an enemy village with no defenders, troops should still be able to steal resources during attack
@@ -484,13 +494,17 @@ class TroopActionService:
                             stolen_resources = await self._steal_resources(
                                 attacker_troop=troop,
                                 target_village=target_village,
-                                new_attacker_quantity=troop.quantity
+                                new_attacker_quantity=troop.quantity,
+                                uow=uow
                             )
                             
                             if any(value > 0 for value in stolen_resources.values()):
                                 result["stolen_resources"] = stolen_resources
                                 logger.info(f"Troops stole resources from undefended village {target_village.id}")
             
+            # Write all troop and village changes of the action in one go
+            await uow.commit()
+            
             # Mark action as processed
             await self.action_repository.mark_processed(action_id)
             
@@ -499,6 +513,9 @@ class TroopActionService:
             
             return result
             
+        except ConcurrentModificationError:
+            # The action stays unprocessed, let retry_on_conflict reload and run it again
+            raise
         except Exception as e:
             logger.error(f"Error completing troop action {action_id}: {str(e)}")
             import traceback
@@ -551,7 +568,8 @@ class TroopActionService:
         defender_troops: List[Any],
         target_location: Location,
         is_movement: bool,
-        start_location: Location
+        start_location: Location,
+        uow: UnitOfWork
     ) -> Dict[str, Any]:
         """
         Process combat between attacker and defender troops.
@@ -562,6 +580,7 @@ class TroopActionService:
             target_location: The location of the combat
             is_movement: Whether this combat was triggered by movement (True) or attack (False)
             start_location: The starting location of the attacker
+            uow: Unit of work collecting the troop and village writes
             
         Returns:
             Dict containing combat results
@@ -617,13 +636,20 @@ class TroopActionService:
         
         # Check if any troop is at its home village
         defender_home_bonus = False
-        for defender_troop in defender_troops:
-            # Find if there's a village at this location
-            village_at_location = await self.village_repository.find_by_location(
-                target_location.x, target_location.y
-            )
-            
-            if village_at_location:
+        
+        # Find if there's a village at this location (same for every defender)
+        village_at_location = await self.village_repository.find_by_location(
+            target_location.x, target_location.y
+        )
+        
+        if village_at_location:
+            checked_home_ids = set()
+            for defender_troop in defender_troops:
+                # Several defenders can share a home village, look each one up once
+                if defender_troop.home_id in checked_home_ids:
+                    continue
+                checked_home_ids.add(defender_troop.home_id)
+                
                 # Get the home village of the defender troop to find its owner
                 defender_home_village = await self.village_repository.get_by_id(defender_troop.home_id)
                 
@@ -690,14 +716,14 @@ class TroopActionService:
         # Apply losses to attacker
         if attacker_all_dead or new_attacker_quantity <= 0:
             # All attacker troops die - delete them from database instead of marking as DEAD
-            await self.troops_repository.delete(attacker_troop.id)
+            uow.delete_troop(attacker_troop.id, version=attacker_troop.version)
             attacker_all_dead = True
             new_attacker_quantity = 0
         else:
             # Update attacker with new quantity
-            await self.troops_repository.update(attacker_troop.id, {
+            uow.update_troop(attacker_troop.id, {
                 "quantity": new_attacker_quantity
-            })
+            }, version=attacker_troop.version)
             
         # Apply losses to each defender troop
         all_defenders_defeated = True
@@ -708,12 +734,12 @@ class TroopActionService:
             
             if defender_all_dead or new_defender_quantity <= 0:
                 # All defender troops die - delete them from database instead of marking as DEAD
-                await self.troops_repository.delete(defender_troop.id)
+                uow.delete_troop(defender_troop.id, version=defender_troop.version)
             else:
                 # Update defender with new quantity
-                await self.troops_repository.update(defender_troop.id, {
+                uow.update_troop(defender_troop.id, {
                     "quantity": new_defender_quantity
-                })
+                }, version=defender_troop.version)
                 all_defenders_defeated = False
                 surviving_defenders.append({
                     "troop": defender_troop,
@@ -735,7 +761,8 @@ class TroopActionService:
                 attacker_backpack=attacker_backpack,
                 defender_troops=defender_troops,
                 surviving_defenders=surviving_defenders,
-                defender_data=defender_data
+                defender_data=defender_data,
+                uow=uow
             )
             
             # Extract relevant data from redistribution result
@@ -756,7 +783,8 @@ class TroopActionService:
                 stolen_resources = await self._steal_resources(
                     attacker_troop=attacker_troop,
                     target_village=target_village,
-                    new_attacker_quantity=new_attacker_quantity
+                    new_attacker_quantity=new_attacker_quantity,
+                    uow=uow
                 )
         
         # Detailed combat log for debugging
@@ -796,7 +824,8 @@ class TroopActionService:
         attacker_backpack: Dict[str, int],
         defender_troops: List[Any],
         surviving_defenders: List[Dict[str, Any]],
-        defender_data: List[Dict[str, Any]]
+        defender_data: List[Dict[str, Any]],
+        uow: UnitOfWork
     ) -> Dict[str, Any]:
         """
         Redistribute resources from fallen troops to surviving troops based on proportional losses.
@@ -810,6 +839,7 @@ class TroopActionService:
             defender_troops: List of all defending troops involved in combat
             surviving_defenders: List of surviving defender troops with new quantities
             defender_data: Original data of defender troops before combat
+            uow: Unit of work collecting the troop writes
             
         Returns:
             Dict with resource redistribution results
@@ -888,8 +918,8 @@ class TroopActionService:
                                     defender_backpack = defender_troop.backpack.dict() if hasattr(defender_troop, 'backpack') else {}
                                     defender_backpack[resource_type] = protected_amount
                                     
-                                    # Save to database
-                                    await self.troops_repository.update(defender_id, {
+                                    # Queue the database write
+                                    uow.update_troop(defender_id, {
                                         "backpack": defender_backpack
                                     })
                                     break
@@ -987,8 +1017,8 @@ class TroopActionService:
                         capacity_data["remaining"][resource_type] -= amount_to_give
                         capacity_data["current_total"] += amount_to_give
                         
-                        # Save to database
-                        await self.troops_repository.update(defender_id, {
+                        # Queue the database write
+                        uow.update_troop(defender_id, {
                             "backpack": defender_backpack
                         })
                         
@@ -1039,9 +1069,9 @@ class TroopActionService:
                     
                     logger.info(f"[RESOURCE_DEBUG] Giving {resource_type}: {amount_to_give} to attacker")
             
-            # Save attacker's backpack to database
+            # Queue the attacker's backpack write
             if any(captured_by_attacker.values()):
-                await self.troops_repository.update(attacker_troop.id, {
+                uow.update_troop(attacker_troop.id, {
                     "backpack": attacker_backpack
                 })
                 logger.info(f"[RESOURCE_DEBUG] Attacker updated backpack: {attacker_backpack}")
@@ -1059,7 +1089,8 @@ class TroopActionService:
             
         return result
 
-    async def _steal_resources(self, attacker_troop: Any, target_village: Any, new_attacker_quantity: int) -> Dict[str, float]:
+    async def _steal_resources(self, attacker_troop: Any, target_village: Any, new_attacker_quantity: int,
+                               uow: UnitOfWork) -> Dict[str, float]:
         """
         Calculate and transfer resources from a target village to an attacker's troops
         
@@ -1067,6 +1098,7 @@ class TroopActionService:
             attacker_troop: The attacking troop
             target_village: The village to steal from
             new_attacker_quantity: The quantity of attacking troops after combat
+            uow: Unit of work collecting the troop and village writes
             
         Returns:
             Dict with amounts of resources stolen
@@ -1201,13 +1233,14 @@ class TroopActionService:
         logger.info(f"[RESOURCE_DEBUG] Final stolen resources before transfer: {stolen_resources}")
         
         # Now update village and troop resources
-        await self._transfer_resources(target_village.id, attacker_troop.id, stolen_resources)
+        await self._transfer_resources(target_village.id, attacker_troop.id, stolen_resources, uow)
         
         logger.info(f"[RESOURCE_DEBUG] Resources stolen: {stolen_resources} from village {target_village.id} by troop {attacker_troop.id}")
         
         return stolen_resources
 
-    async def _transfer_resources(self, from_village_id: str, to_troop_id: str, resources: Dict[str, float]) -> None:
+    async def _transfer_resources(self, from_village_id: str, to_troop_id: str, resources: Dict[str, float],
+                                  uow: UnitOfWork) -> None:
         """
         Transfer resources from a village to a troop's backpack
         
@@ -1215,6 +1248,7 @@ class TroopActionService:
             from_village_id: The ID of the village to take resources from
             to_troop_id: The ID of the troop to receive resources
             resources: Dictionary of resources to transfer
+            uow: Unit of work collecting the troop and village writes
         """
         logger.info(f"[RESOURCE_DEBUG] Transferring resources | From village: {from_village_id} | To troop: {to_troop_id} | Resources: {resources}")
         
@@ -1222,17 +1256,14 @@ class TroopActionService:
         rounded_resources = {k: round(v) for k, v in resources.items()}
         logger.info(f"[RESOURCE_DEBUG] Rounded resources: {rounded_resources}")
         
-        # Get the village
-        from minute_empire.domain.village import Village
-        village_data = await self.village_repository.get_by_id(from_village_id)
-        if not village_data:
+        # Get the village (the tracked instance, so earlier changes in this action are kept)
+        village = await uow.get_village(from_village_id)
+        if not village:
             logger.error(f"[RESOURCE_DEBUG] Village {from_village_id} not found when trying to transfer resources")
             return
-            
-        village = village_data  # It's already a Village object, no need to wrap it
         
-        # Get the troop
-        troop = await self.troops_repository.get_by_id(to_troop_id)
+        # Get the troop as it is after the writes queued so far (e.g. combat captures)
+        troop = await uow.get_troop(to_troop_id)
         if not troop:
             logger.error(f"[RESOURCE_DEBUG] Troop {to_troop_id} not found when trying to transfer resources")
             return
@@ -1244,7 +1275,17 @@ class TroopActionService:
         backpack = troop.backpack.dict() if hasattr(troop, 'backpack') else {}
         logger.info(f"[RESOURCE_DEBUG] Troop backpack before transfer: {backpack}")
         
+        # A retry of an action whose village write went through: only the troop side is left
+        applied = village.get_applied_transfer(uow.operation_id) if uow.operation_id else None
+        if applied is not None:
+            for resource_type, amount in applied.items():
+                backpack[resource_type] = backpack.get(resource_type, 0) + amount
+            uow.update_troop(troop.id, {"backpack": backpack})
+            logger.info(f"[RESOURCE_DEBUG] Transfer already taken from village {village.id}, troop backpack: {backpack}")
+            return
+        
         resources_modified = False
+        transferred = {}
         
         for resource_type, amount in rounded_resources.items():
             if amount > 0:
@@ -1253,6 +1294,7 @@ class TroopActionService:
                 if current_village_amount >= amount:
                     setattr(village.resources, resource_type, current_village_amount - amount)
                     resources_modified = True
+                    transferred[resource_type] = amount
                     logger.info(f"[RESOURCE_DEBUG] Deducted {amount} {resource_type} from village")
                     
                     # Add to troop
@@ -1261,26 +1303,22 @@ class TroopActionService:
                 else:
                     logger.warning(f"[RESOURCE_DEBUG] Not enough {resource_type} in village: have {current_village_amount}, need {amount}")
         
-        # Save changes to village
+        # Queue changes to village
         if resources_modified:
-            # Mark the village as changed which updates the timestamp
-            village.mark_as_changed()
-            
-            # Save the village directly using the repository
-            save_result = await self.village_repository.save(village)
-            if save_result:
-                logger.info(f"[RESOURCE_DEBUG] Village resources after transfer successfully saved: wood={village.resources.wood}, stone={village.resources.stone}, iron={village.resources.iron}, food={village.resources.food}")
-            else:
-                logger.error(f"[RESOURCE_DEBUG] Failed to save village {from_village_id} after resource transfer")
+            # Mark the village resources as changed which updates the timestamp
+            village.mark_as_changed("resources")
+            if uow.operation_id:
+                village.record_transfer(uow.operation_id, transferred)
+            logger.info(f"[RESOURCE_DEBUG] Village resources after transfer: wood={village.resources.wood}, stone={village.resources.stone}, iron={village.resources.iron}, food={village.resources.food}")
         
-        # Save changes to troop
+        # Queue changes to troop
         if resources_modified:
-            await self.troops_repository.update(troop.id, {"backpack": backpack})
+            uow.update_troop(troop.id, {"backpack": backpack})
             logger.info(f"[RESOURCE_DEBUG] Troop backpack after transfer: {backpack}")
         else:
             logger.info("[RESOURCE_DEBUG] No resources were modified during transfer")
 
-    async def _deposit_resources(self, troop: Any, target_village: Any) -> Dict[str, float]:
+    async def _deposit_resources(self, troop: Any, target_village: Any, uow: UnitOfWork) -> Dict[str, float]:
         """
         Deposit resources from a troop's backpack into a friendly village.
         If the village storage is full, the excess resources are lost.
@@ -1288,6 +1326,7 @@ class TroopActionService:
         Args:
             troop: The troop carrying resources
             target_village: The village to deposit resources into
+            uow: Unit of work collecting the troop and village writes
             
         Returns:
             dict: A dictionary of the deposited resources
@@ -1312,11 +1351,18 @@ class TroopActionService:
         logger.info(f"[RESOURCE_DEBUG] Troop backpack before deposit: wood={backpack.get('wood', 0)} stone={backpack.get('stone', 0)} iron={backpack.get('iron', 0)} food={backpack.get('food', 0)}")
         logger.info(f"[RESOURCE_DEBUG] Village resources before deposit: wood={target_village.resources.wood} stone={target_village.resources.stone} iron={target_village.resources.iron} food={target_village.resources.food}")
         
-        # Get the village from the repository to ensure we have the correct object
-        village = await self.village_repository.get_by_id(target_village.id)
+        # Get the tracked village to ensure we have the correct object
+        village = await uow.get_village(target_village.id)
         if not village:
             logger.error(f"Failed to find village {target_village.id} for resource deposit")
             return {"wood": 0, "stone": 0, "iron": 0, "food": 0}
+        
+        # A retry of an action whose village write went through: only empty the backpack
+        applied = village.get_applied_transfer(uow.operation_id) if uow.operation_id else None
+        if applied is not None:
+            uow.update_troop(troop.id, {"backpack": {"wood": 0, "stone": 0, "iron": 0, "food": 0}})
+            logger.info(f"[RESOURCE_DEBUG] Deposit already made in village {village.id}: {applied}")
+            return {"wood": 0, "stone": 0, "iron": 0, "food": 0, **applied}
             
         # Calculate available space for each resource
         deposited = {"wood": 0, "stone": 0, "iron": 0, "food": 0}
@@ -1355,22 +1401,22 @@ class TroopActionService:
                         lost_amount = amount_to_deposit - actual_deposit
                         logger.info(f"[RESOURCE_DEBUG] {lost_amount} {resource_type} was lost because village storage is full")
         
-        # Mark village as changed and save it
-        village.mark_as_changed()
-        try:
-            saved = await self.village_repository.save(village)
-            if saved:
-                logger.info(f"[RESOURCE_DEBUG] Successfully saved village {village.id} after resource deposit")
-            else:
-                logger.error(f"Failed to save village {village.id} after resource deposit")
-        except Exception as e:
-            logger.error(f"Error saving village {village.id} after resource deposit: {str(e)}")
+        # Mark village resources as changed, the unit of work saves it
+        village.mark_as_changed("resources")
+        if uow.operation_id:
+            village.record_transfer(uow.operation_id, deposited)
         
         # Update the troop's backpack with zero values for all resources
-        await self.troops_repository.update(troop.id, {"backpack": new_backpack})
+        uow.update_troop(troop.id, {"backpack": new_backpack})
         
         logger.info(f"[RESOURCE_DEBUG] Deposited resources: {deposited}")
         logger.info(f"[RESOURCE_DEBUG] Village resources after deposit: wood={getattr(village.resources, 'wood', 0)} stone={getattr(village.resources, 'stone', 0)} iron={getattr(village.resources, 'iron', 0)} food={getattr(village.resources, 'food', 0)}")
         logger.info(f"[RESOURCE_DEBUG] Troop's new backpack: {new_backpack}")
         
-        return deposited 
\ No newline at end of file
+        return deposited 
+
+# Handler of the durable task kind; a fresh service per task, like the API endpoints use
+async def _complete_troop_action(**payload) -> Dict[str, Any]:
+    return await TroopActionService().complete_troop_action(**payload)
+
+task_scheduler.register_kind(TROOP_ACTION_TASK_KIND, _complete_troop_action)
@@ -0,0 +1,39 @@
+"""
+Shared fixtures. The suite runs on the in-memory database backend, so it needs
+no MongoDB server: DATABASE_BACKEND is forced to memory before the package is
+imported.
+"""
+
+import os
+
+os.environ["DATABASE_BACKEND"] = "memory"
+os.environ.setdefault("DATABASE_NAME", "minute_empire_test")
+
+import pytest
+
+from minute_empire.db.mongodb import connect_to_mongo, close_mongo_connection
+from minute_empire.repositories.village_cache import village_cache
+from minute_empire.repositories.village_repository import VillageRepository
+from minute_empire.services.registration_service import RegistrationService
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+@pytest.fixture
+async def db():
+    """A fresh, empty in-memory database (and village cache) for each test"""
+    await close_mongo_connection()
+    await connect_to_mongo()
+    village_cache.clear()
+    yield
+    await close_mongo_connection()
+    village_cache.clear()
+
+@pytest.fixture
+async def village(db):
+    """The village of a newly registered player"""
+    result = await RegistrationService().register_user_and_village(
+        "player1", "password123", "Family", "#ff0000", "Village1"
+    )
+    return await VillageRepository().get_by_id(result["village_id"])
@@ -0,0 +1,95 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from minute_empire.db.mongodb import get_db
+from minute_empire.repositories.concurrency import ConcurrentModificationError
+from minute_empire.repositories.task_history_repository import TaskHistoryRepository
+from minute_empire.repositories.troops_repository import TroopsRepository
+from minute_empire.repositories.unit_of_work import UnitOfWork
+from minute_empire.repositories.village_repository import VillageRepository
+from minute_empire.schemas.schemas import TaskType
+from minute_empire.services.timed_tasks_service import TimedConstructionService
+
+pytestmark = pytest.mark.anyio
+
+async def create_troop(troop_id: str, village) -> None:
+    now = datetime.utcnow()
+    await TroopsRepository().create({
+        "_id": troop_id, "type": "militia", "quantity": 10, "home_id": village.id,
+        "location": village.location, "mode": "idle", "created_at": now, "updated_at": now
+    })
+
+async def test_partial_save_sets_one_task_through_array_filters(village):
+    repository = VillageRepository()
+    first = village.add_construction_task(TaskType.CREATE_FIELD, "wood", 2, 5)
+    second = village.add_construction_task(TaskType.CREATE_FIELD, "stone", 3, 5)
+    await repository.save(village)
+
+    village = await repository.get_by_id(village.id)
+    task = next(t for t in village._data.construction_tasks if t.id == first.id)
+    task.processed = True
+    village.mark_task_changed(task)
+
+    update, array_filters = village.get_pending_update()
+    assert list(update["$set"]) == ["construction_tasks.$[e0]", "updated_at"]
+    assert array_filters == [{"e0.id": first.id}]
+
+    version = village.version
+    await repository.save(village)
+
+    async with get_db() as db:
+        document = await db[VillageRepository.COLLECTION].find_one({"_id": village.id})
+    processed = {task["id"]: task["processed"] for task in document["construction_tasks"]}
+    assert processed == {first.id: True, second.id: False}
+    assert document["version"] == version + 1
+
+async def test_saving_a_stale_village_raises_a_conflict(village):
+    repository = VillageRepository()
+    stale = await repository.get_by_id(village.id)
+
+    village.add_construction_task(TaskType.CREATE_FIELD, "wood", 2, 5)
+    await repository.save(village)
+
+    stale.add_construction_task(TaskType.CREATE_FIELD, "iron", 2, 5)
+    with pytest.raises(ConcurrentModificationError):
+        await repository.save(stale)
+
+    reloaded = await repository.get_by_id(village.id)
+    assert [task.target_type for task in reloaded._data.construction_tasks] == ["wood"]
+
+async def test_unit_of_work_conflicts_on_a_troop_written_since_it_was_loaded(village):
+    troops = TroopsRepository()
+    await create_troop("troop-1", village)
+    loaded = await troops.get_by_id("troop-1")
+    await troops.update("troop-1", {"quantity": 12}, version=loaded.version)
+
+    uow = UnitOfWork()
+    tracked = await uow.get_village(village.id)
+    tracked.deduct_resources({"wood": 1})
+    uow.delete_troop("troop-1", version=loaded.version)
+    with pytest.raises(ConcurrentModificationError):
+        await uow.commit()
+
+    # Nothing was written: the troop survives and the village keeps its resources
+    assert (await troops.get_by_id("troop-1")).quantity == 12
+    assert (await VillageRepository().get_by_id(village.id)).version == village.version
+
+async def test_completing_due_tasks_archives_them_out_of_the_village(village):
+    repository = VillageRepository()
+    service = TimedConstructionService()
+    task = village.add_construction_task(TaskType.CREATE_FIELD, "wood", 2, 0)
+    await repository.save(village)
+
+    result = await service.complete_village_tasks_until(village.id, datetime.utcnow() + timedelta(seconds=1))
+    assert result["success"]
+    assert [t.id for t in result["construction_tasks"]] == [task.id]
+
+    village = await repository.get_by_id(village.id)
+    assert village.get_resource_field(2) is not None
+    assert village._data.construction_tasks == []
+    assert await TaskHistoryRepository().exists(task.id)
+
+    # Completing it again finds it in the history
+    again = await service.complete_construction_task(village.id, task.id, task.completion_time)
+    assert again == {"success": True, "task_id": task.id, "already_completed": True}
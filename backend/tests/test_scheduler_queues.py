@@ -0,0 +1,48 @@
+import random
+import time
+
+from minute_empire.services.scheduler_queues import HeapTaskQueue, TimingWheelTaskQueue
+
+def make_entry(task_id: str, sequence: int, deadline: float) -> tuple:
+    """A scheduler entry whose timestamp orders it like its monotonic deadline"""
+    return (deadline + 1_000_000, sequence, task_id, None, deadline, 0.0, None, (), {}, None)
+
+def test_timing_wheel_pops_in_the_same_order_as_the_heap():
+    rng = random.Random(7)
+    heap, wheel = HeapTaskQueue(), TimingWheelTaskQueue(resolution=0.01)
+    now = time.monotonic()
+    live = set()
+    sequence = 0
+
+    def push(deadline: float) -> None:
+        nonlocal sequence
+        entry = make_entry(f"task-{sequence}", sequence, deadline)
+        heap.push(entry)
+        wheel.push(entry)
+        live.add(entry[2])
+        sequence += 1
+
+    # Overdue, sub-second, minutes away and days away: every level of the wheel
+    for _ in range(2000):
+        push(now + rng.choice([-rng.uniform(0, 5), rng.uniform(0, 1), rng.uniform(0, 600), rng.uniform(0, 3 * 86400)]))
+
+    heap_order, wheel_order = [], []
+    while live:
+        # Cancel and reschedule a few tasks as time goes by
+        for task_id in rng.sample(sorted(live), min(3, len(live))):
+            assert heap.remove(task_id) is wheel.remove(task_id)
+            live.discard(task_id)
+            push(now + rng.uniform(0, 900))
+        assert heap.peek() is wheel.peek()
+
+        now += rng.choice([0.003, 0.05, 1.0, 37.0, 3600.0])
+        popped = wheel.pop_due(now)
+        assert all(entry[4] <= now for entry in popped)
+        wheel_order.extend(entry[2] for entry in popped)
+        # The wheel releases a task up to one tick after it is due
+        heap_order.extend(entry[2] for entry in heap.pop_due(now - 0.01))
+        live.difference_update(entry[2] for entry in popped)
+
+    heap_order.extend(entry[2] for entry in heap.pop_due(now))
+    assert wheel_order == heap_order
+    assert len(heap) == len(wheel) == 0
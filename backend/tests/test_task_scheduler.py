@@ -0,0 +1,199 @@
+import asyncio
+from datetime import datetime, timedelta
+
+import pytest
+
+from minute_empire.services import task_scheduler as task_scheduler_module
+from minute_empire.services.task_scheduler import TaskScheduler
+
+pytestmark = pytest.mark.anyio
+
+async def wait_until(predicate, timeout: float = 3.0) -> None:
+    """Poll until predicate() is true, failing after timeout seconds"""
+    async with asyncio.timeout(timeout):
+        while not predicate():
+            await asyncio.sleep(0.01)
+
+@pytest.fixture
+async def scheduler(db):
+    scheduler = TaskScheduler(durable=True, max_workers=4, coalesce_ms=0)
+    yield scheduler
+    await scheduler.stop()
+
+async def test_tasks_with_the_same_serial_key_never_overlap(scheduler):
+    running = {}
+    peak = {}
+    order = []
+    overlap = []
+
+    async def work(key: str, index: int) -> None:
+        running[key] = running.get(key, 0) + 1
+        peak[key] = max(peak.get(key, 0), running[key])
+        overlap.append(sum(running.values()))
+        order.append((key, index))
+        await asyncio.sleep(0.02)
+        running[key] -= 1
+
+    scheduler.register_kind("work", work)
+    due = datetime.utcnow() + timedelta(milliseconds=50)
+    for index in range(6):
+        for key in ("village:a", "village:b"):
+            await scheduler.schedule(f"{key}-{index}", "work", due + timedelta(milliseconds=index),
+                                     serial_key=key, key=key, index=index)
+    scheduler.start()
+
+    await wait_until(lambda: len(order) == 12 and not any(running.values()))
+    assert peak == {"village:a": 1, "village:b": 1}
+    # Each key ran in due order, and the two keys ran side by side
+    for key in ("village:a", "village:b"):
+        assert [index for k, index in order if k == key] == list(range(6))
+    assert max(overlap) == 2
+
+async def test_a_task_moved_while_running_stays_queued(scheduler):
+    started = asyncio.Event()
+    release = asyncio.Event()
+    runs = []
+
+    async def slow(label: str) -> None:
+        runs.append(label)
+        started.set()
+        await release.wait()
+
+    scheduler.register_kind("slow", slow)
+    await scheduler.schedule("task-1", "slow", datetime.utcnow(), label="first")
+    scheduler.start()
+    await wait_until(started.is_set)
+
+    moved_to = (datetime.utcnow() + timedelta(hours=1)).replace(microsecond=0)
+    await scheduler.schedule("task-1", "slow", moved_to, label="moved")
+    release.set()
+    await wait_until(lambda: scheduler.metrics.executed()["count"] == 1)
+
+    page = await scheduler.repository.get_due_page(datetime.max)
+    assert [(task["_id"], task["due_at"], task["payload"]) for task in page] == [
+        ("task-1", moved_to, {"label": "moved"})
+    ]
+    assert runs == ["first"]
+
+async def test_co_due_tasks_of_a_village_run_as_one_batch(db):
+    scheduler = TaskScheduler(durable=True, max_workers=4, coalesce_ms=100)
+    batches = []
+    single = []
+
+    async def handler(**payload) -> None:
+        single.append(payload)
+
+    async def batch_handler(payloads) -> None:
+        batches.append(payloads)
+
+    scheduler.register_kind("build", handler, batch_handler=batch_handler)
+    scheduler.register_kind("train", handler, batch_handler=batch_handler)
+    try:
+        due = datetime.utcnow() + timedelta(milliseconds=50)
+        for index, kind in enumerate(("build", "build", "train")):
+            await scheduler.schedule(f"task-{index}", kind, due + timedelta(milliseconds=10 * index),
+                                     serial_key="village:a", index=index)
+        # Another village is batched separately
+        await scheduler.schedule("other", "build", due, serial_key="village:b", index=9)
+        deleted = []
+        delete_many = scheduler.repository.delete_many
+
+        async def record_delete_many(tasks):
+            deleted.append(sorted(task_id for task_id, _ in tasks))
+            return await delete_many(tasks)
+
+        scheduler.repository.delete_many = record_delete_many
+        scheduler.start()
+
+        await wait_until(lambda: scheduler.metrics.executed()["count"] == 4)
+        assert batches == [[{"index": 0}, {"index": 1}, {"index": 2}]]
+        assert single == [{"index": 9}]
+        assert deleted == [["task-0", "task-1", "task-2"]]
+        assert await scheduler.repository.count() == 0
+    finally:
+        await scheduler.stop()
+
+async def test_a_failed_task_is_retried_until_it_succeeds(db):
+    scheduler = TaskScheduler(durable=True, max_workers=4, coalesce_ms=0, max_attempts=5, retry_backoff_ms=20)
+    runs = []
+
+    async def flaky(label: str) -> dict:
+        runs.append(label)
+        if len(runs) == 1:
+            raise RuntimeError("database unavailable")
+        if len(runs) == 2:
+            return {"success": False, "error": "Village not found"}
+        return {"success": True}
+
+    scheduler.register_kind("flaky", flaky)
+    try:
+        await scheduler.schedule("task-1", "flaky", datetime.utcnow(), label="only")
+        scheduler.start()
+
+        await wait_until(lambda: scheduler.metrics.completed.get("flaky") == 1)
+        assert runs == ["only", "only", "only"]
+        assert scheduler.metrics.failed == {"flaky": 2}
+        assert scheduler.retries == 2
+        assert await scheduler.repository.count() == 0
+    finally:
+        await scheduler.stop()
+
+async def test_a_task_that_keeps_failing_stays_in_the_queue(db):
+    scheduler = TaskScheduler(durable=True, max_workers=4, coalesce_ms=0, max_attempts=3, retry_backoff_ms=10)
+    runs = []
+
+    async def reports_failure(label: str) -> dict:
+        runs.append(label)
+        return {"success": False, "error": "Troop not found"}
+
+    async def raises(label: str) -> None:
+        runs.append(label)
+        raise RuntimeError("database unavailable")
+
+    scheduler.register_kind("reports_failure", reports_failure)
+    scheduler.register_kind("raises", raises)
+    try:
+        due = datetime.utcnow()
+        await scheduler.schedule("task-1", "reports_failure", due, label="reported")
+        await scheduler.schedule("task-2", "raises", due, label="raised")
+        scheduler.start()
+
+        await wait_until(lambda: sum(scheduler.metrics.failed.values()) == 6)
+        await asyncio.sleep(0.1)
+        # Three runs each, then no more retries
+        assert sorted(runs) == ["raised"] * 3 + ["reported"] * 3
+        assert scheduler.get_pending_task_count() == 0
+        page = await scheduler.repository.get_due_page(datetime.max)
+        assert sorted(task["_id"] for task in page) == ["task-1", "task-2"]
+    finally:
+        await scheduler.stop()
+
+async def test_a_restart_without_rescan_pages_in_the_queue_left_behind(db, monkeypatch):
+    monkeypatch.setattr(task_scheduler_module, "SCHEDULER_PAGE_SIZE", 2)
+    runs = []
+
+    async def work(index: int) -> None:
+        runs.append(index)
+
+    previous = TaskScheduler(durable=True)
+    previous.register_kind("work", work)
+    now = datetime.utcnow()
+    # Left behind by the previous process: overdue tasks, one due soon and one past the window
+    for index in range(5):
+        await previous.schedule(f"overdue-{index}", "work", now - timedelta(minutes=5 - index), index=index)
+    await previous.schedule("soon", "work", now + timedelta(milliseconds=100), index=5)
+    await previous.schedule("later", "work", now + timedelta(hours=1), index=6)
+
+    scheduler = TaskScheduler(durable=True, max_workers=1, coalesce_ms=0)
+    scheduler.register_kind("work", work)
+    try:
+        scheduler.start()
+        await wait_until(lambda: len(runs) == 6)
+        assert runs == [0, 1, 2, 3, 4, 5]
+        # Three full pages of two, then a short one that closes the window
+        assert scheduler.pages_loaded >= 4
+        page = await scheduler.repository.get_due_page(datetime.max)
+        assert [task["_id"] for task in page] == ["later"]
+        assert scheduler.get_pending_task_count() == 0
+    finally:
+        await scheduler.stop()
@@ -0,0 +1,58 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from minute_empire.repositories.troop_action_repository import TroopActionRepository
+from minute_empire.repositories.troops_repository import TroopsRepository
+from minute_empire.repositories.unit_of_work import UnitOfWork
+from minute_empire.repositories.village_repository import VillageRepository
+from minute_empire.services.registration_service import RegistrationService
+from minute_empire.services.timed_tasks_service import TimedConstructionService
+from minute_empire.services.troop_action_service import TroopActionService
+
+pytestmark = pytest.mark.anyio
+
+RESOURCES = ("wood", "stone", "iron", "food")
+
+async def test_a_raid_retried_after_a_troop_conflict_steals_once(village, monkeypatch):
+    registered = await RegistrationService().register_user_and_village(
+        "player2", "password123", "Rivals", "#0000ff", "Village2"
+    )
+    target = await VillageRepository().get_by_id(registered["village_id"])
+    now = datetime.utcnow()
+    await TroopsRepository().create({
+        "_id": "raider", "type": "militia", "quantity": 10, "home_id": village.id,
+        "location": village.location, "mode": "move", "created_at": now, "updated_at": now
+    })
+    completion_time = now + timedelta(seconds=1)
+    action = await TroopActionRepository().create({
+        "troop_id": "raider", "action_type": "move",
+        "start_location": village.location, "target_location": target.location,
+        "started_at": now, "completion_time": completion_time, "processed": False
+    })
+    # The resources the target has when the raid lands, before anything is stolen
+    await TimedConstructionService().update_resources_until(target.id, completion_time)
+    before = (await VillageRepository().get_by_id(target.id)).resources.dict()
+
+    # Another writer changes the troop after its version check, so the villages are
+    # written and the troop write conflicts, once
+    check_troop_versions = UnitOfWork._check_troop_versions
+    commits = []
+
+    async def racing_check(uow, db):
+        await check_troop_versions(uow, db)
+        commits.append(uow.operation_id)
+        if len(commits) == 1:
+            await TroopsRepository().update("raider", {"mode": "move"})
+
+    monkeypatch.setattr(UnitOfWork, "_check_troop_versions", racing_check)
+    result = await TroopActionService().complete_troop_action(action.id, completion_time)
+
+    assert result["success"]
+    assert commits == [action.id, action.id]
+    after = (await VillageRepository().get_by_id(target.id)).resources.dict()
+    backpack = (await TroopsRepository().get_by_id("raider")).backpack.dict()
+    assert sum(backpack.values()) > 0
+    for resource in RESOURCES:
+        assert after[resource] + backpack[resource] == pytest.approx(before[resource])
+    assert (await TroopActionRepository().get_by_id(action.id)).processed